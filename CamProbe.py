@@ -0,0 +1,101 @@
+import itertools
+import time
+import numpy as np
+from datetime import datetime
+from CaptureBackends import DeviceCapture, save_profile
+from UserParams import params
+
+# Tries every combination of the modes below on each camera, measures the frame rate it actually achieves and how
+# steady it is, then saves the fastest steady mode for CamRead to use at startup. Only the resolution set in UserParams
+# is tried by default: add others to let the probe trade resolution for frame rate.
+cameras = range(params['*participants'])
+resolutions = [params['*resolution']]
+frame_rates = sorted({params['*fps'], 60, 30}, reverse=True)
+fourccs = ['MJPG', 'YUY2', None]    # None leaves the format up to the driver
+warm_up_time = 1    # Seconds to read frames for before measuring, while the camera settles (e.g. auto-exposure)
+probe_time = 3  # Seconds to measure each mode for
+min_rate = 0.95     # A mode is only steady if it achieves at least this proportion of its frame rate...
+max_jitter = 4  # ...and the time between frames varies by no more than this many ms (standard deviation)
+
+
+def probe_mode(source, width, height, fps, fourcc):
+    """Opens a camera in a mode, returning the mode it actually gave us and how well it kept up in it"""
+    cam = DeviceCapture(source, api=params['*capture backend'], decode_threads=params['*capture decode threads'])
+    if not cam.cam.isOpened():
+        cam.release()
+        return None, None
+    try:
+        mode = cam.configure(fps=fps, width=width, height=height, fourcc=fourcc)
+        slot = np.empty((mode['height'], mode['width'], 3), dtype=np.uint8)
+        end = time.perf_counter() + warm_up_time
+        while time.perf_counter() < end:
+            if cam.read(slot) is None:
+                return mode, None
+        times = []
+        end = time.perf_counter() + probe_time
+        while time.perf_counter() < end:
+            timestamp = cam.read(slot)
+            if timestamp is not None:
+                times.append(timestamp)
+    finally:
+        cam.release()
+    if len(times) < 2:
+        return mode, None
+    intervals = np.diff(times) * 1000
+    return mode, {'achieved fps': round(1000 / intervals.mean(), 2), 'jitter': round(float(intervals.std()), 2)}
+
+
+def probe_camera(source):
+    results = {}
+    for res, fps, fourcc in itertools.product(resolutions, frame_rates, fourccs):
+        width, height = (int(i) for i in res.split('x'))
+        mode, measured = probe_mode(source, width, height, fps, fourcc)
+        if mode is None:
+            print(f'Cam {source + 1}: could not be opened')
+            break
+        # Drivers often give us a different mode to the one we asked for: there's no need to measure it twice
+        key = (mode['width'], mode['height'], mode['fps'], mode['fourcc'])
+        if key in results:
+            continue
+        if measured is None:
+            print(f'Cam {source + 1}: could not read frames as {res} at {fps} fps ({fourcc or "default format"})')
+            continue
+        steady = measured['achieved fps'] >= min_rate * mode['fps'] and measured['jitter'] <= max_jitter
+        print(f'Cam {source + 1}: asked for {res} at {fps} fps ({fourcc or "default format"}), got '
+              f'{mode["width"]}x{mode["height"]} at {mode["fps"]} fps ({mode["fourcc"] or "default format"}): '
+              f'achieved {measured["achieved fps"]} fps, jitter {measured["jitter"]} ms '
+              f'({"steady" if steady else "unsteady"})')
+        results[key] = {**mode, **measured, 'steady': steady}
+    return list(results.values())
+
+
+def best_profile(results):
+    # Pick the fastest steady mode, then the largest, then the steadiest
+    steady = [r for r in results if r['steady']]
+    if not steady:
+        return None
+    best = max(steady, key=lambda r: (round(r['achieved fps']), r['width'] * r['height'], -r['jitter']))
+    return {
+        'width': best['width'],
+        'height': best['height'],
+        'fps': best['fps'],
+        'fourcc': best['fourcc'] or None,
+        'achieved fps': best['achieved fps'],
+        'jitter': best['jitter'],
+        'probed': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+if __name__ == '__main__':
+    if params['*capture backend'] in ['file', 'synthetic']:
+        raise SystemExit(f'Nothing to probe: capture backend is set to {params["*capture backend"]}')
+    if params['*camera profiles'] is None:
+        raise SystemExit('Nowhere to save profiles: set *camera profiles in UserParams')
+    for cam_num in cameras:
+        profile = best_profile(probe_camera(cam_num))
+        if profile is None:
+            print(f'Cam {cam_num + 1}: no steady mode found, so no profile saved')
+            continue
+        save_profile(params['*camera profiles'], params['*capture backend'], cam_num, profile)
+        print(f'Cam {cam_num + 1}: saved {profile["width"]}x{profile["height"]} at {profile["fps"]} fps '
+              f'({profile["fourcc"] or "default format"}) to {params["*camera profiles"]}')
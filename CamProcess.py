@@ -0,0 +1,183 @@
+import threading
+import multiprocessing as mp
+from queue import Empty
+from CamThread import CamThread, CamWrite
+from FrameRing import FrameRing
+from CaptureSync import CaptureCoordinator
+from DelayTimeline import DelayTimeline
+
+# Only parameters of these types are mirrored to the camera processes: anything else (e.g. frames) stays local
+MIRRORED_TYPES = (bool, int, float, str, type(None), DelayTimeline)
+# Parameters set by a camera process that should be passed back to KeyThread
+RETURNED_PARAMS = ['*fps', '*resolution']
+
+
+class MirroredParams(dict):
+    """A params dictionary that forwards every change made by KeyThread and the GUI on to the camera processes"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queues = []
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if isinstance(value, MIRRORED_TYPES):
+            for q in self.queues:
+                q.put((key, value))
+
+
+class CamProcess:
+    """Runs the CamThread pipeline for one camera in its own process, standing in for the CamThread in KeyThread"""
+    def __init__(self, source: int, stop_event, global_barrier, params: MirroredParams,
+                 coordinator: CaptureCoordinator = None):
+        self.source = source
+        self.params = params
+        self.stop_event = stop_event
+        # The coordinator lives in this process: it can match frames for consumers here, but not for the views or
+        # recorders in the camera process. Their recordings aren't synced, so must be lined up afterwards using the
+        # capture time of every frame, saved in the .frames index written alongside each recording.
+        self.coordinator = coordinator
+        if params['*sync cameras'] and source == 0:
+            print('Cameras are not synced when each runs in its own process: line recordings up using their .frames')
+
+        # Changes to params are sent to the process on one queue, and results and stats come back on the other
+        self.control_queue = mp.Queue()
+        self.result_queue = mp.Queue()
+        self.params.queues.append(self.control_queue)
+        self.stats = {'delivery': {}, 'delay': None, 'detect': None, 'display': None, 'record': {}, 'capture': None}
+        # The process' frame ring, which we attach to once it's been created in the process
+        self.frame_ring = None
+
+        # Recording by capturing the camera windows doesn't care which process they were created in, but any other
+        # recorder is given its frames inside the camera process, so we pass recording commands on to it there
+        if params['*recorder'] == 'gdigrab':
+            self.cam_write = CamWrite(source=self.source, windowname='Rec')
+            self.performer_cam_write = CamWrite(source=self.source, windowname='View')
+        else:
+            self.cam_write = RemoteCamWrite(name='cam_write', control_queue=self.control_queue)
+            self.performer_cam_write = RemoteCamWrite(name='performer_cam_write', control_queue=self.control_queue)
+
+        # Start the process, with a copy of the current params, and listen for anything it sends back
+        self.process = mp.Process(
+            target=run_cam_process,
+            args=(self.source, stop_event, global_barrier, dict(params), self.control_queue, self.result_queue)
+        )
+        self.process.start()
+        threading.Thread(target=self.receive_results, daemon=True).start()
+
+    def receive_results(self):
+        # Carry on after we've been stopped until the process has told us about every recording it was finishing
+        while not self.stop_event.is_set() or (self.recording_unfinished() and self.process.is_alive()):
+            try:
+                kind, result = self.result_queue.get(timeout=1)
+            except Empty:
+                continue
+            match kind:
+                case 'params':
+                    # Set these without sending them straight back to the process again
+                    for k, v in result.items():
+                        dict.__setitem__(self.params, k, v)
+                case 'ring':
+                    self.frame_ring = FrameRing.attach(result)
+                    if self.coordinator is not None:
+                        self.coordinator.register(source=self.source, ring=self.frame_ring)
+                case 'stats':
+                    self.stats = result
+                case 'stopped':
+                    recorder, stream = result
+                    getattr(self, recorder).stream.update(stream or {})
+                    getattr(self, recorder).finished.set()
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+
+    def recording_unfinished(self) -> bool:
+        return not (self.cam_write.finished.is_set() and self.performer_cam_write.finished.is_set())
+
+    def delivery_stats(self) -> dict:
+        return self.stats['delivery']
+
+    def delay_stats(self) -> dict | None:
+        return self.stats['delay']
+
+    def detect_stats(self) -> dict | None:
+        return self.stats['detect']
+
+    def display_stats(self) -> dict | None:
+        return self.stats['display']
+
+    def record_stats(self) -> dict:
+        return self.stats['record']
+
+    def capture_stats(self) -> dict | None:
+        return self.stats['capture']
+
+    def sync_stats(self) -> dict | None:
+        return self.coordinator.stats() if self.coordinator is not None else None
+
+
+class RemoteCamWrite:
+    """Stands in for a CamWrite running in a camera process, passing recording commands on to it"""
+    def __init__(self, name: str, control_queue):
+        self.name = name
+        self.ext = 'Rec' if name == 'cam_write' else 'View'
+        self.control_queue = control_queue
+        # Set by CamProcess once the camera process has finished writing the recording, along with its details
+        self.finished = threading.Event()
+        self.finished.set()
+        self.stream = {}
+
+    def start_recording(self, start_time, res='1920x1080', start_at: float = None):
+        # time.perf_counter is shared between processes, so start_at means the same thing in the camera process
+        self.control_queue.put(((self.name, 'start_recording'), (start_time, res, start_at)))
+
+    def stop_recording(self) -> dict:
+        """Stops recording without waiting: the details of the recording are filled in once finished is set"""
+        self.finished.clear()
+        self.stream = {}
+        self.control_queue.put(((self.name, 'stop_recording'), ()))
+        return self.stream
+
+
+def run_cam_process(source: int, stop_event, global_barrier, params: dict, control_queue, result_queue):
+    """Entry point of each camera process: runs a CamThread and keeps its params in sync with KeyThread"""
+    # The CamThread creates its own DisplayThread, as windows have to be shown from the process that created them
+    cam = CamThread(source=source, stop_event=stop_event, global_barrier=global_barrier, params=params,
+                    shared_frames=True)
+    # Let KeyThread know what the camera was actually configured to, and where it can find the frames
+    result_queue.put(('params', {k: params[k] for k in RETURNED_PARAMS}))
+    result_queue.put(('ring', cam.cam_read.frame_ring.shared_spec()))
+    # Apply every change to params made by KeyThread and the GUI in the main process, and any recording commands
+    threading.Thread(target=apply_params, args=(params, control_queue, stop_event, cam, result_queue),
+                     daemon=True).start()
+    # Report stats back to the main process until we're told to stop
+    while not stop_event.wait(timeout=1):
+        result_queue.put(('stats', {'delivery': cam.delivery_stats(), 'delay': cam.delay_stats(),
+                                    'detect': cam.detect_stats(), 'display': cam.display_stats(),
+                                    'record': cam.record_stats(), 'capture': cam.capture_stats()}))
+    # Wait for all our threads to finish before freeing the shared memory they use
+    for thread in cam.threads:
+        thread.join()
+    cam.cam_read.frame_ring.close()
+
+
+def apply_params(params: dict, control_queue, stop_event, cam: CamThread, result_queue):
+    while not stop_event.is_set():
+        try:
+            key, value = control_queue.get(timeout=1)
+        except Empty:
+            continue
+        # Recording commands are sent as (recorder, method) keys, and run in their own thread as they can take a while
+        # Stopping isn't a daemon, so the process stays alive until it's reported that the recording is finished
+        if isinstance(key, tuple):
+            threading.Thread(target=run_command, args=(cam, key, value, result_queue),
+                             daemon=key[1] != 'stop_recording').start()
+        else:
+            params[key] = value
+
+
+def run_command(cam: CamThread, key: tuple, args: tuple, result_queue):
+    recorder, method = key
+    result = getattr(getattr(cam, recorder), method)(*args)
+    if method == 'stop_recording':
+        # Only report back once the recording has been completely written
+        getattr(cam, recorder).finished.wait()
+        result_queue.put(('stopped', (recorder, result)))
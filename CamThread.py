@@ -1,83 +1,160 @@
 import threading
 import ffmpeg
+import os
+import glob
 import time
 import sys
 import numpy as np
 from cv2 import cv2
-from queue import Queue, Empty
 from collections import deque
+from datetime import datetime
+from FrameRing import FrameRing, FrameCursor, RecordQueue
+from FrameIndex import FrameIndex, FrameIndexWriter
+from DelayBuffer import DelayBuffer, LoopBuffer
+from CaptureSync import CaptureCoordinator
+from DetectThread import DetectThread
+from RegionDetectors import get_detector
+from ManipChain import ManipChain
+from DisplayThread import DisplayThread
+from CaptureBackends import open_capture, load_profile
 
 
-# TODO: investigate using PyTest here!
+# Recorders write to temporary files until they know the real filename. These are named after this run of the program,
+# so they never overwrite (or get deleted along with) any left behind by an earlier run that crashed.
+RUN_ID = f'{datetime.now():%Y-%m-%d_%H-%M-%S}_{os.getpid()}'
 
 
 class CamThread:
-    def __init__(self, source: int, stop_event: threading.Event, global_barrier: threading.Barrier, params: dict):
+    def __init__(self, source: int, stop_event: threading.Event, global_barrier: threading.Barrier, params: dict,
+                 shared_frames: bool = False, coordinator: CaptureCoordinator = None, display: DisplayThread = None):
         self.source = source
         self.params = params
+        # Used to line up frames from this camera with those from all the other cameras
+        self.coordinator = coordinator
+        # Shows the windows for every camera: if we haven't been given one to share, we show our own windows
+        self.display = display if display is not None else DisplayThread(params=params, stop_event=stop_event)
 
         # Initialise flow control
         self.global_barrier = global_barrier
         self.stop_event = stop_event
 
-        # Initialise queues
+        # Number of frame slots in the ring shared between CamRead and the views
         self.queue_length = 64  # This can be changed to save memory if required
-        self.researcher_cam_queue = Queue(maxsize=self.queue_length)
-        self.performer_cam_queue = Queue(maxsize=self.queue_length)
 
         # Initialise child classes - needs to be done in __init__ so they can be called in KeyThread
-        self.cam_read = CamRead(source=self.source, perfor_q=self.performer_cam_queue,
-                                resear_q=self.researcher_cam_queue, params=self.params)
-        self.researcher_cam_view = ResearcherCamView(source=self.source, queue=self.researcher_cam_queue,
-                                                     params=self.params)
-        self.performer_cam_view = PerformerCamView(source=self.source, queue=self.performer_cam_queue,
-                                                   params=self.params)
-        self.cam_write = CamWrite(source=self.source, windowname='Rec')
-        self.performer_cam_write = CamWrite(source=self.source, windowname='View')
+        # Recorders are given frames by CamRead (exactly as captured) and the performer view (exactly as shown)
+        self.cam_write = CamWrite(source=self.source, windowname='Rec', params=self.params)
+        self.performer_cam_write = CamWrite(source=self.source, windowname='View', params=self.params)
+        # When syncing cameras, the researcher's recording is made from the frames matched across every camera (as
+        # shown in the researcher view), rather than straight from the camera, so every recording stays lined up
+        sync_recording = self.coordinator is not None and self.params['*sync cameras']
+        self.cam_read = CamRead(source=self.source, params=self.params, queue_length=self.queue_length,
+                                shared=shared_frames, recorder=None if sync_recording else self.cam_write)
+        if self.coordinator is not None:
+            self.coordinator.register(source=self.source, ring=self.cam_read.frame_ring)
+        # Each view holds its own cursor over the same ring of frames written by CamRead
+        self.researcher_cam_view = ResearcherCamView(source=self.source, cursor=self.get_cursor('researcher'),
+                                                     params=self.params, display=self.display,
+                                                     coordinator=self.coordinator,
+                                                     recorder=self.cam_write if sync_recording else None)
+        self.performer_cam_view = PerformerCamView(source=self.source, cursor=self.get_cursor('performer'),
+                                                   params=self.params, display=self.display,
+                                                   recorder=self.performer_cam_write, coordinator=self.coordinator)
 
         # Start threads
         classes = [self.cam_read, self.researcher_cam_view, self.performer_cam_view]
         args = (self.global_barrier, self.stop_event)
-        _ = [threading.Thread(target=cl.start_cam, args=args).start() for cl in classes]
+        self.threads = [threading.Thread(target=cl.start_cam, args=args) for cl in classes]
+        _ = [t.start() for t in self.threads]
+
+    def get_cursor(self, consumer: str) -> FrameCursor:
+        """Creates a cursor on the frame ring for a consumer, using the delivery policy set for it in UserParams"""
+        policy, maxlen = self.params['*frame delivery'][consumer]
+        return self.cam_read.frame_ring.cursor(name=consumer, policy=policy, maxlen=maxlen)
+
+    def delivery_stats(self) -> dict:
+        """Returns the number of frames delivered, dropped, and currently lagging for each view"""
+        return {view.cursor.name: view.cursor.stats() for view in [self.researcher_cam_view, self.performer_cam_view]}
+
+    def delay_stats(self) -> dict | None:
+        return self.performer_cam_view.delay_stats()
+
+    def sync_stats(self) -> dict | None:
+        return self.coordinator.stats() if self.coordinator is not None else None
+
+    def detect_stats(self) -> dict | None:
+        return self.performer_cam_view.detect_thread.stats()
+
+    def display_stats(self) -> dict:
+        return self.display.stats(names=[self.researcher_cam_view.name, self.performer_cam_view.name])
+
+    def capture_stats(self) -> dict:
+        return self.cam_read.mode
+
+    def record_stats(self) -> dict:
+        return {cam.ext: s for cam in [self.cam_write, self.performer_cam_write] if (s := cam.stats()) is not None}
 
 
 class CamRead:
-    def __init__(self, source, params, resear_q, perfor_q):
+    def __init__(self, source, params, queue_length, shared=False, recorder=None):
         self.source = source
-        self.cam = cv2.VideoCapture(self.source, cv2.CAP_DSHOW)
-        self.researcher_cam_queue = resear_q
-        self.performer_cam_queue = perfor_q
+        self.recorder = recorder
         self.params = params
-        self.config_cam()
+        # The camera (or file, or test pattern) we read frames from, opened using the backend set in UserParams
+        self.cam = open_capture(self.source, self.params)
+        self.mode = self.config_cam()
+        # Frames are read straight into the preallocated slots of this ring, so we don't allocate a new frame each time.
+        # If shared, the ring is created in shared memory so it can be read from other processes.
+        self.frame_ring = FrameRing(shape=self.get_frame_shape(), length=queue_length, shared=shared)
+        # Start the recorder's encoder now, so it's ready as soon as we start recording
+        if self.recorder is not None:
+            self.recorder.prepare(self.get_frame_shape())
 
     def start_cam(self, global_barrier, stop_event):
-        self.read_frame()
+        if not self.read_frame():
+            print('no frame!')
+            sys.exit()
         self.wait(global_barrier)
         self.main_loop(stop_event)
         self.exit_loop()
 
-    def config_cam(self):
-        # Set the FPS
+    def config_cam(self) -> dict:
+        # Ask for the FPS, resolution and format we want, and find out what the camera actually gave us
         # Change of FPS may require restart of program due to threading...
         # TODO: check and make sure this doesn't break anything!
-        self.cam.set(cv2.CAP_PROP_FPS, self.params["*fps"])
-        self.params["*fps"] = round(self.cam.get(cv2.CAP_PROP_FPS))
-
-        # Set the resolution
         res = self.params['*resolution'].split('x')
-        self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, float(res[0]))
-        self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, float(res[1]))
-        self.params['*resolution'] = f'{round(self.cam.get(cv2.CAP_PROP_FRAME_WIDTH))}x' \
-                                     f'{round(self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT))}'
-
-    def read_frame(self):
-        _, frame = self.cam.read()
-        if frame is None:
-            print('no frame!')
-            sys.exit()
-        else:
-            self.researcher_cam_queue.put(frame)
-            self.performer_cam_queue.put(frame)
+        wanted = {'fps': self.params['*fps'], 'width': int(res[0]), 'height': int(res[1]),
+                  'fourcc': self.params['*capture fourcc']}
+        # If CamProbe has found the fastest mode for this camera, use that instead of what's set in UserParams
+        if self.params['*capture backend'] not in ['file', 'synthetic']:
+            profile = load_profile(self.params['*camera profiles'], self.params['*capture backend'], self.source)
+            if profile is not None:
+                wanted = {k: profile[k] for k in wanted}
+                print(f'Cam {self.source + 1} using probed mode from {self.params["*camera profiles"]}')
+        mode = self.cam.configure(**wanted)
+        print(f"Cam {self.source + 1} capturing {mode['width']}x{mode['height']} at {mode['fps']} fps "
+              f"({mode['backend']}, {mode['fourcc'] or 'default format'}, {mode['decode threads']} decode threads)")
+        if (mode['width'], mode['height'], mode['fps']) != (wanted['width'], wanted['height'], wanted['fps']):
+            print(f"Cam {self.source + 1} could not capture {wanted['width']}x{wanted['height']} at "
+                  f"{wanted['fps']} fps: run CamProbe.py to find the modes it supports")
+        self.params["*fps"] = mode['fps']
+        self.params['*resolution'] = f"{mode['width']}x{mode['height']}"
+        return mode
+
+    def get_frame_shape(self) -> tuple:
+        return self.mode['height'], self.mode['width'], 3
+
+    def read_frame(self) -> bool:
+        slot = self.frame_ring.next_slot()
+        # The backend fills the slot and tells us when the frame was captured, using a monotonic clock
+        timestamp = self.cam.read(slot)
+        if timestamp is None:
+            return False
+        self.frame_ring.commit(timestamp=timestamp)
+        # The recorder takes its own copy of the frame (only while recording), so never holds up capture
+        if self.recorder is not None:
+            self.recorder.write(slot, timestamp)
+        return True
 
     def wait(self, global_barrier):
         print(f"Cam {self.source + 1} reader currently waiting. Waiting threads = {global_barrier.n_waiting + 1}")
@@ -85,22 +162,28 @@ class CamRead:
 
     def main_loop(self, stop_event):
         while not stop_event.is_set():
-            _, frame = self.cam.read()
-            self.researcher_cam_queue.put(frame)
-            self.performer_cam_queue.put(frame)
+            self.read_frame()
 
     def exit_loop(self):
         self.cam.release()
+        if self.recorder is not None:
+            self.recorder.close()
 
 
 class ResearcherCamView:
-    def __init__(self, source: int, queue: Queue, params: dict):
+    def __init__(self, source: int, cursor: FrameCursor, params: dict, display: DisplayThread,
+                 coordinator: CaptureCoordinator = None, recorder=None):
         self.name = f"Cam {source + 1} Rec"
-        self.queue = queue
+        self.source = source
+        self.cursor = cursor
         self.params = params
+        self.display = display
+        self.coordinator = coordinator
+        # Only given a recorder when syncing cameras: it then records the frames we show, as matched across cameras
+        self.recorder = recorder
 
     def start_cam(self, global_barrier, stop_event):
-        initialise_camera(n=self.name, q=self.queue)
+        initialise_camera(n=self.name, cursor=self.cursor, display=self.display, role='researcher')
         self.wait(global_barrier)
         self.main_loop(stop_event)
         self.exit_loop()
@@ -110,31 +193,54 @@ class ResearcherCamView:
         global_barrier.wait()
 
     def main_loop(self, stop_event):
+        # Frames in the ring are shared with the performer view, so any text is drawn onto our own copy
+        text_frame = np.empty_like(self.cursor.ring.slots[0])
+        if self.recorder is not None:
+            self.recorder.prepare(text_frame.shape)
         while not stop_event.is_set():
-            # Acquire frame from queue
-            frame = self.queue.get()
+            # Acquire frame from the ring
+            frame, frame_time, _ = acquire_frame(self.cursor, self.coordinator, self.source, self.params)
+            if frame is None:
+                continue
+            # Recorded before any text is added. The timestamp is that of the newest frame, so recording starts at the
+            # same moment as for every other recorder, even though the matched frame may have been captured earlier.
+            if self.recorder is not None:
+                self.recorder.write(frame, self.cursor.timestamp, captured=frame_time)
 
             # Modify frame
             match self.params:
                 case {'*recording': True}:
-                    frame = cv2.putText(frame, "Recording...", (20, 40), cv2.FONT_HERSHEY_DUPLEX, 1, (0, 0, 255))
+                    np.copyto(text_frame, frame)
+                    frame = cv2.putText(text_frame, "Recording...", (20, 40), cv2.FONT_HERSHEY_DUPLEX, 1, (0, 0, 255))
 
-            cv2.imshow(self.name, frame)
-            cv2.waitKey(1)
+            self.display.show(self.name, frame, frame_time)
+        if self.recorder is not None:
+            self.recorder.close()
 
     def exit_loop(self):
+        self.cursor.close()     # Make sure we don't hold up CamRead if we were using the blocking policy
         time.sleep(1)  # Wait for 1 sec to allow cv2 and ffmpeg time to stop
-        cv2.destroyWindow(self.name)
+        self.display.close(self.name)
 
 
 class PerformerCamView:
-    def __init__(self, source: int, queue: Queue, params: dict):
+    def __init__(self, source: int, cursor: FrameCursor, params: dict, display: DisplayThread,
+                 recorder=None, coordinator: CaptureCoordinator = None):
         self.name = f"Cam {source + 1} View"
-        self.queue = queue
+        self.source = source
+        self.cursor = cursor
         self.params = params
+        self.display = display
+        # Records exactly what the performer sees
+        self.recorder = recorder
+        self.coordinator = coordinator
+        # The delay actually applied to the most recent frames, in milliseconds (which may differ from *delay time)
+        self.delivered_delay = deque(maxlen=256)
+        # Regions to blank are detected in the background, so detection never holds up the performer's view
+        self.detect_thread = DetectThread(params=self.params, blank_params=self.get_blank_params())
 
     def start_cam(self, global_barrier, stop_event):
-        initialise_camera(n=self.name, q=self.queue)
+        initialise_camera(n=self.name, cursor=self.cursor, display=self.display, role='performer')
         self.wait(global_barrier)
         self.main_loop(stop_event)
         self.exit_loop()
@@ -144,82 +250,93 @@ class PerformerCamView:
         global_barrier.wait()
 
     def main_loop(self, stop_event):
-        delay_frames = deque(maxlen=round(self.params['*fps'] * (self.params['*max delay time'] / 1000)))
-        loop_params = self.params['*loop params']
+        # Frames for the delay are stored compactly (e.g. already scaled down to the size we'll display them at)
+        delay_frames = DelayBuffer(capacity=round(self.params['*fps'] * (self.params['*max delay time'] / 1000)),
+                                   shape=self.cursor.ring.slots[0].shape,
+                                   scaling=self.params['*scaling'] if self.params['*delay buffer scaled'] else 1.0,
+                                   fmt=self.params['*delay buffer format'],
+                                   jpeg_quality=self.params['*delay buffer jpeg quality'],
+                                   directory=self.params['*delay buffer directory'])
+        # Size of the performer view: we only need to resize frames that aren't already this size
+        h, w = self.cursor.ring.slots[0].shape[:2]
+        output_size = (round(w * self.params['*scaling']), round(h * self.params['*scaling']))
+        # Each view records its own loop, into a buffer of fixed length that only takes up memory once used
+        loop_params = dict(self.params['*loop params'])
+        loop_scaling = self.params['*scaling'] if self.params['*loop buffer scaled'] else 1.0
+        loop_params["frames"] = LoopBuffer(capacity=round(self.params['*fps'] * self.params['*max loop time']),
+                                           shape=self.cursor.ring.slots[0].shape,
+                                           scaling=loop_scaling,
+                                           fmt=self.params['*loop buffer format'],
+                                           jpeg_quality=self.params['*delay buffer jpeg quality'],
+                                           ram_budget=self.params['*loop ram budget'],
+                                           directory=self.params['*loop buffer directory'])
+
+        # Start the recorder's encoder now, so it's ready as soon as we start recording
+        if self.recorder is not None:
+            self.recorder.prepare((output_size[1], output_size[0], 3))
+
+        # Manipulations are applied by a chain of steps that is only rebuilt when manipulations are turned on or off
+        chain = ManipChain(view=self, delay_frames=delay_frames, loop_params=loop_params, output_size=output_size)
+        self.detect_thread.start(stop_event)
+
+        while not stop_event.is_set():
+            frame, frame_time, derived = acquire_frame(self.cursor, self.coordinator, self.source, self.params)
+            if frame is None:
+                continue
+            # Frames are always added to the buffer so they can be played later (for delay). The ring slot will be
+            # overwritten by CamRead, so the buffer keeps its own (compact) copy of the frame. If the buffer is scaled
+            # to the size of the view, this is the same scaled frame that's shown when there's no delay.
+            delay_frames.append(derived.scaled((delay_frames.width, delay_frames.height)), timestamp=frame_time)
+
+            if self.params['*reset video']:
+                self.reset_manips(loop_params)
+
+            # Modify frame: this also scales it to the size of the performer view
+            frame = chain(frame, frame_time, derived)
+
+            # cv2.moveWindow(self.name, -1500, 0)   # Comment this out to display on 2nd monitor (in DisplayThread)
+            self.display.show(self.name, frame, frame_time)
+            if self.recorder is not None:
+                self.recorder.write(frame, frame_time, captured=chain.timestamp)
+
+        # Remove the delay and loop buffers from disk, if we were storing them there
+        delay_frames.close()
+        loop_params["frames"].close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def exit_loop(self):
+        self.cursor.close()     # Make sure we don't hold up CamRead if we were using the blocking policy
+        time.sleep(1)  # Wait for 1 sec to allow cv2 and ffmpeg time to stop
+        self.display.close(self.name)
 
-        # TODO: refactor these into UserParams.py somehow - they're taking up a lot of space here.
-        cascade_location = r".\venv\Lib\site-packages\opencv_python-4.5.5.62.dist-info"
-        blank_params = {
+    def get_blank_params(self) -> dict:
+        # Detectors are loaded once and shared between every camera in this process
+        detectors, directory = self.params['*blank detectors'], self.params['*detector directory']
+        return {
             "face": {
-                "cascade": cv2.CascadeClassifier(fr'{cascade_location}\lbpcascade_frontalface_improved.xml'),
-                "scaleFactor": 1.4,
-                "minNeighbors": 4,
+                "detector": get_detector(detectors['face'], directory),
                 "dimensions": 60,
                 "previous_detection": np.full((1, 4), fill_value=100),
-                "minNum": 1
+                "minNum": 1,
             },
             "eye": {
-                "cascade": cv2.CascadeClassifier(fr'{cascade_location}\haarcascade_eye_tree_eyeglasses.xml'),
-                "scaleFactor": 2.7,
-                "minNeighbors": 3,
+                "detector": get_detector(detectors['eye'], directory),
                 "dimensions": 1,
                 "previous_detection": np.full((2, 4), fill_value=100),  # Make sure fill - dimensions > 0!
                 "minNum": 2,
             }
         }
 
-        while not stop_event.is_set():
-            frame = self.queue.get()
-            delay_frames.append(frame)  # Frames are always added to the deque so they can be played later (for delay)
-
-            # Modify frame
-            match self.params:
-                case {'flipped': True}:
-                    frame = cv2.flip(frame, 0)  # This is a test manip and probably won't be used
-
-                case {'delayed': True}:
-                    # TODO: Need to catch errors here if delayed time is outside recorded range
-                    # Out-of-sync delay is likely a performance issue (e.g. overheating laptop!)
-
-                    frame_num = -round(self.params['*fps'] * (self.params['*delay time'] / 1000))
-                    # If returned frame_num is 0, will underflow to start of delay_frames, so set frame to -1 instead
-                    # TODO: check this doesn't lead to a measurable performance decrease
-                    frame = delay_frames[frame_num if frame_num != 0 else -1]
-
-                case {'loop rec': True}:
-                    self._manip_loop_rec(frame, loop_params)
-
-                # TODO: catch error when no loop recorded
-                case {'loop play': True}:
-                    frame = self._manip_loop_play(loop_params)
-
-                case {'loop clear': True}:
-                    loop_params["var"] = 0
-                    loop_params["frames"].clear()
+    def log_delivered_delay(self, delay: float) -> None:
+        self.delivered_delay.append(delay * 1000)
 
-                case {'pause video': True} | {'pause both': True}:
-                    if self.params['*pause frame'] is None:
-                        self.params['*pause frame'] = frame
-                    frame = self.params['*pause frame']
-
-                case {'blank face': True}:
-                    self._manip_detect_blanked_region(frame, params=blank_params["face"])
-
-                case {'blank eyes': True}:
-                    # TODO: implement error correction if only one eye detected (i'm lazy and this is hard)
-                    self._manip_detect_blanked_region(frame, params=blank_params['eye'])
-
-                case {'*reset video': True}:
-                    self.reset_manips(loop_params, blank_params)
-
-            # cv2.moveWindow(self.name, -1500, 0)   # Comment this out to display on 2nd monitor
-            frame = cv2.resize(frame, (0, 0), fx=self.params['*scaling'], fy=self.params['*scaling'])
-            cv2.imshow(self.name, frame)
-            cv2.waitKey(1)
-
-    def exit_loop(self):
-        time.sleep(1)  # Wait for 1 sec to allow cv2 and ffmpeg time to stop
-        cv2.destroyWindow(self.name)
+    def delay_stats(self) -> dict | None:
+        """Returns the most recent delay actually applied to the video, and its error against *delay time"""
+        if not self.delivered_delay:
+            return None
+        errors = [abs(d - self.params['*delay time']) for d in self.delivered_delay]
+        return {'last': self.delivered_delay[-1], 'mean error': sum(errors) / len(errors), 'max error': max(errors)}
 
     def _manip_loop_rec(self, frame, params):
         if params["has_loop"]:
@@ -231,36 +348,27 @@ class PerformerCamView:
     def _manip_loop_play(self, params):
         if params["var"] >= len(params["frames"]):
             params["var"] = 0
+        # The loop buffer may reuse the array it returns, but we're finished with it before the next frame is played
         frame = params["frames"][params["var"]]
         params["var"] += 1
         return frame
 
-    def _manip_detect_blanked_region(self, frame, params):
-        regions = params["cascade"].detectMultiScale(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
-                                                     params["scaleFactor"], params["minNeighbors"])
-        if len(regions) == params["minNum"]:
-            params["previous_detection"] = regions
-        else:
-            regions = params["previous_detection"]
-        for region in regions:
-            self._manip_plot_blanked_region(frame, params, region)
-
-    def _manip_plot_blanked_region(self, frame, params, region):
+    def _manip_plot_blanked_region(self, frame, params, region, scale=1.0):
         try:
             (x, y, w, h) = region
         except ValueError:
             pass
         else:
-            cv2.rectangle(frame, (x - params["dimensions"], y - params["dimensions"]),
-                          (x + w + params["dimensions"], y + h + params["dimensions"]), (0, 0, 0), -1)
+            # Regions are drawn on to the scaled view, so the padding around them is scaled to match
+            d = round(params["dimensions"] * scale)
+            cv2.rectangle(frame, (x - d, y - d), (x + w + d, y + h + d), (0, 0, 0), -1)
 
-    def reset_manips(self, loop_params, blank_params):
+    def reset_manips(self, loop_params):
         # TODO: this could look a bit nicer i'm sure
         loop_params["var"] = 0
         loop_params["has_loop"] = True
         self.params['*pause frame'] = None
-        blank_params['face']['previous_detection'] = np.full((1, 4), fill_value=100)
-        blank_params['eye']['previous_detection'] = np.full((1, 4), fill_value=100)
+        self.detect_thread.reset()
         self.params['*reset video'] = False
 
 
@@ -268,16 +376,76 @@ class CamWrite:
     # If you run into FileNotFound errors when importing ffmpeg-python, make sure that ffmpeg.exe is placed in the
     # Python/Scripts directory of your environment.
 
-    def __init__(self, source: int, windowname):
+    def __init__(self, source: int, windowname, params: dict = None):
         self.source = source
         self.ext = windowname
         self.window_name = f"Cam {self.source + 1} {self.ext}"
+        self.params = params
+        # How we record: 'ffmpeg' and 'opencv' record the frames given to write(), 'gdigrab' captures the window
+        self.backend = params['*recorder'] if params is not None else 'gdigrab'
         self.process = None
-
-    def start_recording(self, start_time, res='1920x1080'):
+        # Frames waiting to be encoded: allocated by prepare(), then reused for every recording
+        self.queue = None
+        # The encoder is started before we start recording, writing to a temporary file until we know the real name
+        self.encoder = None
+        self.pending = None
+        self.takes = 0
+        self.writer_thread = None
+        # If set, recordings are split into files of this many seconds, so a crash only loses the last few seconds
+        self.segment_time = params['*recording segment time'] if params is not None else None
+        # Frames captured before this time (from time.perf_counter) aren't recorded: None if we're not recording
+        self.start_at = None
+        self.stopping = False
+        self.filename = None
+        self.first_frame = None
+        self.written = 0
+        # Set once the last recording has been completely written to disk (which carries on after stop_recording)
+        self.finished = threading.Event()
+        self.finished.set()
+
+    def prepare(self, shape: tuple) -> None:
+        """Starts the encoder for the next recording in advance, so it's ready to go as soon as recording starts"""
+        if self.backend == 'gdigrab':
+            return
+        if self.queue is None or self.queue.shape != shape:
+            self.queue = RecordQueue(shape=shape, length=self.params['*recorder queue length'])
+        # Anything left in the queue (e.g. if the last encoder stopped early) belongs to the last recording
+        self.queue.clear()
+        self.takes += 1
+        self.pending = f'output/video/.pending_{RUN_ID}_cam{self.source + 1}_{self.ext}_{self.takes}'
+        os.makedirs(os.path.dirname(self.pending), exist_ok=True)
+        try:
+            self.encoder = self.open_encoder(self.pending, shape)
+            index = FrameIndexWriter(self.pending + '.frames', flush_every=self.params['*fps'])
+        except OSError as e:
+            # e.g. if ffmpeg isn't installed: we can carry on without recording, but can't start any recordings
+            print(f'{self.window_name}: could not start recorder, so nothing will be recorded: {e!r}')
+            self.encoder = None
+            return
+        self.writer_thread = threading.Thread(target=self.write_loop, args=(self.encoder, index), daemon=True)
+        self.writer_thread.start()
+
+    def start_recording(self, start_time, res='1920x1080', start_at: float = None):
+        """Starts recording from the first frame captured at or after start_at (from time.perf_counter), so that
+        every recorder given the same start_at begins from the same moment"""
+        f = "%Y-%m-%d_%H-%M-%S"
+        filename = f'output/video/{start_time.strftime(f)}_cam{self.source + 1}_{self.ext}_out'
+        if self.backend == 'gdigrab':
+            self.start_screen_recording(filename + '.avi', res)
+            return
+        # The previous recording may still be being written, in which case the encoder isn't ready yet
+        self.finished.wait()
+        if self.encoder is None:
+            print(f'{self.window_name}: no recorder running, so not recording')
+            return
+        self.filename = filename
+        self.first_frame = None
+        self.written = 0
+        self.start_at = time.perf_counter() if start_at is None else start_at
+
+    def start_screen_recording(self, filename, res):
         # On high-resolution monitors, gdigrab may display black padding around the captured video. I'd suggest
         # changing your monitor display resolution/scaling if this is an issue, as I can't find a workaround in ffmpeg.
-        f = "%Y-%m-%d_%H-%M-%S"
         # filename = f'output/video/{start_time.strftime(f)}_cam{self.source + 1}_{self.ext}_out.mkv'
         # p = (
         #     ffmpeg.input(
@@ -300,7 +468,6 @@ class CamWrite:
         # )
 
         # Slow computer option - resolution is low!
-        filename = f'output/video/{start_time.strftime(f)}_cam{self.source + 1}_{self.ext}_out.avi'
         p = (
             ffmpeg.input(
                 format='gdigrab',
@@ -318,30 +485,267 @@ class CamWrite:
         )
         self.process = p.run_async(pipe_stdin=True)
 
-    def stop_recording(self):
+    def write(self, frame: np.ndarray, timestamp: float, captured: float = None) -> None:
+        """Queues a copy of a frame to be recorded, if we're recording: never waits for the encoder. The timestamp is
+        the capture time of the newest frame from the camera, and captured the capture time of the frame itself if
+        it's different (e.g. if it's been delayed)."""
+        # Read once, as stop_recording may set this to None at any moment from another thread
+        start_at = self.start_at
+        if start_at is None or timestamp < start_at or self.stopping:
+            return
+        if frame.shape != self.queue.shape:
+            self.queue.dropped += 1
+            return
+        if self.first_frame is None:
+            self.first_frame = timestamp
+        self.queue.put(frame, captured=timestamp if captured is None else captured, presented=time.perf_counter())
+
+    def write_loop(self, encoder, index: FrameIndexWriter):
+        # Wait for frames until we've been stopped, and have written every frame still waiting in the queue
         try:
-            # Send quit command to ffmpeg process
-            self.process.communicate(str.encode("q"))
-        except (ValueError, AttributeError, TypeError):
-            pass
-        else:
-            # Close ffmpeg process
-            self.process.terminate()
+            while not (self.stopping and len(self.queue) == 0):
+                frame, times = self.queue.get(timeout=0.1)
+                if frame is None:
+                    continue
+                if self.backend == 'ffmpeg':
+                    # Frames are written straight from the queue's memory, without copying them again
+                    encoder.stdin.write(frame.data)
+                else:
+                    encoder.write(frame)
+                # Record exactly when every frame in the video was captured and shown
+                index.append(*times)
+                self.written += 1
+                self.queue.release()
+        except OSError as e:
+            # e.g. if ffmpeg has crashed: everything written so far is kept, and any later frames are dropped
+            print(f'{self.window_name}: recorder stopped after {self.written} frames: {e!r}')
+        finally:
+            try:
+                self.close_encoder(encoder)
+            except OSError:
+                pass
+            index.close()
+
+    def open_encoder(self, filename, shape):
+        """Starts an encoder writing to filename (without an extension): if we're segmenting the recording, each
+        segment is numbered, and every finished segment is listed in a .ffconcat file that can be used to join them"""
+        h, w = shape[:2]
+        if self.backend == 'opencv':
+            fourcc = cv2.VideoWriter_fourcc(*self.params['*recorder codec'])
+            if self.segment_time:
+                return SegmentedVideoWriter(filename, fourcc, self.params['*fps'], (w, h),
+                                            segment_frames=round(self.segment_time * self.params['*fps']))
+            return cv2.VideoWriter(filename + '.avi', fourcc, self.params['*fps'], (w, h))
+        output = {'filename': filename + '.avi'}
+        if self.segment_time:
+            output = {
+                'filename': filename + '_%03d.avi',
+                'f': 'segment',
+                'segment_time': self.segment_time,
+                'reset_timestamps': 1,
+                'segment_list': filename + '.ffconcat',
+                'segment_list_type': 'ffconcat',
+                # Segments can only start on a keyframe, so make sure there's one where each segment should start
+                'force_key_frames': f'expr:gte(t,n_forced*{self.segment_time})',
+            }
+        # Raw BGR frames are piped into ffmpeg, which only has to encode them
+        p = (
+            ffmpeg.input(
+                'pipe:',
+                format='rawvideo',
+                pix_fmt='bgr24',
+                s=f'{w}x{h}',
+                framerate=self.params['*fps'],
+                loglevel='warning',
+            )
+            .output(
+                vcodec=self.params['*recorder codec'],
+                pix_fmt='yuv420p',
+                vf="pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                **output,
+            )
+            .overwrite_output()
+        )
+        return p.run_async(pipe_stdin=True)
 
+    def close_encoder(self, encoder):
+        if self.backend == 'opencv':
+            encoder.release()
+        else:
+            # Closing stdin tells ffmpeg there are no more frames, so it can finish writing the file
+            encoder.stdin.close()
+            encoder.wait()
+
+    def finish_take(self) -> None:
+        """Waits for the encoder to finish with every queued frame, and for the file to be written"""
+        self.stopping = True
+        self.writer_thread.join()
+        self.stopping = False
+
+    def stop_recording(self) -> dict | None:
+        """Stops recording, returning where the recording will be saved and when its first frame was captured.
+        Frames still queued are written in the background: the recording is complete once finished is set."""
+        if self.backend == 'gdigrab':
+            try:
+                # Send quit command to ffmpeg process
+                self.process.communicate(str.encode("q"))
+            except (ValueError, AttributeError, TypeError):
+                pass
+            else:
+                # Close ffmpeg process
+                self.process.terminate()
+            return None
+        start_at, self.start_at = self.start_at, None
+        if start_at is None:
+            return None
+        stream = {
+            'file': self.filename + ('.ffconcat' if self.segment_time else '.avi'),
+            'index': self.filename + '.frames',     # Exact capture and present time of every frame, see FrameIndex
+            'first frame': self.first_frame,
+            # Time between the shared start time and the first frame we recorded, in milliseconds
+            'start offset': None if self.first_frame is None else (self.first_frame - start_at) * 1000,
+        }
+        self.finished.clear()
+        threading.Thread(target=self.finish_recording, args=(stream,)).start()
+        return stream
 
-def initialise_camera(n: str, q: Queue) -> None:
-    while True:
+    def finish_recording(self, stream: dict) -> None:
         try:
-            frame = q.get(False)
-        except Empty:
-            time.sleep(1)
-        else:
-            cv2.imshow(n, frame)
+            self.finish_take()
+            stream['frames'] = self.written
+            os.replace(self.pending + '.frames', self.filename + '.frames')
+            if self.segment_time:
+                stream['segments'] = self.rename_segments()
+            else:
+                os.replace(self.pending + '.avi', self.filename + '.avi')
+        except OSError as e:
+            # e.g. if the encoder crashed before writing anything: whatever was written is left under its pending name
+            print(f'{self.window_name}: could not save recording as {self.filename}: {e!r}')
+        finally:
+            # Get the encoder for the next recording ready straight away. Whatever happened, we're finished with this
+            # recording, so nothing waiting on it (e.g. the next recording) should wait forever.
+            try:
+                self.prepare(self.queue.shape)
+            finally:
+                self.finished.set()
+
+    def rename_segments(self) -> list:
+        """Gives each segment of the recording its final name, and lists them in order in a new .ffconcat file"""
+        segments = []
+        for num, pending in enumerate(sorted(glob.glob(glob.escape(self.pending) + '_*.avi'))):
+            segments.append(f'{self.filename}_{num:03d}.avi')
+            os.replace(pending, segments[-1])
+        with open(self.filename + '.ffconcat', 'w') as f:
+            f.write('ffconcat version 1.0\n')
+            f.writelines(f"file '{os.path.basename(segment)}'\n" for segment in segments)
+        if os.path.exists(self.pending + '.ffconcat'):
+            os.remove(self.pending + '.ffconcat')
+        return segments
+
+    def close(self) -> None:
+        """Stops the encoder waiting for the next recording, removing its temporary files"""
+        self.finished.wait()
+        if self.encoder is None:
+            return
+        self.start_at = None
+        self.finish_take()
+        self.encoder = None
+        # Only remove the files of this take (e.g. not those of take 12 when this is take 1)
+        for pattern in ['.*', '_*.avi']:
+            for pending in glob.glob(glob.escape(self.pending) + pattern):
+                os.remove(pending)
+
+    def stats(self) -> dict | None:
+        """Returns the number of frames recorded, and how many are waiting in (or were dropped from) the queue"""
+        if self.queue is None:
+            return None
+        return {'written': self.written, **self.queue.stats()}
+
+
+class SegmentedVideoWriter:
+    """Writes video with cv2.VideoWriter, starting a new numbered file every segment_frames frames and listing each
+    finished file in a .ffconcat file, in the same way as ffmpeg's segment muxer"""
+    def __init__(self, filename: str, fourcc: int, fps: float, size: tuple, segment_frames: int):
+        self.filename = filename
+        self.fourcc = fourcc
+        self.fps = fps
+        self.size = size
+        self.segment_frames = segment_frames
+        self.writer = None
+        self.segments = 0
+        self.count = 0
+        with open(self.filename + '.ffconcat', 'w') as f:
+            f.write('ffconcat version 1.0\n')
+
+    def write(self, frame: np.ndarray) -> None:
+        if self.writer is None or self.count >= self.segment_frames:
+            self.next_segment()
+        self.writer.write(frame)
+        self.count += 1
+
+    def next_segment(self) -> None:
+        self.release()
+        self.writer = cv2.VideoWriter(f'{self.filename}_{self.segments:03d}.avi', self.fourcc, self.fps, self.size)
+        self.segments += 1
+        self.count = 0
+
+    def release(self) -> None:
+        """Finishes the current segment, and adds it to the list of segments"""
+        if self.writer is None:
+            return
+        self.writer.release()
+        self.writer = None
+        with open(self.filename + '.ffconcat', 'a') as f:
+            f.write(f"file '{os.path.basename(self.filename)}_{self.segments - 1:03d}.avi'\n")
+
+
+def recover_pending_recordings(directory: str = 'output/video') -> list:
+    """Renames any temporary recording files left behind by an earlier run (e.g. if it crashed), so they're kept
+    rather than overwritten or removed, and returns their new names"""
+    recovered = []
+    for pending in sorted(glob.glob(os.path.join(glob.escape(directory), '.pending_*'))):
+        name = os.path.basename(pending)
+        if name.startswith(f'.pending_{RUN_ID}_'):
+            continue
+        recovered.append(os.path.join(directory, 'recovered' + name[len('.pending'):]))
+        os.replace(pending, recovered[-1])
+    if recovered:
+        print(f'Recovered {len(recovered)} unfinished recording files from an earlier run, e.g. {recovered[0]}')
+    return recovered
+
+
+def acquire_frame(cursor: FrameCursor, coordinator: CaptureCoordinator, source: int, params: dict) -> tuple:
+    """Waits for the next frame from a camera, and returns it with its capture time and the cache of its derived
+    versions (e.g. scaled, grayscale), or Nones if it didn't arrive"""
+    frame = cursor.get(timeout=1)
+    if frame is None:
+        return None, None, None
+    if coordinator is None or not params['*sync cameras']:
+        return frame, cursor.timestamp, cursor.derived
+    # If we're syncing cameras, swap this frame for the one captured closest to the newest time all cameras have
+    # reached, so that every view shows frames captured at the same moment
+    slot = coordinator.slot_for(source)
+    if slot is None:
+        return frame, cursor.timestamp, cursor.derived
+    ring = cursor.ring
+    return ring.slots[slot], ring.timestamps[slot], ring.derivatives(ring.index_of(slot))
+
+
+def initialise_camera(n: str, cursor: FrameCursor, display: DisplayThread, role: str) -> None:
+    display.open(n, role=role)
+    while True:
+        frame = cursor.get(timeout=1)
+        if frame is not None:
+            display.show(n, frame, cursor.timestamp)
             break
     return
 
 
 def get_video_stats(filename):
+    # Use the exact times every frame was shown, if the video was recorded with a frame index
+    if os.path.exists(os.path.splitext(filename)[0] + '.frames'):
+        print(FrameIndex.for_video(filename).duration())
+        return
     vid = cv2.VideoCapture(filename)
     fps = vid.get(cv2.CAP_PROP_FPS)  # TODO: this should use user_params['*fps'] instead, I think
     framecount = vid.get(cv2.CAP_PROP_FRAME_COUNT)
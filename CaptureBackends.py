@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+from cv2 import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# OpenCV capture APIs we can open cameras with. 'auto' picks the best one for the platform we're running on.
+DEVICE_APIS = {
+    'dshow': cv2.CAP_DSHOW,     # DirectShow (Windows)
+    'msmf': cv2.CAP_MSMF,   # Media Foundation (Windows)
+    'v4l2': cv2.CAP_V4L2,   # Video4Linux (Linux)
+    'any': cv2.CAP_ANY,     # Let OpenCV decide
+}
+
+
+def default_api() -> str:
+    if sys.platform.startswith('win'):
+        return 'dshow'
+    if sys.platform.startswith('linux'):
+        return 'v4l2'
+    return 'any'
+
+
+def fourcc_to_str(code: float) -> str:
+    code = int(code)
+    return ''.join(chr((code >> (8 * i)) & 0xFF) for i in range(4)) if code > 0 else ''
+
+
+class DeviceCapture:
+    """Captures from a camera using one of OpenCV's capture APIs, asking it for a compressed format (e.g. MJPEG) if
+    given one: uncompressed formats can't reach full frame rate at high resolutions on most USB webcams"""
+    def __init__(self, source: int, api: str = 'auto', decode_threads: int = 0):
+        self.api = default_api() if api == 'auto' else api
+        self.cam = cv2.VideoCapture(source, DEVICE_APIS[self.api])
+        # If set, MJPEG frames are taken from the driver still compressed and decoded by a pool of threads, so that
+        # decoding doesn't limit how fast we can capture. Frames are still delivered in the order they were captured.
+        self.decode_threads = decode_threads
+        self.pool = None
+        self.decoding = deque()
+
+    def configure(self, fps: int, width: int, height: int, fourcc: str = None) -> dict:
+        """Asks the camera for a mode, and returns the mode it actually gave us"""
+        # The format has to be set before the resolution, or some drivers ignore it
+        if fourcc:
+            self.cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, float(width))
+        self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, float(height))
+        self.cam.set(cv2.CAP_PROP_FPS, fps)
+        if self.decode_threads and fourcc_to_str(self.cam.get(cv2.CAP_PROP_FOURCC)) == 'MJPG':
+            self.start_decode_pool()
+        return self.mode()
+
+    def start_decode_pool(self) -> None:
+        # Not every capture API will give us frames still compressed: if this one won't, the driver decodes them
+        if not self.cam.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            print(f'{self.api} cannot deliver compressed frames: decoding MJPEG in the driver instead')
+            return
+        self.pool = ThreadPoolExecutor(max_workers=self.decode_threads, thread_name_prefix='mjpeg')
+
+    def mode(self) -> dict:
+        return {
+            'backend': self.api,
+            'fourcc': fourcc_to_str(self.cam.get(cv2.CAP_PROP_FOURCC)),
+            'width': round(self.cam.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': round(self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': round(self.cam.get(cv2.CAP_PROP_FPS)),
+            'decode threads': self.decode_threads if self.pool is not None else 0,
+        }
+
+    def read(self, slot: np.ndarray) -> float | None:
+        """Reads the next frame into slot, returning the time it was captured (or None if we couldn't read one)"""
+        if self.pool is not None:
+            return self.read_compressed(slot)
+        _, frame = self.cam.read(image=slot)
+        # Every frame is stamped with the time it was captured, using a monotonic clock
+        timestamp = time.perf_counter()
+        if frame is None:
+            return None
+        # If the driver gave us a frame it allocated itself (rather than filling our slot), copy it into the slot
+        if frame is not slot:
+            np.copyto(slot, frame)
+        return timestamp
+
+    def read_compressed(self, slot: np.ndarray) -> float | None:
+        # Keep grabbing compressed frames and handing them to the pool until the oldest one has been decoded, or we
+        # have one waiting for every thread. Frames therefore arrive a little later, but we can capture far faster.
+        while not self.decoding or (not self.decoding[0][0].done() and len(self.decoding) < self.decode_threads):
+            ok, data = self.cam.read()
+            timestamp = time.perf_counter()
+            if not ok:
+                break
+            self.decoding.append((self.pool.submit(cv2.imdecode, data, cv2.IMREAD_COLOR), timestamp))
+        if not self.decoding:
+            return None
+        future, timestamp = self.decoding.popleft()
+        frame = future.result()
+        if frame is None or frame.shape != slot.shape:
+            return None
+        np.copyto(slot, frame)
+        return timestamp
+
+    def release(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+        self.cam.release()
+
+
+class FileCapture:
+    """Plays a video file as if it were a camera, at the file's own frame rate, looping back to the start at the end"""
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.cam = cv2.VideoCapture(filename)
+        self.fps = self.cam.get(cv2.CAP_PROP_FPS) or 30
+        self.next_frame = None
+
+    def configure(self, fps: int, width: int, height: int, fourcc: str = None) -> dict:
+        # We can't change the mode of a file, so we just report what it is
+        return self.mode()
+
+    def mode(self) -> dict:
+        return {
+            'backend': 'file',
+            'fourcc': fourcc_to_str(self.cam.get(cv2.CAP_PROP_FOURCC)),
+            'width': round(self.cam.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': round(self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': round(self.fps),
+            'decode threads': 0,
+        }
+
+    def read(self, slot: np.ndarray) -> float | None:
+        ok, frame = self.cam.read(image=slot)
+        if not ok:
+            self.cam.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cam.read(image=slot)
+            if not ok:
+                return None
+        if frame is not slot:
+            np.copyto(slot, frame)
+        return pace(self, 1 / self.fps)
+
+    def release(self) -> None:
+        self.cam.release()
+
+
+class SyntheticCapture:
+    """Generates a moving test pattern, for running without any cameras attached (e.g. when testing performance)"""
+    def __init__(self, source: int = 0):
+        self.source = source
+        self.width, self.height, self.fps = 1280, 720, 30
+        self.count = 0
+        self.next_frame = None
+
+    def configure(self, fps: int, width: int, height: int, fourcc: str = None) -> dict:
+        self.width, self.height, self.fps = width, height, fps
+        return self.mode()
+
+    def mode(self) -> dict:
+        return {'backend': 'synthetic', 'fourcc': '', 'width': self.width, 'height': self.height, 'fps': self.fps,
+                'decode threads': 0}
+
+    def read(self, slot: np.ndarray) -> float | None:
+        # A gradient that scrolls one pixel every frame, with a bar showing the frame number
+        slot[:] = ((np.arange(self.width) + self.count) % 256).astype(np.uint8)[None, :, None]
+        cv2.putText(slot, f'Cam {self.source + 1}: {self.count}', (20, 40), cv2.FONT_HERSHEY_DUPLEX, 1, (0, 0, 255))
+        self.count += 1
+        return pace(self, 1 / self.fps)
+
+    def release(self) -> None:
+        pass
+
+
+def pace(capture, period: float) -> float:
+    """Waits until the next frame of a file or synthetic source is due, so they run at the rate a camera would"""
+    now = time.perf_counter()
+    capture.next_frame = now if capture.next_frame is None else capture.next_frame + period
+    if capture.next_frame > now:
+        time.sleep(capture.next_frame - now)
+    else:
+        # Don't try to catch up if we've fallen behind, just carry on from now
+        capture.next_frame = now
+    return time.perf_counter()
+
+
+def profile_key(api: str, source: int) -> str:
+    # OpenCV doesn't tell us anything about which camera is which, so profiles are stored by API and camera index
+    return f'{default_api() if api == "auto" else api}:{source}'
+
+
+def load_profile(filename: str, api: str, source: int) -> dict | None:
+    """Returns the mode saved for a camera by CamProbe, if it's been probed"""
+    if filename is None or not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f).get(profile_key(api, source))
+
+
+def save_profile(filename: str, api: str, source: int, profile: dict) -> None:
+    """Saves the best mode found for a camera, keeping the profiles saved for every other camera"""
+    profiles = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            profiles = json.load(f)
+    profiles[profile_key(api, source)] = profile
+    with open(filename, 'w') as f:
+        json.dump(profiles, f, indent=4)
+
+
+def open_capture(source: int, params: dict):
+    """Opens the capture source set in UserParams for a camera"""
+    match params['*capture backend']:
+        case 'file':
+            files = params['*capture file']
+            return FileCapture(files[source % len(files)] if isinstance(files, list) else files)
+        case 'synthetic':
+            return SyntheticCapture(source)
+        case api:
+            return DeviceCapture(source, api=api, decode_threads=params['*capture decode threads'])
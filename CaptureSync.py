@@ -0,0 +1,54 @@
+import threading
+from collections import deque
+from FrameRing import FrameRing, nearest_slot
+
+
+class CaptureCoordinator:
+    """Lines up the frames captured by every camera, using the capture timestamps they share from one monotonic clock"""
+    def __init__(self, tolerance: float):
+        # Frames more than this many seconds away from the time we're matching to won't be paired up
+        self.tolerance = tolerance
+        self.rings = {}
+        self.lock = threading.Lock()
+        # The difference between the newest frames of each camera, in milliseconds, measured once per captured frame
+        self.skew_history = deque(maxlen=256)
+        # Every view asks for the reference time on every frame, but it only changes when a camera captures a frame,
+        # so we keep the last one along with how many frames each camera had captured when we found it
+        self.counts = None
+        self.reference = None
+
+    def register(self, source: int, ring: FrameRing) -> None:
+        with self.lock:
+            self.rings[source] = ring
+
+    def reference_time(self) -> float | None:
+        """Returns the newest time that every camera has captured a frame for, which all cameras can be matched to"""
+        with self.lock:
+            counts = tuple(ring.write_index for ring in self.rings.values())
+            if counts == self.counts:
+                return self.reference
+            # Capture time of the newest frame from each camera that has started capturing
+            latest = [ring.timestamps[(count - 1) % ring.length]
+                      for ring, count in zip(self.rings.values(), counts) if count > 0]
+            self.counts, self.reference = counts, min(latest) if latest else None
+            if latest:
+                self.skew_history.append((max(latest) - min(latest)) * 1000)
+            return self.reference
+
+    def slot_for(self, source: int, reference: float = None) -> int | None:
+        """Returns the slot in one camera's ring holding the frame nearest the reference time, or None if too far"""
+        ring = self.rings[source]
+        reference = self.reference_time() if reference is None else reference
+        if reference is None or ring.write_index == 0:
+            return None
+        # The oldest slot in the ring may be in the middle of being overwritten, so we never search that one
+        slot = nearest_slot(ring.timestamps, ring.write_index, reference, limit=ring.length - 1)
+        if abs(ring.timestamps[slot] - reference) > self.tolerance:
+            return None
+        return slot
+
+    def stats(self) -> dict | None:
+        """Returns the current and largest recent time difference between the newest frames from each camera"""
+        if not self.skew_history:
+            return None
+        return {'skew': self.skew_history[-1], 'max skew': max(self.skew_history)}
@@ -0,0 +1,229 @@
+import os
+import mmap
+import tempfile
+import numpy as np
+from cv2 import cv2
+from FrameRing import nearest_slot
+
+# These are the formats that frames can be stored in when they're held in a DelayBuffer or LoopBuffer
+DELAY_FORMATS = [
+    'bgr',  # Raw frames as captured: largest, but no encoding or decoding cost
+    'yuv420',   # Planar YUV 4:2:0: half the size of BGR, cheap to convert
+    'jpeg',     # JPEG compressed: by far the smallest, but costs an encode for every frame
+]
+
+# Number of frames ahead of the most recently read frame that we ask the OS to keep in memory, when stored on disk
+READAHEAD_FRAMES = 8
+
+
+class FrameStore:
+    """Scales, encodes and decodes frames held in a preallocated store, either in RAM or in a file mapped from disk"""
+    def __init__(self, shape: tuple, scaling: float = 1.0, fmt: str = 'bgr', jpeg_quality: int = 90,
+                 on_disk: bool = False):
+        if fmt not in DELAY_FORMATS:
+            raise ValueError(f'Frame buffer format must be one of {DELAY_FORMATS}, not {fmt}')
+        # Frames stored on disk need to be a fixed size, so we can't use JPEG here
+        if on_disk and fmt == 'jpeg':
+            print('JPEG frame buffer cannot be stored on disk: using YUV420 instead')
+            fmt = 'yuv420'
+        self.fmt = fmt
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+
+        # Work out the size frames will be stored at. We never want to store frames larger than they were captured,
+        # and YUV 4:2:0 needs both dimensions to be even.
+        h, w = shape[:2]
+        scaling = min(scaling, 1.0)
+        self.width, self.height = round(w * scaling), round(h * scaling)
+        if fmt == 'yuv420':
+            self.width, self.height = self.width - self.width % 2, self.height - self.height % 2
+        self.slot_shape = (self.height, self.width, 3) if fmt == 'bgr' else (self.height * 3 // 2, self.width)
+
+        self.scale_buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.decode_buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.file, self.mmap = None, None
+
+    def _allocate(self, capacity: int, directory: str = None):
+        """Preallocates space for capacity frames: JPEGs are variable length, so are kept in a list instead"""
+        if self.fmt == 'jpeg':
+            return [None] * capacity
+        if directory is None:
+            return np.zeros((capacity, *self.slot_shape), dtype=np.uint8)
+        return self._map_store(directory, (capacity, *self.slot_shape))
+
+    def _map_store(self, directory: str, shape: tuple, advice: str = 'MADV_RANDOM') -> np.ndarray:
+        """Preallocates a file on disk large enough for every frame in the buffer and maps it into memory"""
+        os.makedirs(directory, exist_ok=True)
+        size = int(np.prod(shape))
+        # The file is deleted automatically once it's closed, so we never leave old frames lying around on disk
+        self.file = tempfile.TemporaryFile(dir=directory, prefix='frames_', suffix='.bin')
+        # Reserve the space on disk up front where we can, so we don't run out of space halfway through a recording
+        try:
+            os.posix_fallocate(self.file.fileno(), 0, size)
+        except (AttributeError, OSError):
+            self.file.truncate(size)
+        self.mmap = mmap.mmap(self.file.fileno(), size)
+        # Tell the OS how we'll be reading frames back, so it knows whether reading ahead is worthwhile
+        if hasattr(mmap, advice):
+            self.mmap.madvise(getattr(mmap, advice))
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.mmap)
+
+    def _unmap_store(self) -> None:
+        # The mapping can't be closed while any arrays still refer to it, so these must be released first
+        if self.mmap is not None:
+            self.mmap.close()
+            self.file.close()
+            self.mmap, self.file = None, None
+
+    def _encode(self, frame: np.ndarray, store, slot: int) -> None:
+        """Stores a copy of a frame in the given slot, scaled and encoded into our storage format"""
+        # Frames may already have been scaled to our size, e.g. by a FrameRing's derivative cache
+        if frame.shape[1::-1] != (self.width, self.height):
+            frame = cv2.resize(frame, (self.width, self.height), dst=self.scale_buffer, interpolation=cv2.INTER_AREA)
+        match self.fmt:
+            case 'bgr':
+                np.copyto(store[slot], frame)
+            case 'yuv420':
+                cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=store[slot])
+            case 'jpeg':
+                _, store[slot] = cv2.imencode('.jpg', frame, self.jpeg_params)
+
+    def _decode(self, store, slot: int) -> np.ndarray:
+        # Only the frame we've been asked for is ever decoded. The array returned may be reused on the next call, so
+        # it should be copied if it needs to be kept.
+        match self.fmt:
+            case 'bgr':
+                return store[slot]
+            case 'yuv420':
+                return cv2.cvtColor(store[slot], cv2.COLOR_YUV2BGR_I420, dst=self.decode_buffer)
+            case 'jpeg':
+                return cv2.imdecode(store[slot], cv2.IMREAD_COLOR)
+
+
+class DelayBuffer(FrameStore):
+    """Holds the most recent frames from a camera in a compact form, so they can be played back after a delay"""
+    def __init__(self, capacity: int, shape: tuple, scaling: float = 1.0, fmt: str = 'bgr', jpeg_quality: int = 90,
+                 directory: str = None):
+        super().__init__(shape=shape, scaling=scaling, fmt=fmt, jpeg_quality=jpeg_quality,
+                         on_disk=directory is not None)
+        self.capacity = capacity
+        # Total number of frames ever appended: frame n is always stored in slot n % capacity
+        self.count = 0
+        # Capture time of the frame held in each slot, so we can look frames up by time rather than by position
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        # We read frames back out of order (whenever the delay time changes), so the OS shouldn't read ahead for us
+        self.store = self._allocate(capacity, directory)
+
+    def _prefetch(self, slot: int) -> None:
+        """Asks the OS to keep the frames we're likely to read next resident in the page cache"""
+        if self.mmap is None or not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+        slot_bytes = self.store[0].nbytes
+        # Offsets passed to madvise must be aligned to the page size
+        start = (slot * slot_bytes) // mmap.PAGESIZE * mmap.PAGESIZE
+        length = min(READAHEAD_FRAMES, self.capacity - slot) * slot_bytes + (slot * slot_bytes - start)
+        self.mmap.madvise(mmap.MADV_WILLNEED, start, length)
+
+    def close(self) -> None:
+        """Releases the memory map and deletes the backing file, if we're storing frames on disk"""
+        if self.mmap is not None:
+            self.store = None
+            self._unmap_store()
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def append(self, frame: np.ndarray, timestamp: float) -> None:
+        """Stores a copy of a frame and its capture time, replacing the oldest frame in the buffer if it's full"""
+        slot = self.count % self.capacity
+        self.timestamps[slot] = timestamp
+        self._encode(frame, self.store, slot)
+        self.count += 1
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """Returns a frame by index, in the same way as a deque: e.g. -1 is the newest frame, 0 the oldest"""
+        length = len(self)
+        if not -length <= index < length:
+            raise IndexError('DelayBuffer index out of range')
+        slot = (self.count + index if index < 0 else self.count - length + index) % self.capacity
+        self._prefetch(slot)
+        return self._decode(self.store, slot)
+
+    def nearest(self, timestamp: float) -> tuple[np.ndarray, float]:
+        """Returns the frame captured closest to the given time, along with the time it was actually captured"""
+        if self.count == 0:
+            raise IndexError('DelayBuffer is empty')
+        slot = nearest_slot(self.timestamps, self.count, timestamp)
+        self._prefetch(slot)
+        return self._decode(self.store, slot), self.timestamps[slot]
+
+
+class LoopBuffer(FrameStore):
+    """Holds a loop of recorded video, up to a fixed length, keeping it in RAM up to a budget and on disk after that"""
+    def __init__(self, capacity: int, shape: tuple, scaling: float = 1.0, fmt: str = 'bgr', jpeg_quality: int = 90,
+                 ram_budget: float = None, directory: str = None):
+        super().__init__(shape=shape, scaling=scaling, fmt=fmt, jpeg_quality=jpeg_quality)
+        # Work out how many frames fit into our RAM budget (given in MB). JPEGs vary in size, so are never limited.
+        slot_bytes = int(np.prod(self.slot_shape))
+        ram_frames = capacity
+        if ram_budget is not None and fmt != 'jpeg':
+            ram_frames = min(capacity, int(ram_budget * 1024 * 1024) // slot_bytes)
+        # Without anywhere to spill frames to, the loop can't be any longer than what fits in RAM
+        if directory is None and ram_frames < capacity:
+            print(f'Loop buffer limited to {ram_frames} frames to stay within RAM budget of {ram_budget} MB')
+            capacity = ram_frames
+        self.capacity = capacity
+        self.directory = directory
+        # Number of frames in the loop: frame n is held in RAM if n < ram_frames, otherwise in the disk store
+        self.count = 0
+        self.ram_frames = ram_frames
+        # RAM is only allocated once a loop is first recorded, so cameras that never loop don't hold on to any
+        self.ram_store = None
+        # The file on disk is only created if a loop ever grows past our RAM budget
+        self.disk_store = None
+        self.full = False
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, frame: np.ndarray) -> bool:
+        """Stores a copy of a frame at the end of the loop, returning False if the loop is already at full length"""
+        if self.count >= self.capacity:
+            if not self.full:
+                print(f'Loop buffer full: stopped recording after {self.capacity} frames')
+                self.full = True
+            return False
+        store, slot = self._locate(self.count, writing=True)
+        self._encode(frame, store, slot)
+        self.count += 1
+        return True
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """Returns a frame from the loop by position: frames are always found in constant time, wherever they're held"""
+        if not -self.count <= index < self.count:
+            raise IndexError('LoopBuffer index out of range')
+        return self._decode(*self._locate(index % self.count))
+
+    def _locate(self, index: int, writing: bool = False) -> tuple:
+        ram_frames = self.ram_frames
+        if index < ram_frames:
+            if self.ram_store is None and writing:
+                self.ram_store = self._allocate(ram_frames)
+            return self.ram_store, index
+        if self.disk_store is None and writing:
+            # Loops are played back in order, so the OS can read ahead of us as much as it likes
+            self.disk_store = self._map_store(self.directory, (self.capacity - ram_frames, *self.slot_shape),
+                                              advice='MADV_SEQUENTIAL')
+        return self.disk_store, index - ram_frames
+
+    def clear(self) -> None:
+        """Forgets the recorded loop, keeping all its memory allocated so the next loop can reuse it"""
+        self.count = 0
+        self.full = False
+        if self.fmt == 'jpeg' and self.ram_store is not None:
+            self.ram_store = [None] * self.ram_frames
+
+    def close(self) -> None:
+        """Releases the memory map and deletes the backing file, if the loop ever spilled on to disk"""
+        if self.mmap is not None:
+            self.disk_store = None
+            self._unmap_store()
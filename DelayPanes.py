@@ -3,10 +3,10 @@ import time
 import tkinter as tk
 from tkinter import ttk, filedialog
 from GuiPanes import ParentFrame
+from DelayTimeline import DelayTimeline
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.ticker import PercentFormatter
-import threading
 import scipy.stats as stats
 
 # TODO: all classes should have the option to delay audio and video separately
@@ -46,10 +46,9 @@ class DelayFromFile(ParentFrame):
                                           command=self.open_file,
                                           text='Open File')
         self.start_delay_button = tk.Button(self.tk_frame,
-                                            command=lambda:
-                                            [self.keythread.enable_manip(manip='delayed',
-                                                                         button=self.start_delay_button),
-                                             threading.Thread(target=self.start_file_delay, daemon=True).start()],
+                                            command=lambda: self.keythread.enable_manip(
+                                                manip='delayed', button=self.start_delay_button
+                                            ) and self.start_file_delay(),
                                             text='Start Delay')
         self.plot_prog_button = tk.Button(self.tk_frame, command=self.plot_delay_prog,
                                           text='Plot Progression')
@@ -140,52 +139,40 @@ class DelayFromFile(ParentFrame):
             self.keythread.reset_manips()
             return
 
-        # Set states of entry windows
-        self.resample_entry.config(state='readonly')
-        self.delay_time_entry.config(state='normal')
-
-        loop_var = 0
-        while self.params['delayed']:
-            # We need to start a timer so we know how long it took to execute all the code below
-            start_time = time.time()
+        # The file is compiled into a timeline, played by the delay scheduler and looping back to the start at the end
+        start_delay_timeline(
+            self,
+            timeline=DelayTimeline.from_array(self.file, resample, max_delay=self.params['*max delay time']),
+            on_tick=self.file_delay_tick,
+            on_start=lambda: [self.resample_entry.config(state='readonly'),
+                              self.delay_time_entry.config(state='normal')],
+            on_finish=self.file_delay_finished,
             # If the count-in hasn't finished, we don't want to start delaying yet
-            if self.keythread.reathread.project.play_position < self.keythread.reathread.project.markers[1].position:
-                self.gui.log_text(text='Waiting for end of count-in to start delay...')
-                set_delay_time(params=self.params, d_time=0, reathread=self.keythread.reathread)
-                self.delay_time_entry.delete(0, 'end')
-                loop_var = 0
-                time.sleep(0.3)
-            else:
-                # Get next value from array
-                i = self.file[loop_var]
-                # Set the delay time to the value from the array
-                set_delay_time(params=self.params, d_time=int(i), reathread=self.keythread.reathread)
-                # Insert the delay value into the GUI
-                self.delay_time_entry.delete(0, 'end')
-                self.delay_time_entry.insert(0, str(round(i)))
-                # Increment the loop variable, and if we've reached the end of the array, reset to the start and log
-                loop_var += 1
-                if loop_var == len(self.file):
-                    self.gui.log_text(text='Reached the end of array, looping back to start.')
-                    loop_var = 0
-                # Calculate how long it has taken to carry out all the above actions
-                pre_resample_time = time.time()
-                # Wait for the resample rate minus the time it has taken for the above actions
-                try:
-                    time.sleep(resample-(pre_resample_time-start_time))
-                except ValueError:
-                    time.sleep(resample)
-                # Log the array position and the actual resample time in the GUI (for monitoring)
-                end_time = time.time()
-                self.gui.log_text(text=f'{loop_var}/{len(self.file)}')
-                self.gui.log_text(text=f'{round(end_time-start_time, 2)}')
+            hold=self.keythread.reathread.countin_remaining,
+            on_hold=self.file_delay_hold,
+        )
+
+    def file_delay_tick(self, index, value):
+        # Set the delay time to the value from the array, and insert it into the GUI
+        set_delay_time(params=self.params, d_time=int(value), reathread=self.keythread.reathread)
+        self.delay_time_entry.delete(0, 'end')
+        self.delay_time_entry.insert(0, str(round(value)))
+        # Log the array position in the GUI (for monitoring), and whether we're about to loop back to the start
+        position = index % len(self.file) + 1
+        self.gui.log_text(text=f'{position}/{len(self.file)}')
+        if position == len(self.file):
+            self.gui.log_text(text='Reached the end of array, looping back to start.')
+
+    def file_delay_hold(self):
+        self.gui.log_text(text='Waiting for end of count-in to start delay...')
+        set_delay_time(params=self.params, d_time=0, reathread=self.keythread.reathread)
+        self.delay_time_entry.delete(0, 'end')
 
+    def file_delay_finished(self, _):
         # Once delaying has finished, delete anything in the delay time entry and reset states
         self.delay_time_entry.delete(0, 'end')
         self.delay_time_entry.config(state='readonly')
         self.resample_entry.config(state='normal')
-        # We should return so we don't have any issues with the threading
-        return
 
     def plot_delay_prog(self):
         fig, ax = plt.subplots()
@@ -223,13 +210,9 @@ class FixedDelay(ParentFrame):
 
         self.combo = self.get_tk_combo()
         self.start_delay_button = tk.Button(self.tk_frame,
-                                            command=lambda: [
-                                                self.keythread.enable_manip(manip='delayed',
-                                                                            button=self.start_delay_button),
-                                                set_delay_time(d_time=self.try_get_entry(self.delay_time_entry),
-                                                               params=self.params,
-                                                               reathread=self.keythread.reathread)
-                                            ],
+                                            command=lambda: self.keythread.enable_manip(
+                                                manip='delayed', button=self.start_delay_button
+                                            ) and self.start_fixed_delay(),
                                             text='Start Delay')
 
         self.tk_list = [
@@ -240,6 +223,10 @@ class FixedDelay(ParentFrame):
         ]
         self.organise_pane()
 
+    def start_fixed_delay(self):
+        set_delay_time(d_time=self.try_get_entry(self.delay_time_entry), params=self.params,
+                       reathread=self.keythread.reathread)
+
     def get_tk_combo(self):
         preset_list = [v for (k, v) in self.params["*delay time presets"].items()]
         combo = ttk.Combobox(self.tk_frame, state='readonly',
@@ -273,10 +260,9 @@ class VariableDelay(ParentFrame):
         self.plot_dist_button = tk.Button(self.tk_frame, command=self.plot_distribution,
                                           text='Plot Distribution')
         self.start_delay_button = tk.Button(self.tk_frame,
-                                            command=lambda:
-                                            [self.keythread.enable_manip(manip='delayed',
-                                                                         button=self.start_delay_button),
-                                             threading.Thread(target=self.start_variable_delay, daemon=True).start()],
+                                            command=lambda: self.keythread.enable_manip(
+                                                manip='delayed', button=self.start_delay_button
+                                            ) and self.start_variable_delay(),
                                             text='Start Delay')
         self.delay_time_frame, self.delay_time_entry, self.delay_time_label = self.get_tk_entry(t1='Delay Time:')
         self.delay_time_entry.config(state='readonly')
@@ -346,7 +332,6 @@ class VariableDelay(ParentFrame):
         return x, y
 
     def start_variable_delay(self):
-        # TODO: fix the occasional valueerror arising here
         resample = self.try_get_entry(self.resample_entry)
         # If we gave a non-integer resample value, quit the function, reset all the manipulations, and print to the GUI
         if resample is None:
@@ -365,30 +350,32 @@ class VariableDelay(ParentFrame):
             self.keythread.reset_manips()
             return
 
-        # Set states of entry windows
-        self.delay_time_entry.config(state='normal')
-        self.resample_entry.config(state='readonly')
-
-        while self.params['delayed']:
-            # Get the time before carrying out the delay
-            start_time = time.time()
-            self.delay_value = abs(np.random.choice(self.dist))
-            self.delay_time_entry.delete(0, 'end')
-            self.delay_time_entry.insert(0, str(round(self.delay_value)))
-            set_delay_time(params=self.params, d_time=self.delay_value, reathread=self.keythread.reathread)
-            # Calculate how long it has taken to carry out all the above actions
-            pre_resample_time = time.time()
-            # Wait for the resample rate minus the time it has taken for the above actions
-            time.sleep(resample - (pre_resample_time - start_time))
-            # Log the actual resample time in the GUI (for monitoring)
-            end_time = time.time()
-            self.gui.log_text(text=f'{round(end_time - start_time, 2)}')
+        # A new delay time is drawn from the distribution for every tick of the timeline, all before we start
+        timeline = DelayTimeline.from_distribution(self.dist, resample, length=self.params['*var delay length'],
+                                                   seed=self.params['*var delay seed'],
+                                                   max_delay=self.params['*max delay time'])
+        start_delay_timeline(
+            self,
+            timeline=timeline,
+            # Only automate a sequence we could draw again from its seed, so the automation can always be reproduced
+            automate=self.params['*var delay seed'] is not None,
+            on_tick=self.variable_delay_tick,
+            on_start=lambda: [self.delay_time_entry.config(state='normal'),
+                              self.resample_entry.config(state='readonly')],
+            on_finish=self.variable_delay_finished,
+        )
+
+    def variable_delay_tick(self, _, value):
+        self.delay_value = value
+        self.delay_time_entry.delete(0, 'end')
+        self.delay_time_entry.insert(0, str(round(self.delay_value)))
+        set_delay_time(params=self.params, d_time=self.delay_value, reathread=self.keythread.reathread)
 
+    def variable_delay_finished(self, _):
         # Reset states of entry windows
         self.delay_time_entry.delete(0, 'end')
         self.delay_time_entry.config(state='readonly')
         self.resample_entry.config(state='normal')
-        return
 
 
 class IncrementalDelay(ParentFrame):
@@ -399,6 +386,7 @@ class IncrementalDelay(ParentFrame):
         self.dist = None
         self.dist_unsmoothed = None
         self.delay_value = float
+        self.start_time = None
 
         self.combo = self.get_tk_combo()
         self.frame_1, self.start_entry, self.label_1 = self.get_tk_entry(t1='Start:',)
@@ -416,12 +404,9 @@ class IncrementalDelay(ParentFrame):
         self.plot_dist_button = tk.Button(self.tk_frame, command=self.plot_distribution,
                                           text='Plot Space')
         self.start_delay_button = tk.Button(self.tk_frame,
-                                            command=lambda:
-                                            [self.keythread.enable_manip(manip='delayed',
-                                                                         button=self.start_delay_button),
-                                             threading.Thread(target=self.get_incremental_delay,
-                                                              daemon=True)
-                                                      .start()],
+                                            command=lambda: self.keythread.enable_manip(
+                                                manip='delayed', button=self.start_delay_button
+                                            ) and self.get_incremental_delay(),
                                             text='Start Delay')
 
         self.tk_list = [tk.Label(self.tk_frame, text='Incremental Delay'),
@@ -513,34 +498,37 @@ class IncrementalDelay(ParentFrame):
         pack_distribution_display(fig)
 
     def get_incremental_delay(self):
+        resample = self.try_get_entry(self.resample_entry)
+        # If we haven't got a resample rate or a delay space, we can't start the delay
+        if resample is None or self.dist is None:
+            self.gui.log_text(text='No delay space calculated: delay aborted.')
+            self.keythread.reset_manips()
+            return
+        # Each value in our delay array is set one resample apart, so the whole array takes exactly the length asked for
+        start_delay_timeline(
+            self,
+            timeline=DelayTimeline.from_space(self.dist, resample / 1000, max_delay=self.params['*max delay time']),
+            on_tick=self.incremental_delay_tick,
+            on_start=self.incremental_delay_started,
+            on_finish=self.incremental_delay_finished,
+        )
+
+    def incremental_delay_started(self):
         self.delay_time_entry.config(state='normal')
-        resample = self.try_get_entry(self.resample_entry) / 1000
-        start = time.time()
-
-        # Iterate through our delay array
-        for num in self.dist:
-            start_time = time.time()
-            self.delay_time_entry.delete(0, 'end')
-            self.delay_time_entry.insert(0, num)
-            set_delay_time(params=self.params, d_time=int(num), reathread=self.keythread.reathread)
-            # If we're still delaying, wait for the resample rate
-            if self.params['delayed']:
-                # Calculate how long it has taken to carry out all the above actions
-                pre_resample_time = time.time()
-                # Wait for the resample rate minus the time it has taken for the above actions
-                time.sleep(resample - (pre_resample_time - start_time))
-                # Log the actual resample time in the GUI (for monitoring)
-                end_time = time.time()
-                self.gui.log_text(text=f'{round(end_time - start_time, 2)}')
-            else:
-                break
+        self.start_time = time.perf_counter()
+
+    def incremental_delay_tick(self, _, value):
+        self.delay_time_entry.delete(0, 'end')
+        self.delay_time_entry.insert(0, str(int(value)))
+        set_delay_time(params=self.params, d_time=int(value), reathread=self.keythread.reathread)
 
+    def incremental_delay_finished(self, completed):
         # Log completion time in the gui console (to check against length inputted by user)
-        end = time.time()
-        self.gui.log_text(f'Incremental delay finished in {round(end - start, 2)} secs!')
+        self.gui.log_text(f'Incremental delay finished in {round(time.perf_counter() - self.start_time, 2)} secs!')
 
         # If the delay has climbed all the way down to 0, we can turn off the delay as it's now unnecessary
-        if self.params['*delay time'] <= 1:  # <=1 is used here as we may have substituted 1 for 0 when using np.log()
+        # <=1 is used here as we may have substituted 1 for 0 when using np.log()
+        if completed and self.params['*delay time'] <= 1:
             self.keythread.reset_manips()
             self.delay_time_entry.delete(0, 'end')  # Only delete the text if we're also turning off the delay
         # Otherwise, we still need to keep the delay on.
@@ -558,6 +546,35 @@ def pack_distribution_display(fig):
     canvas.get_tk_widget().pack()
 
 
+def start_delay_timeline(pane, timeline: DelayTimeline, automate: bool = True, **callbacks):
+    """Starts running a pane's delay timeline. If set in UserParams (and the pane allows it), the whole timeline is
+    written into automation in Reaper first, and the video starts following it as soon as Reaper reaches the start of
+    the automation."""
+    # The delay may have been turned off again before we got here, in which case there's nothing to automate
+    if pane.params['*delay automation'] and automate and pane.params['delayed']:
+        reathread = pane.keythread.reathread
+        start = reathread.write_delay_automation(timeline, length=pane.params['*delay automation length'],
+                                                 lead=pane.params['*delay automation lead'])
+        pane.gui.log_text(text=f'Delay written into Reaper automation from {round(start, 2)} secs')
+        callbacks['hold'] = hold_until(reathread, start)
+    pane.keythread.delay_scheduler.start(timeline, **callbacks)
+
+
+def hold_until(reathread, position: float):
+    """Returns a hold for the delay scheduler that waits for Reaper to reach a position. Once it has, we stop asking
+    Reaper where it is, so nothing at all is sent to Reaper while the automation plays."""
+    reached = False
+
+    def hold():
+        nonlocal reached
+        if reached:
+            return 0
+        remaining = position - reathread.play_position()
+        reached = remaining <= 0
+        return max(remaining, 0)
+    return hold
+
+
 def set_delay_time(params, d_time: int, reathread=None):
     params['*delay time'] = d_time if 0 <= d_time < params['*max delay time'] else 0
     if reathread is not None:
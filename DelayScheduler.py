@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+from DelayTimeline import DelayTimeline
+
+# Time (in seconds) between checks of whether a sequence that's being held (e.g. during the count-in) can carry on
+HOLD_POLL = 0.3
+
+
+class DelayScheduler:
+    """Runs the delay timeline of whichever delay pane is active, from a single thread shared by every pane.
+
+    Each tick is due exactly one period after the one before it, counting from when the timeline started rather than
+    from when the last tick finished, so time spent setting the delay (e.g. in Reaper) never builds up. The running
+    timeline is also put in params, so the video can look up the current delay itself without waiting for a tick."""
+    def __init__(self, params: dict, stop_event: threading.Event):
+        self.params = params
+        self.stop_event = stop_event
+        self.condition = threading.Condition()
+        # Sequence waiting to replace the one currently running, set by the GUI thread
+        self.pending = None
+        # How late each tick ran, in milliseconds
+        self.jitter = deque(maxlen=1024)
+        self.ticks, self.skipped = 0, 0
+        # Every run of a timeline as (timeline, start, stop), so they can be saved alongside recordings
+        self.runs = deque(maxlen=256)
+        threading.Thread(target=self.main_loop, daemon=True).start()
+
+    def start(self, timeline: DelayTimeline, on_tick, on_start=None, on_finish=None, hold=None, on_hold=None):
+        """Starts running a timeline, replacing any timeline already running.
+
+        on_tick(index, value) is called with the delay time for each tick. While hold() returns True (or the number of
+        seconds left to wait) the timeline waits, calling on_hold(), and starts again from the beginning once it's
+        released. on_finish(completed) is
+        called when the timeline ends (if it doesn't loop), the delay is turned off, or it's replaced."""
+        with self.condition:
+            self.pending = {
+                "timeline": timeline,
+                "on_tick": on_tick,
+                "on_start": on_start,
+                "on_finish": on_finish,
+                "hold": hold,
+                "on_hold": on_hold,
+            }
+            self.condition.notify()
+
+    def main_loop(self) -> None:
+        seq, deadline, index, holding = None, 0, 0, False
+        while not self.stop_event.is_set():
+            with self.condition:
+                # Sleep until the next tick is due, or until we're given a new sequence to run
+                if self.pending is None:
+                    self.condition.wait(timeout=HOLD_POLL if seq is None else deadline - time.perf_counter())
+                new, self.pending = self.pending, None
+            if new is not None:
+                if seq is not None:
+                    self.finish(seq, completed=False)
+                seq, deadline, index, holding = new, time.perf_counter(), 0, False
+                self.publish(seq, deadline)
+                if not self.call(seq, 'on_start'):
+                    seq = None
+                continue
+            now = time.perf_counter()
+            if seq is None or now < deadline:
+                continue
+            # The sequence ends as soon as the delay is turned off
+            if not self.params['delayed']:
+                seq = self.finish(seq, completed=False)
+                continue
+            # While held, check again every so often, and restart the sequence (and its timing) once released
+            # hold() can also return how long is left to wait, so we can start as close as possible to the right time
+            try:
+                remaining = seq["hold"]() if seq["hold"] is not None else 0
+            except Exception as e:
+                # As with every other callback, only this sequence stops (e.g. if Reaper isn't responding)
+                print(f'Delay sequence stopped: hold raised {e!r}')
+                seq = self.finish(seq, completed=False)
+                continue
+            if remaining:
+                if not holding:
+                    self.unpublish(seq, now)
+                if not self.call(seq, 'on_hold'):
+                    seq = None
+                index, holding = 0, True
+                deadline = now + (HOLD_POLL if remaining is True else min(remaining, HOLD_POLL))
+                continue
+            if holding:
+                holding, deadline = False, now
+                self.publish(seq, deadline)
+            seq, deadline, index = self.tick(seq, deadline, index, now)
+        if seq is not None:
+            self.finish(seq, completed=False)
+
+    def tick(self, seq: dict, deadline: float, index: int, now: float) -> tuple:
+        late = now - deadline
+        self.jitter.append(late * 1000)
+        self.ticks += 1
+        # If we've woken up more than a whole period late, we can either skip the ticks we've missed (so every value
+        # is set when it should be, as if we'd never been late) or catch up by running every missed tick straight away
+        timeline = seq["timeline"]
+        period = timeline.period
+        if late >= period and self.params['*delay late ticks'] == 'skip':
+            missed = int(late // period)
+            self.skipped += missed
+            index += missed
+            deadline += missed * period
+        if not timeline.loop and index >= len(timeline):
+            return self.finish(seq, completed=True), deadline, index
+        value = timeline.delays[index % len(timeline)]
+        if not self.call(seq, 'on_tick', index, value):
+            return None, deadline, index
+        return seq, deadline + timeline.period, index + 1
+
+    def call(self, seq: dict, callback: str, *args) -> bool:
+        # An error in one pane's sequence (e.g. if Reaper isn't responding) shouldn't stop every other pane's sequences
+        if seq[callback] is None:
+            return True
+        try:
+            seq[callback](*args)
+        except Exception as e:
+            print(f'Delay sequence stopped: {callback} raised {e!r}')
+            if callback != 'on_finish':
+                self.finish(seq, completed=False)
+            return False
+        return True
+
+    def finish(self, seq: dict, completed: bool) -> None:
+        self.unpublish(seq, time.perf_counter())
+        self.call(seq, 'on_finish', completed)
+        return None
+
+    def publish(self, seq: dict, start: float) -> None:
+        # The timeline's ticks are all worked out from this start time, by us and by anything looking up the delay
+        seq["timeline"].start = start
+        self.params['*delay timeline'] = seq["timeline"]
+
+    def unpublish(self, seq: dict, stop: float) -> None:
+        timeline = seq["timeline"]
+        if timeline.start is None:
+            return
+        # Finished timelines stop running as soon as they reach their end, even if we're late getting to them
+        if not timeline.loop:
+            stop = min(stop, timeline.start + len(timeline) * timeline.period)
+        self.runs.append((timeline, timeline.start, stop))
+        # Take the timeline out of params before stopping it, so nothing looks up a delay from it once it's stopped
+        if self.params.get('*delay timeline') is timeline:
+            self.params['*delay timeline'] = None
+        timeline.start = None
+
+    def export(self, filename: str, origin: float) -> bool:
+        """Saves every delay time applied since origin (e.g. the start of a recording), with times relative to it"""
+        runs = [(t, start, stop) for t, start, stop in list(self.runs) if stop > origin]
+        # Include the timeline still running, up to now
+        current = self.params.get('*delay timeline')
+        if current is not None and current.start is not None:
+            runs.append((current, current.start, time.perf_counter()))
+        for num, (timeline, start, stop) in enumerate(runs):
+            timeline.export(filename, start=start, stop=stop, origin=origin, append=num > 0)
+        return bool(runs)
+
+    def stats(self) -> dict | None:
+        """Returns how late ticks have been running, in milliseconds, and how many we've had to skip"""
+        jitter = list(self.jitter)
+        if not jitter:
+            return None
+        return {'ticks': self.ticks, 'skipped': self.skipped, 'jitter': sum(jitter) / len(jitter),
+                'max jitter': max(jitter)}
@@ -0,0 +1,81 @@
+import csv
+import numpy as np
+
+
+class DelayTimeline:
+    """A delay sequence compiled ahead of time: one delay time (in ms) for every tick, each a fixed period apart.
+
+    As ticks are evenly spaced, the delay at any moment is found in constant time, so the video and audio can both
+    look up the current delay themselves rather than waiting for the scheduler to tell them."""
+    def __init__(self, delays, period: float, loop: bool = False, max_delay: float = None):
+        self.delays = np.asarray(delays, dtype=np.float64)
+        if not len(self.delays):
+            raise ValueError('Delay timeline must contain at least one delay time')
+        # Delay times we can't apply are replaced with no delay, in the same way as when setting the delay time directly
+        if max_delay is not None:
+            self.delays[(self.delays < 0) | (self.delays >= max_delay)] = 0
+        self.period = period
+        # Whether to go back to the start once we reach the end, or hold the last delay time
+        self.loop = loop
+        # Time (from time.perf_counter) the first tick was applied, set by the scheduler when the timeline starts
+        self.start = None
+
+    @classmethod
+    def from_array(cls, array, period: float, max_delay: float = None):
+        """Plays through an array of delay times (e.g. loaded from a file), looping back to the start at the end"""
+        return cls(np.ravel(array), period, loop=True, max_delay=max_delay)
+
+    @classmethod
+    def from_distribution(cls, dist, period: float, length: float, seed: int = None, max_delay: float = None):
+        """Draws a new delay time from a distribution on every tick, for length seconds (after which it loops).
+        Given a seed, the same sequence is drawn every time."""
+        rng = np.random.default_rng(seed)
+        delays = np.abs(rng.choice(dist, size=max(round(length / period), 1)))
+        return cls(delays, period, loop=True, max_delay=max_delay)
+
+    @classmethod
+    def from_space(cls, space, period: float, max_delay: float = None):
+        """Steps through a delay space once (e.g. an incremental delay), holding the final delay time at the end"""
+        return cls(space, period, loop=False, max_delay=max_delay)
+
+    def __len__(self) -> int:
+        return len(self.delays)
+
+    def index_at(self, timestamp: float) -> int | None:
+        """Returns the tick due at a given time, or None if the timeline isn't running"""
+        # Read once, as the scheduler can stop the timeline (setting start to None) at any moment
+        start = self.start
+        if start is None:
+            return None
+        index = max(int((timestamp - start) // self.period), 0)
+        return index % len(self.delays) if self.loop else min(index, len(self.delays) - 1)
+
+    def changes(self, length: float) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the offset (in seconds) and delay time of every tick that changes the delay, up to length seconds
+        in (a timeline that doesn't loop ends sooner), e.g. for writing the timeline into automation"""
+        count = max(round(length / self.period), 1) if self.loop else len(self.delays)
+        delays = np.resize(self.delays, count)
+        changed = np.concatenate(([True], delays[1:] != delays[:-1]))
+        return np.flatnonzero(changed) * self.period, delays[changed]
+
+    def value_at(self, timestamp: float, default: float = None) -> float:
+        """Returns the delay time (in ms) that should be applied at a given time, or default if the timeline isn't
+        running"""
+        index = self.index_at(timestamp)
+        return default if index is None else float(self.delays[index])
+
+    def export(self, filename: str, start: float, stop: float, origin: float, append: bool = False) -> None:
+        """Writes the delay times applied between start and stop, as times (in seconds) from origin (e.g. the
+        recording start), so every delay change can be lined up with the recordings"""
+        ticks = np.arange(max(int(np.ceil((stop - start) / self.period)), 0))
+        times = start + ticks * self.period
+        with open(filename, 'a' if append else 'w', newline='') as f:
+            writer = csv.writer(f)
+            if not append:
+                writer.writerow(['time (s)', 'delay (ms)'])
+            for tick, time in zip(ticks, times):
+                # Only the delay time already applied when origin was reached is included from before it
+                if time + self.period <= origin:
+                    continue
+                delay = self.delays[tick % len(self.delays)] if self.loop else self.delays[min(tick, len(self) - 1)]
+                writer.writerow([round(max(time - origin, 0), 4), round(float(delay), 2)])
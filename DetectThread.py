@@ -0,0 +1,160 @@
+import threading
+import time
+import numpy as np
+from cv2 import cv2
+from collections import deque
+
+
+class DetectThread:
+    """Detects regions to blank (e.g. faces, eyes) in the background, so the performer view never waits on detection"""
+    def __init__(self, params: dict, blank_params: dict):
+        self.params = params
+        # Cascade and tracking settings for each kind of region we can detect (e.g. 'face', 'eye')
+        self.blank_params = blank_params
+        for target in self.blank_params.values():
+            target.update(self.get_detection_state())
+
+        # The most recent frame submitted by the performer view: only ever holds one frame, the newest
+        self.condition = threading.Condition()
+        self.pending = None
+        self.submitted = 0
+        # Frames that won't stay valid until the detector's finished with them are copied into one of these two
+        # buffers, never into the one the detector is currently working on
+        self.copies = [None, None]
+        self.in_use = None
+        # The newest regions found for each target, along with their velocity and the capture time of their frame
+        self.published = {}
+        # Guards the tracking state in blank_params and published, which the performer view can reset at any time.
+        # Detection itself runs without it, so the performer view never waits for the detector.
+        self.state_lock = threading.Lock()
+        # Goes up on every reset, so regions found in a frame submitted before a reset are thrown away
+        self.generation = 0
+
+        # Time taken to run detection, and how old the regions drawn on each frame were, both in milliseconds
+        self.latency = deque(maxlen=256)
+        self.staleness = deque(maxlen=256)
+
+    def get_detection_state(self) -> dict:
+        """Returns the settings and tracking state used to speed up detection of blanked regions"""
+        return {
+            "detectScale": self.params['*blank detection']['scale'],    # Run the detector on an image scaled by this
+            "roiPadding": self.params['*blank detection']['padding'],   # Search this many box sizes around last boxes
+            "detectEvery": self.params['*blank detection']['every'],    # Only run the detector every N frames
+            "found": False,     # Whether previous_detection came from the most recent run of the detector
+            "velocity": np.zeros((1, 4)),   # Movement of the boxes per second between the last two detections
+            "detectedAt": None,     # Capture time of the frame previous_detection was found in
+            "lastSubmitted": -np.inf,   # Frame number of the last frame we ran the detector on
+        }
+
+    def start(self, stop_event: threading.Event) -> None:
+        threading.Thread(target=self.main_loop, args=(stop_event,), daemon=True).start()
+
+    def submit(self, frame: np.ndarray, timestamp: float, target: str, copy: bool = False, derived=None) -> None:
+        """Hands the newest frame to the detector, replacing any frame it hasn't got round to yet. If the frame's
+        derived versions are given (from its FrameRing), the detector uses the scaled frame from there."""
+        # Live frames aren't copied: the detector finishes with them long before CamRead overwrites their slot in the
+        # ring. Frames from the delay or loop buffers can be reused straight away, so need copying first.
+        with self.condition:
+            index = None
+            if copy:
+                index = 1 if self.in_use == 0 else 0
+                if self.copies[index] is None or self.copies[index].shape != frame.shape:
+                    self.copies[index] = np.empty_like(frame)
+                np.copyto(self.copies[index], frame)
+                frame = self.copies[index]
+            self.submitted += 1
+            self.pending = (frame, timestamp, target, self.submitted, index, derived)
+            self.condition.notify()
+
+    def main_loop(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.pending is not None, timeout=1):
+                    continue
+                frame, timestamp, target, number, self.in_use, derived = self.pending
+                self.pending = None
+            with self.state_lock:
+                params = self.blank_params[target]
+                # When we're already tracking regions, we only need to run the detector every N frames
+                if params["found"] and number - params["lastSubmitted"] < params["detectEvery"]:
+                    continue
+                params["lastSubmitted"] = number
+                # The detector searches using the state as it is now, even if it's reset while it's running
+                search, generation = dict(params), self.generation
+            start = time.perf_counter()
+            try:
+                regions = self.run_detector(frame, search, derived)
+            except Exception as e:
+                # A bad frame (or detector) shouldn't stop detection for every frame after it
+                print(f'Detection of {target} failed: {e!r}')
+                continue
+            self.latency.append((time.perf_counter() - start) * 1000)
+            with self.state_lock:
+                if generation == self.generation:
+                    self.track(regions, timestamp, target, params)
+
+    def track(self, regions: np.ndarray, timestamp: float, target: str, params: dict) -> None:
+        """Updates the tracking state of a target with the regions just found for it, and publishes them"""
+        if len(regions) == params["minNum"]:
+            # Sort the boxes left-to-right, so we compare the same box (e.g. the same eye) between detections
+            regions = regions[np.argsort(regions[:, 0])]
+            if params["found"] and timestamp > params["detectedAt"]:
+                params["velocity"] = (regions - params["previous_detection"]) / (timestamp - params["detectedAt"])
+            params["previous_detection"] = regions
+            params["found"] = True
+        else:
+            # Our next search will cover the whole frame again, as the boxes weren't where we expected them
+            params["velocity"] = np.zeros((1, 4))
+            params["found"] = False
+        params["detectedAt"] = timestamp
+        self.published[target] = (params["previous_detection"], params["velocity"], timestamp)
+
+    @staticmethod
+    def run_detector(frame: np.ndarray, params: dict, derived=None) -> np.ndarray:
+        """Runs the detector on a downscaled copy of the frame, only around the boxes we found last time"""
+        h, w = frame.shape[:2]
+        x0, y0, x1, y1 = 0, 0, w, h
+        if params["found"]:
+            boxes = params["previous_detection"]
+            pad = (boxes[:, 2:].max(axis=0) * params["roiPadding"]).astype(int)
+            x0, y0 = np.maximum((boxes[:, :2] - pad).min(axis=0), 0)
+            x1, y1 = np.minimum((boxes[:, :2] + boxes[:, 2:] + pad).max(axis=0), (x1, y1))
+        scale = params["detectScale"]
+        detector = params["detector"]
+        if derived is None:
+            roi = cv2.resize(frame[y0:y1, x0:x1], (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            # Crop the search area out of the whole frame, scaled (and converted to gray, if the detector wants it)
+            # once and shared with any other consumer that needs the same version
+            size = (round(w * scale), round(h * scale))
+            scaled = derived.gray(size) if detector.gray else derived.scaled(size)
+            roi = scaled[round(y0 * scale):round(y1 * scale), round(x0 * scale):round(x1 * scale)]
+        regions = detector.detect(roi)
+        # Convert the boxes back to the coordinates of the full-resolution frame
+        return (np.asarray(regions) / scale).astype(int) + [x0, y0, 0, 0]
+
+    def latest(self, target: str, timestamp: float) -> np.ndarray:
+        """Returns the newest regions for a target, moved along to where we expect them to be at the given time"""
+        with self.state_lock:
+            try:
+                regions, velocity, detected_at = self.published[target]
+            except KeyError:
+                return self.blank_params[target]["previous_detection"]
+        self.staleness.append((timestamp - detected_at) * 1000)
+        return (regions + velocity * (timestamp - detected_at)).astype(int)
+
+    def reset(self) -> None:
+        """Forgets everything we've detected, e.g. when manipulations are reset"""
+        with self.state_lock:
+            self.generation += 1
+            self.published.clear()
+            for target in self.blank_params.values():
+                target["previous_detection"] = np.full((1, 4), fill_value=100)
+                target.update(self.get_detection_state())
+
+    def stats(self) -> dict | None:
+        """Returns the mean time taken to run detection, and the mean age of the regions drawn onto frames"""
+        if not self.latency or not self.staleness:
+            return None
+        return {'latency': sum(self.latency) / len(self.latency),
+                'staleness': sum(self.staleness) / len(self.staleness)}
@@ -0,0 +1,98 @@
+import csv
+import os
+import time
+import numpy as np
+from cv2 import cv2
+from RegionDetectors import DETECTORS, get_detector
+from UserParams import params
+
+# Benchmarks every face detector in RegionDetectors on a sample clip, so we can pick the fastest one that keeps up with
+# the camera. Accuracy is measured against hand-labelled boxes if an annotation file is given, or else against the
+# reference detector (ideally the most accurate one available), or the first other detector that loads if it can't.
+clip = r"./input/benchmark_clip.mp4"
+annotations = r"./input/benchmark_clip.csv"     # Rows of frame, x, y, w, h: one row per labelled face
+reference = 'dnn face'
+detectors = [name for name in DETECTORS if name.endswith('face')]
+scale = params['*blank detection']['scale']     # Frames are scaled by the same amount as when blanking
+max_frames = 300
+min_iou = 0.5   # Boxes overlapping by at least this much count as the same face
+
+
+def load_frames():
+    vid = cv2.VideoCapture(clip)
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = vid.read()
+        if not ok:
+            break
+        frames.append(cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+    vid.release()
+    return frames
+
+
+def load_truth(frames, ref):
+    # Use hand-labelled boxes if we have them, scaled to match our frames
+    if os.path.exists(annotations):
+        truth = {num: [] for num in range(len(frames))}
+        with open(annotations) as f:
+            for row in csv.reader(f):
+                num, box = int(row[0]), np.array(row[1:5], dtype=float) * scale
+                if num in truth:
+                    truth[num].append(box)
+        return truth
+    # Otherwise, treat whatever our reference detector finds as the truth
+    for name in [ref] + [n for n in detectors if n != ref]:
+        try:
+            detector = get_detector(name, params['*detector directory'])
+        except ValueError as e:
+            print(f'Could not load reference detector: {e}')
+            continue
+        print(f'No annotations found: measuring accuracy against {name}')
+        return {num: list(detector.detect(frame)) for num, frame in enumerate(frames)}
+    return None
+
+
+def iou(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    overlap = max(0, x1 - x0) * max(0, y1 - y0)
+    return overlap / (a[2] * a[3] + b[2] * b[3] - overlap)
+
+
+def benchmark(name, frames, truth):
+    detector = get_detector(name, params['*detector directory'])
+    detector.detect(frames[0])  # The first run is always much slower, so don't include it
+    true_pos, false_pos, false_neg = 0, 0, 0
+    start = time.perf_counter()
+    found = [detector.detect(frame) for frame in frames]
+    elapsed = time.perf_counter() - start
+    fps = len(frames) / elapsed
+    speed = (f'{name}: {round(fps, 1)} frames/sec ({"keeps up" if fps >= params["*fps"] else "too slow"} '
+             f'at {params["*fps"]} fps)')
+    # Without anything to compare against, we can only measure speed
+    if truth is None:
+        print(speed)
+        return
+    for num, boxes in enumerate(found):
+        matched = sum(any(iou(box, t) >= min_iou for t in truth[num]) for box in boxes)
+        true_pos += matched
+        false_pos += len(boxes) - matched
+        false_neg += max(len(truth[num]) - matched, 0)
+    precision = true_pos / (true_pos + false_pos) if true_pos + false_pos else 0
+    recall = true_pos / (true_pos + false_neg) if true_pos + false_neg else 0
+    print(f'{speed}, precision {round(precision, 2)}, recall {round(recall, 2)}')
+
+
+if __name__ == '__main__':
+    frames = load_frames()
+    if not frames:
+        print(f'Could not read any frames from {clip}')
+    else:
+        truth = load_truth(frames, reference)
+        if truth is None:
+            print('No reference detector could be loaded: measuring speed only')
+        for n in detectors:
+            try:
+                benchmark(n, frames, truth)
+            except ValueError as e:
+                print(f'{n}: {e}')
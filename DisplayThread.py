@@ -0,0 +1,113 @@
+import threading
+import time
+import numpy as np
+from cv2 import cv2
+from collections import deque
+
+
+class DisplayThread:
+    """Owns every OpenCV window, showing the newest frame from each view at a steady rate from a single thread.
+
+    HighGUI isn't safe to call from more than one thread, and every waitKey adds its own wait, so views hand their
+    frames to this thread instead of showing them themselves."""
+    def __init__(self, params: dict, stop_event: threading.Event):
+        self.params = params
+        self.lock = threading.Lock()
+        self.windows = {}
+        # Windows that views have finished with, which we need to destroy from our own thread
+        self.closing = []
+        # Number of times we woke up too late to show frames when we should have
+        self.missed = 0
+        threading.Thread(target=self.main_loop, args=(stop_event,), daemon=True).start()
+
+    def open(self, name: str, role: str = 'performer') -> None:
+        """Registers a window to be shown: researcher windows are shown at a lower rate than performer windows"""
+        refresh = self.params['*researcher refresh'] if role == 'researcher' else self.params['*display refresh']
+        with self.lock:
+            self.windows[name] = {
+                "period": 1 / refresh,
+                "due": 0,   # Time we should next show this window
+                "pending": None,    # Newest frame given to us by the view, which we haven't shown yet
+                "shown": None,  # Frame currently being shown
+                "captured": None,   # Capture time of the pending frame
+                "new": False,   # Whether the pending frame has changed since we last showed it
+                "latency": deque(maxlen=256),   # Time from capture to being shown, in milliseconds
+                "presented": 0,
+            }
+
+    def show(self, name: str, frame: np.ndarray, timestamp: float) -> None:
+        """Hands a frame to be shown in a window, replacing any frame we haven't got round to showing yet"""
+        with self.lock:
+            window = self.windows.get(name)
+            if window is None:
+                return
+            # The view may reuse its frame straight away (and ring frames are shared), so we keep our own copy.
+            # The buffers are only allocated again if the size of the frames changes.
+            if window["pending"] is None or window["pending"].shape != frame.shape:
+                window["pending"] = np.empty_like(frame)
+            np.copyto(window["pending"], frame)
+            window["captured"] = timestamp
+            window["new"] = True
+
+    def close(self, name: str) -> None:
+        with self.lock:
+            if self.windows.pop(name, None) is not None:
+                self.closing.append(name)
+
+    def main_loop(self, stop_event: threading.Event) -> None:
+        period = 1 / self.params['*display refresh']
+        deadline = time.perf_counter()
+        while not stop_event.is_set():
+            self.present(deadline)
+            # A single waitKey handles the events for every window we own
+            cv2.waitKey(1)
+            self.destroy_closed()
+            # Deadlines are worked out from the last one, not from when we woke, so the rate doesn't drift
+            deadline += period
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                # We've missed at least one refresh: skip them rather than trying to catch up all at once
+                skipped = int(-remaining // period) + 1
+                self.missed += skipped
+                deadline += skipped * period
+        cv2.destroyAllWindows()
+
+    def present(self, now: float) -> None:
+        """Shows the newest frame in every window that's due to be refreshed"""
+        with self.lock:
+            due = []
+            for name, window in self.windows.items():
+                if not window["new"] or now < window["due"]:
+                    continue
+                # Swap the buffers, so the view can give us its next frame while we're showing this one
+                window["pending"], window["shown"] = window["shown"], window["pending"]
+                window["new"] = False
+                window["due"] = max(window["due"] + window["period"], now)
+                due.append((name, window, window["captured"]))
+        presented = []
+        for name, window, captured in due:
+            cv2.imshow(name, window["shown"])
+            presented.append((window, (time.perf_counter() - captured) * 1000))
+        with self.lock:
+            for window, latency in presented:
+                window["latency"].append(latency)
+                window["presented"] += 1
+
+    def destroy_closed(self) -> None:
+        with self.lock:
+            closing, self.closing = self.closing, []
+        for name in closing:
+            cv2.destroyWindow(name)
+
+    def stats(self, names: list = None) -> dict:
+        """Returns the mean and worst time from capture to display for each window, and the number of late refreshes"""
+        with self.lock:
+            windows = {n: (w["presented"], list(w["latency"])) for n, w in self.windows.items()
+                       if (names is None or n in names) and w["latency"]}
+        return {
+            'missed': self.missed,
+            'windows': {n: {'presented': presented, 'latency': sum(lat) / len(lat), 'max latency': max(lat)}
+                        for n, (presented, lat) in windows.items()},
+        }
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+
+# Every recording is written with a .frames file alongside it, holding one of these for every frame in the video.
+# Times are in seconds from time.perf_counter(), the same clock used for the session start time and by every camera.
+INDEX_DTYPE = np.dtype([
+    ('frame', '<i8'),   # Position of the frame in the video (across every segment, if the recording is segmented)
+    ('captured', '<f8'),    # When the camera captured the frame shown (which may be earlier, e.g. when delayed)
+    ('presented', '<f8'),   # When the frame was shown to the performer (or, for the researcher's recording, read)
+])
+# Identifies the file type and version: the records follow straight after this
+INDEX_MAGIC = b'FRMIDX01'
+
+
+class FrameIndexWriter:
+    """Appends a record for every frame written to a video. Records are only ever added to the end of the file, so
+    everything written before a crash can still be read."""
+    def __init__(self, filename: str, flush_every: int = 30):
+        self.file = open(filename, 'wb')
+        self.file.write(INDEX_MAGIC)
+        self.record = np.zeros(1, dtype=INDEX_DTYPE)
+        self.count = 0
+        # Records are flushed to disk every this many frames
+        self.flush_every = flush_every
+
+    def append(self, captured: float, presented: float) -> None:
+        self.record['frame'] = self.count
+        self.record['captured'] = captured
+        self.record['presented'] = presented
+        self.file.write(self.record.tobytes())
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class FrameIndex:
+    """Reads the .frames file written alongside a recording, to convert between frame numbers and exact times"""
+    def __init__(self, filename: str):
+        with open(filename, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f'{filename} is not a frame index')
+        # Ignore any record only partly written (e.g. if the program crashed while writing it)
+        count = (os.path.getsize(filename) - len(INDEX_MAGIC)) // INDEX_DTYPE.itemsize
+        self.records = np.memmap(filename, dtype=INDEX_DTYPE, mode='r', offset=len(INDEX_MAGIC), shape=(count,))
+
+    @classmethod
+    def for_video(cls, video: str):
+        """Opens the index written alongside a video (or the .ffconcat list of a segmented recording)"""
+        return cls(os.path.splitext(video)[0] + '.frames')
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def time_of(self, frame: int, column: str = 'presented') -> float:
+        """Returns when a frame was presented (or captured)"""
+        return float(self.records[column][frame])
+
+    def frame_at(self, timestamp: float, column: str = 'presented') -> int:
+        """Returns the frame showing at a given time: the last one presented (or captured) at or before it.
+        Capture times are only in order for the researcher's recording, as the performer may see earlier frames."""
+        return max(int(np.searchsorted(self.records[column], timestamp, side='right')) - 1, 0)
+
+    def duration(self) -> float:
+        """Returns the time between the first and last frames being presented, in seconds"""
+        return float(self.records['presented'][-1] - self.records['presented'][0]) if len(self) else 0.0
+
+    def close(self) -> None:
+        # The file is unmapped once nothing refers to the records any more
+        self.records = None
@@ -0,0 +1,334 @@
+import bisect
+import time
+import threading
+import numpy as np
+from cv2 import cv2
+from multiprocessing import shared_memory
+
+# These are the policies a consumer can use to receive frames from a FrameRing
+DELIVERY_POLICIES = [
+    'latest',   # Mailbox: always jump to the newest frame, dropping anything older that hasn't been read
+    'drop oldest',  # Keep up to maxlen frames waiting, dropping the oldest ones if we fall further behind
+    'block',    # Never drop a frame: CamRead will wait for this consumer before overwriting a slot it hasn't read
+]
+
+
+class FrameRing:
+    """A preallocated ring of frame slots, written by a single CamRead and shared between any number of consumers"""
+    def __init__(self, shape: tuple, length: int = 64, dtype=np.uint8, shared: bool = False, name: str = None):
+        self.length = length
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        # All the memory for our frames is allocated here, once: CamRead writes straight into these slots. If the
+        # ring is shared, it's allocated in shared memory so other processes can attach to it by name.
+        self.shm = None
+        self.attached = name is not None
+        if shared or self.attached:
+            self.shm = shared_memory.SharedMemory(name=name, create=not self.attached, size=self._shared_size())
+            buffer = self.shm.buf
+        else:
+            buffer = bytearray(self._shared_size())
+        # Layout of the buffer: total frames written, then the capture time of each slot, then the slots themselves
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=buffer)
+        # Capture time of the frame in each slot, in seconds from time.perf_counter()
+        self.timestamps = np.ndarray((length,), dtype=np.float64, buffer=buffer, offset=8)
+        self.slots = np.ndarray((length, *shape), dtype=self.dtype, buffer=buffer, offset=8 + 8 * length)
+        # Used to wake up any consumers waiting for a new frame (and CamRead, if it's waiting on a blocking consumer)
+        self.condition = threading.Condition()
+        self.blocking_cursors = []
+        # Versions of each frame derived by consumers (e.g. scaled, grayscale), shared between them all. There's one
+        # cache for every slot, so a frame's versions stay valid for exactly as long as the frame itself, however far
+        # behind a consumer is. Buffers are only allocated once a version is first asked for.
+        self.derived = [DerivedCache(dtype=self.dtype) for _ in range(length)]
+
+    def _shared_size(self) -> int:
+        return 8 + 8 * self.length + self.length * int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def write_index(self) -> int:
+        """Total number of frames committed to the ring: slot for frame n is always n % length"""
+        return int(self.counter[0])
+
+    @classmethod
+    def attach(cls, spec: dict):
+        """Attaches to a ring created in another process, from the dictionary returned by its shared_spec()"""
+        return cls(shape=spec['shape'], length=spec['length'], dtype=spec['dtype'], name=spec['name'])
+
+    def shared_spec(self) -> dict:
+        """Returns everything another process needs to attach to this ring"""
+        return {'name': self.shm.name, 'shape': self.shape, 'length': self.length, 'dtype': self.dtype.str}
+
+    def close(self) -> None:
+        """Releases our handle on the shared memory, removing it entirely if we created it"""
+        if self.shm is not None:
+            # The shared memory can't be closed while any arrays still refer to it
+            self.counter, self.timestamps, self.slots = None, None, None
+            self.shm.close()
+            if not self.attached:
+                self.shm.unlink()
+            self.shm = None
+
+    def next_slot(self) -> np.ndarray:
+        """Returns the slot that the next captured frame should be written into"""
+        # Only consumers using the blocking policy can hold up capture: all others will drop frames instead
+        if self.blocking_cursors:
+            with self.condition:
+                self.condition.wait_for(self._slot_is_free)
+        return self.slots[self.write_index % self.length]
+
+    def _slot_is_free(self) -> bool:
+        # The slot before a cursor's read_index may still be in use by that consumer, so we can't overwrite it either
+        return all(self.write_index - c.read_index + 1 < self.length for c in self.blocking_cursors)
+
+    def commit(self, timestamp: float) -> None:
+        """Marks the frame written into next_slot() as complete and wakes up all waiting consumers"""
+        with self.condition:
+            self.timestamps[self.write_index % self.length] = timestamp
+            self.counter[0] += 1
+            self.condition.notify_all()
+
+    def derivatives(self, index: int):
+        """Returns the derived versions of frame number index, which must still be held in the ring. Nothing is
+        computed until a version is asked for."""
+        return FrameDerivatives(ring=self, index=index)
+
+    def index_of(self, slot: int) -> int:
+        """Returns the number of the frame currently held in a slot"""
+        newest = self.write_index - 1
+        return newest - (newest - slot) % self.length
+
+    def cursor(self, name: str = '', policy: str = 'drop oldest', maxlen: int = None):
+        """Returns a new read cursor over the ring, starting at the next frame to be committed"""
+        c = FrameCursor(ring=self, name=name, policy=policy, maxlen=maxlen)
+        if policy == 'block':
+            with self.condition:
+                self.blocking_cursors.append(c)
+        return c
+
+    def remove_cursor(self, cursor) -> None:
+        """Stops a cursor from holding up capture, e.g. once its consumer has stopped reading"""
+        with self.condition:
+            if cursor in self.blocking_cursors:
+                self.blocking_cursors.remove(cursor)
+            self.condition.notify_all()
+
+
+class FrameCursor:
+    """A single consumer's read position in a FrameRing. Frames returned are views onto the shared ring memory."""
+    def __init__(self, ring: FrameRing, name: str, policy: str, maxlen: int = None):
+        if policy not in DELIVERY_POLICIES:
+            raise ValueError(f'Frame delivery policy must be one of {DELIVERY_POLICIES}, not {policy}')
+        self.ring = ring
+        self.name = name
+        self.policy = policy
+        # We can never hold more frames than the ring has valid slots for, whatever policy we're using
+        self.maxlen = min(maxlen or ring.length - 1, ring.length - 1)
+        self.read_index = ring.write_index
+        # Number of the frame most recently returned by get(), used to find its derived versions
+        self.index = None
+        # Capture time of the frame most recently returned by get()
+        self.timestamp = None
+        # Counters for monitoring how well this consumer is keeping up with the camera
+        self.delivered = 0
+        self.dropped = 0
+
+    @property
+    def lag(self) -> int:
+        """Number of committed frames this consumer hasn't read yet"""
+        return self.ring.write_index - self.read_index
+
+    def get(self, timeout: float = None) -> np.ndarray | None:
+        """Waits for the next frame and returns it, or returns None if no frame arrived before the timeout"""
+        ring = self.ring
+        # A ring attached from another process won't notify us of new frames, so we need to poll it instead
+        if ring.attached and not self._poll(timeout):
+            return None
+        with ring.condition:
+            if not ring.condition.wait_for(lambda: ring.write_index > self.read_index, timeout=timeout):
+                return None
+            # Work out the oldest frame we're allowed to read according to our delivery policy. The slot for
+            # write_index is the one currently being written into, so we can never read that one.
+            oldest = ring.write_index - (1 if self.policy == 'latest' else self.maxlen)
+            if self.read_index < oldest:
+                self.dropped += oldest - self.read_index
+                self.read_index = oldest
+            frame = ring.slots[self.read_index % ring.length]
+            self.timestamp = ring.timestamps[self.read_index % ring.length]
+            self.index = self.read_index
+            self.read_index += 1
+            self.delivered += 1
+            # CamRead may be waiting for us to move on before it can write into the next slot
+            if self.policy == 'block':
+                ring.condition.notify_all()
+        # Consumers must not modify this frame in place, as it is shared with every other cursor on the ring.
+        # Unless we're blocking, it also remains valid only until CamRead has written another (length - 1) frames.
+        return frame
+
+    def _poll(self, timeout: float = None) -> bool:
+        end = None if timeout is None else time.perf_counter() + timeout
+        while self.ring.write_index <= self.read_index:
+            if end is not None and time.perf_counter() > end:
+                return False
+            time.sleep(0.002)
+        return True
+
+    def close(self) -> None:
+        self.ring.remove_cursor(self)
+
+    @property
+    def derived(self):
+        """Returns the derived versions of the frame most recently returned by get()"""
+        return self.ring.derivatives(self.index)
+
+    def stats(self) -> dict:
+        return {'policy': self.policy, 'delivered': self.delivered, 'dropped': self.dropped, 'lag': self.lag}
+
+
+class DerivedCache:
+    """Buffers holding the derived versions of whichever frame is in one slot of a FrameRing. Buffers are allocated
+    once and reused for every later frame written into the slot."""
+    def __init__(self, dtype):
+        self.dtype = dtype
+        # Number of the frame our versions are derived from
+        self.index = None
+        self.buffers = {}
+        self.valid = set()
+        # Consumers in different threads may ask for the same version at once: only one of them will compute it
+        self.lock = threading.RLock()
+
+    def get(self, index: int, key: tuple, shape: tuple, make) -> np.ndarray:
+        with self.lock:
+            # The versions held are only replaced by those of a newer frame. A consumer still using a frame that has
+            # since been overwritten gets versions computed just for it, so it never replaces a newer frame's.
+            if self.index is None or index > self.index:
+                self.index = index
+                self.valid.clear()
+            elif index < self.index:
+                dst = np.empty(shape, dtype=self.dtype)
+                make(dst)
+                return dst
+            if key not in self.valid:
+                if key not in self.buffers:
+                    self.buffers[key] = np.empty(shape, dtype=self.dtype)
+                make(self.buffers[key])
+                self.valid.add(key)
+            return self.buffers[key]
+
+
+class FrameDerivatives:
+    """Scaled, grayscale and downsampled versions of one frame in a FrameRing, shared by every consumer of the ring.
+
+    Each version is only computed the first time it's asked for, and is then reused by every other consumer that needs
+    it. The arrays returned are only valid for as long as the frame itself is, and must not be modified."""
+    def __init__(self, ring: FrameRing, index: int):
+        self.ring = ring
+        # Number of the frame our versions are derived from
+        self.index = index
+
+    @property
+    def frame(self) -> np.ndarray:
+        return self.ring.slots[self.index % self.ring.length]
+
+    def _get(self, key: tuple, shape: tuple, make) -> np.ndarray:
+        return self.ring.derived[self.index % self.ring.length].get(self.index, key, shape, make)
+
+    def scaled(self, size: tuple) -> np.ndarray:
+        """Returns the frame resized to (width, height)"""
+        frame = self.frame
+        h, w = frame.shape[:2]
+        if size == (w, h):
+            return frame
+        # Halving the frame is shared with the pyramid, so both are only ever computed once
+        pw, ph = w, h
+        for level in range(1, 4):
+            pw, ph = (pw + 1) // 2, (ph + 1) // 2
+            if size == (pw, ph):
+                return self.pyramid(level)
+        return self._get(('scaled', size), (size[1], size[0], *frame.shape[2:]),
+                         lambda dst: cv2.resize(self.frame, size, dst=dst, interpolation=cv2.INTER_AREA))
+
+    def gray(self, size: tuple = None) -> np.ndarray:
+        """Returns the frame converted to grayscale, optionally resized to (width, height) first"""
+        h, w = self.frame.shape[:2]
+        size = size or (w, h)
+        return self._get(('gray', size), (size[1], size[0]),
+                         lambda dst: cv2.cvtColor(self.scaled(size), cv2.COLOR_BGR2GRAY, dst=dst))
+
+    def pyramid(self, level: int) -> np.ndarray:
+        """Returns the frame halved in size the given number of times, using a Gaussian pyramid"""
+        if level == 0:
+            return self.frame
+        h, w = self.pyramid(level - 1).shape[:2]
+        return self._get(('pyramid', level), ((h + 1) // 2, (w + 1) // 2, *self.frame.shape[2:]),
+                         lambda dst: cv2.pyrDown(self.pyramid(level - 1), dst=dst))
+
+
+def nearest_slot(timestamps: np.ndarray, count: int, target: float, limit: int = None) -> int:
+    """Binary searches a ring of timestamps (with count frames ever written) for the slot captured closest to target"""
+    capacity = len(timestamps)
+    # We may only be able to search the most recent frames, e.g. if the oldest slot is currently being overwritten
+    length = min(count, capacity if limit is None else limit)
+    # Timestamps are in capture order starting from the oldest slot, wrapping round the end of the ring
+    start = (count - length) % capacity
+    def ts(n): return timestamps[(start + n) % capacity]
+    i = bisect.bisect_left(range(length), target, key=ts)
+    # The nearest frame is either the first one captured at or after the target, or the one just before it
+    if i == length or (i > 0 and target - ts(i - 1) <= ts(i) - target):
+        i -= 1
+    return (start + i) % capacity
+
+
+class RecordQueue:
+    """A bounded queue of preallocated frame slots, used to hand frames to a recorder without blocking the sender.
+    Frames are copied in, and dropped (and counted) rather than waited for if the recorder has fallen too far behind."""
+    def __init__(self, shape: tuple, length: int = 32, dtype=np.uint8):
+        self.shape = shape
+        self.slots = np.empty((length, *shape), dtype=dtype)
+        # Capture time and time handed to the queue of the frame in each slot
+        self.timestamps = np.zeros((length, 2), dtype=np.float64)
+        self.length = length
+        # Total frames ever put into and taken out of the queue: frame n is always held in slot n % length
+        self.head = 0
+        self.tail = 0
+        self.condition = threading.Condition()
+        # Counters for monitoring how well the recorder is keeping up
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self) -> int:
+        return self.head - self.tail
+
+    def put(self, frame: np.ndarray, captured: float, presented: float) -> bool:
+        """Copies a frame into the queue, returning False (and dropping the frame) if the queue is full"""
+        if self.head - self.tail >= self.length:
+            self.dropped += 1
+            return False
+        # Only the sender ever writes into the slot at head, so we don't need the lock while copying
+        np.copyto(self.slots[self.head % self.length], frame)
+        self.timestamps[self.head % self.length] = captured, presented
+        with self.condition:
+            self.head += 1
+            self.max_depth = max(self.max_depth, self.head - self.tail)
+            self.condition.notify()
+        return True
+
+    def get(self, timeout: float = None) -> tuple:
+        """Returns the oldest frame in the queue and its (captured, presented) times, without removing it: call
+        release() once done"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.head > self.tail, timeout=timeout):
+                return None, None
+        return self.slots[self.tail % self.length], self.timestamps[self.tail % self.length]
+
+    def release(self) -> None:
+        """Frees the slot of the frame returned by get(), so it can be reused"""
+        with self.condition:
+            self.tail += 1
+
+    def clear(self) -> None:
+        """Discards every frame in the queue"""
+        with self.condition:
+            self.tail = self.head
+
+    def stats(self) -> dict:
+        return {'queued': len(self), 'max queued': self.max_depth, 'dropped': self.dropped}
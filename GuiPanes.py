@@ -144,6 +144,46 @@ class CommandPane(ParentFrame):
         """Creates a tk messagebox showing information e.g. number of active cameras, fps, resolution..."""
         # Format the screen resolution by getting info from the params file
         p_res = 'x'.join([str(round(int(i) * self.params['*scaling'])) for i in self.params['*resolution'].split('x')])
+        # Format the frame delivery statistics for each camera view
+        delivery = ''.join([f'\nCam {num + 1} {name}: {s["dropped"]} dropped, lag {s["lag"]} ({s["policy"]})'
+                            for num, cam in enumerate(self.keythread.camthread)
+                            for name, s in cam.delivery_stats().items()])
+        # Format the delay actually applied to each performer view, if we've been delaying the video
+        delay = ''.join([f'\nCam {num + 1} video delay: {round(s["last"])} ms (mean error {round(s["mean error"])} ms)'
+                         for num, cam in enumerate(self.keythread.camthread)
+                         if (s := cam.delay_stats()) is not None])
+        # Format how long detection is taking for each performer view, if we've been blanking the video
+        detect = ''.join([f'\nCam {num + 1} detection: {round(s["latency"])} ms, boxes {round(s["staleness"])} ms old'
+                          for num, cam in enumerate(self.keythread.camthread)
+                          if (s := cam.detect_stats()) is not None])
+        # Format the time from capture to being shown in each window, and how often the display ran late
+        display = ''.join([f'\nCam {num + 1} display: ' +
+                           ', '.join(f'{n.split()[-1]} {round(w["latency"])} ms' for n, w in s['windows'].items()) +
+                           f' ({s["missed"]} missed refreshes)'
+                           for num, cam in enumerate(self.keythread.camthread)
+                           if (s := cam.display_stats()) is not None and s['windows']])
+        # Format how many frames each recorder has written, and how many it had to drop because it fell behind
+        record = ''.join([f'\nCam {num + 1} {name} recording: {s["written"]} frames, {s["dropped"]} dropped '
+                          f'(max queued {s["max queued"]})'
+                          for num, cam in enumerate(self.keythread.camthread)
+                          for name, s in cam.record_stats().items()])
+        # Format the mode each camera was actually opened in, which may not be what we asked for
+        capture = ''.join([f'\nCam {num + 1} capture: {s["width"]}x{s["height"]} at {s["fps"]} fps '
+                           f'({s["backend"]} {s["fourcc"] or "default"}, {s["decode threads"]} decode threads)'
+                           for num, cam in enumerate(self.keythread.camthread)
+                           if (s := cam.capture_stats()) is not None])
+        # Format how late the active delay sequence has been changing the delay time
+        schedule = self.keythread.delay_scheduler.stats()
+        schedule = (f'\nDelay schedule: {round(schedule["jitter"], 1)} ms late '
+                    f'(max {round(schedule["max jitter"], 1)} ms), {schedule["ticks"]} ticks, '
+                    f'{schedule["skipped"]} skipped') if schedule else ''
+        # Format how long commands are taking to reach Reaper, and how many were replaced by newer ones before sending
+        rpc = self.keythread.reathread.rpc_stats()
+        rpc = ('\nReaper: ' + ', '.join(f'{n} {round(c["latency"])} ms' for n, c in rpc['commands'].items()) +
+               f' ({rpc["coalesced"]} coalesced)') if rpc['commands'] else ''
+        # Format the time difference between the newest frames from each camera
+        sync = self.keythread.camthread[0].sync_stats() if self.keythread.camthread else None
+        sync = f'\nCamera skew: {round(sync["skew"])} ms (max {round(sync["max skew"])} ms)' if sync else ''
         # Create the messagebox
         _ = tk.messagebox.showinfo(
             title='Info',
@@ -151,6 +191,15 @@ class CommandPane(ParentFrame):
                     f'Camera FPS: {str(self.params["*fps"])}\n'
                     f'Researcher Camera Resolution: {self.params["*resolution"]}\n'
                     f'Performer Camera Resolution: {p_res}'
+                    f'{capture}'
+                    f'{delivery}'
+                    f'{delay}'
+                    f'{detect}'
+                    f'{display}'
+                    f'{record}'
+                    f'{schedule}'
+                    f'{rpc}'
+                    f'{sync}'
         )
 
     def init_bpm_entry(self) -> tuple[tk.Frame, tk.Entry]:
@@ -202,8 +251,7 @@ class PausePane(ParentFrame):
         """Pause the audio in reathread"""
         b = tk.Button(
             self.tk_frame, text='Pause Audio', fg='black', command=lambda: [
-                self.keythread.enable_manip('pause audio', b),
-                self.keythread.reathread.pause_manip()
+                self.keythread.enable_manip('pause audio', b) and self.keythread.reathread.pause_manip()
             ]
         )
         return b
@@ -221,8 +269,7 @@ class PausePane(ParentFrame):
         """Pause both the audio and video"""
         b = tk.Button(
             self.tk_frame, text='Pause Both', fg='black', command=lambda: [
-                self.keythread.enable_manip('pause video', b),
-                self.keythread.reathread.pause_manip()
+                self.keythread.enable_manip('pause video', b) and self.keythread.reathread.pause_manip()
             ]
         )
         return b
@@ -1,10 +1,12 @@
 import threading
 import time
 import os
+import json
 from datetime import datetime
 import tkinter
 from TkGui import TkGui
 from PolThread import PolThread
+from DelayScheduler import DelayScheduler
 import shutil
 
 
@@ -17,6 +19,8 @@ class KeyThread:
         self.name = 'Keypress Manager'
         self.stop_event = stop_event
         self.params = params
+        # Runs the delay sequences of every delay pane, so needs to exist before the GUI is created
+        self.delay_scheduler = DelayScheduler(params=self.params, stop_event=self.stop_event)
 
         self.gui = TkGui(params=self.params, keythread=self)
         self.polthread = [PolThread(address=add, params=params, logger=self.gui.log_text)
@@ -24,6 +28,8 @@ class KeyThread:
                           in self.params['*polar mac addresses']]
         self.reathread = reathread
         self.camthread = camthread
+        # Details of the current recording, saved alongside the video once it's finished
+        self.session = None
         self.start_keymanager()
 
     def start_keymanager(self):
@@ -38,19 +44,45 @@ class KeyThread:
         # for num in range(self.params['*exit time'], 0, -1):
         #     # Wait to make sure everything has shut down (prevents tkinter RunTime errors w/threading)
         #     time.sleep(1)
-        # If we're recording, stop first
-        if self.reathread.project.is_recording:
-            self.stop_recording()
+        # If we're recording, stop first, and wait for the recorders to finish writing so the session can be saved and
+        # backed up while the GUI (and the camera processes, if we're using them) are still around
+        if self.reathread.is_recording():
+            writers, session = self.stop_recording(finish=False)
+            end = time.perf_counter() + self.params['*recorder finish timeout']
+            for writer in writers:
+                if not writer.finished.wait(timeout=max(end - time.perf_counter(), 0)):
+                    self.gui.log_text(text='Recorders did not finish in time: some recordings may be incomplete')
+                    break
+            self.finish_recording(writers, session, wait=False)
         self.stop_event.set()
         for pol in self.polthread:
             pol.quit_polar()
         self.gui.root.destroy()
 
-    def enable_manip(self, manip, button):
-        self.reset_manips()
+    def enable_manip(self, manip, button) -> bool:
+        """Turns on a manipulation, returning whether it's now active (so the caller knows whether to start it)"""
+        # When stacking, manipulations are added on top of any already active, and pressing one again turns it off
+        if not self.params['*stack manipulations']:
+            self.reset_manips()
+        elif self.params[manip]:
+            self.disable_manip(manip, button)
+            return False
         self.params[manip] = True
         button.config(bg='green')
         self.gui.log_text(text=f'{manip} now active.')
+        return True
+
+    def disable_manip(self, manip, button):
+        # Turns off a single manipulation, leaving any others stacked with it running
+        self.params[manip] = False
+        button.config(bg="SystemButtonFace")
+        # Undo anything the manipulation changed in Reaper: the delay scheduler stops by itself once delayed is False
+        if manip == 'delayed':
+            self.reathread.undo_delayed_manip()
+        # Pause Both uses the pause video param, so unmute unless Pause Audio is still active
+        elif manip in ['pause audio', 'pause video'] and not self.params['pause audio']:
+            self.reathread.undo_pause_manip()
+        self.gui.log_text(text=f'{manip} no longer active.')
 
     def reset_manips(self):
         # TODO: refactor this into seperate functions
@@ -64,9 +96,7 @@ class KeyThread:
                 b.config(bg="SystemButtonFace")
             except tkinter.TclError:
                 pass
-        # Allows time for all threads relying on params being true to finish. This helps avoid the reaper socket closing
-        # unexpectedly if it tries to execute two commands simultaneously (e.g. setting delay time, turning off fx)
-        time.sleep(0.3)
+        # Commands are sent to Reaper one at a time by its worker, so there's no need to wait for anything else first
         self.reathread.reset_manips()
         self.gui.log_text(text='done!')
 
@@ -76,34 +106,71 @@ class KeyThread:
         self.reset_manips()
         # Start the recording in both reathread and for all of our camthreads
         self.reathread.start_recording(bpm,)
+        # Every video stream starts from the first frame captured after Reaper started recording. The recorders'
+        # encoders are already running, so they start straight away.
+        start_at = time.perf_counter()
+        self.session = {'start': record_start.isoformat(), 'start timestamp': start_at, 'streams': {}}
         for cam in self.camthread:
             threading.Thread(
                 target=cam.cam_write.start_recording,
-                args=([record_start, self.params['*resolution']])
+                args=([record_start, self.params['*resolution'], start_at])
             ).start()
             threading.Thread(
                 target=cam.performer_cam_write.start_recording,
-                args=([record_start, self.params['*resolution']])
+                args=([record_start, self.params['*resolution'], start_at])
             ).start()
         self.params['*recording'] = True  # This parameter is used to add text onto the camera view
         for pol in self.polthread:
             pol.start_polar(record_start)
         self.gui.log_text(text=f'Started recording at {record_start.strftime("%H:%M:%S")}')
 
-    def stop_recording(self):
+    def stop_recording(self, finish: bool = True) -> tuple:
+        """Stops recording, returning the recorders and the session they belong to. Unless told not to, the session
+        is saved and backed up once the recorders have finished writing."""
         self.params['*recording'] = False    # This parameter is used to remove text from the camera view
         # We need to reset all of our manips before stopping the recording (can turn them on after)
         self.reset_manips()
         # Stop the recording in both reathread and for all our camthreads
         self.reathread.stop_recording()
-        for cam in self.camthread:
-            cam.cam_write.stop_recording()
-            cam.performer_cam_write.stop_recording()
+        # Recorders stop straight away, and finish writing any frames they still have queued in the background
+        writers = {f'cam{num + 1}_{writer.ext}': writer
+                   for num, cam in enumerate(self.camthread) for writer in [cam.cam_write, cam.performer_cam_write]}
+        # There's no session if Reaper was already recording when we started (i.e. not from Start Recording)
+        session, self.session = self.session, None
+        for name, writer in writers.items():
+            stream = writer.stop_recording()
+            if stream is not None and session is not None:
+                session['streams'][name] = stream
         for pol in self.polthread:
             pol.stop_polar()
         self.gui.log_text(text=f'Finished recording at {datetime.now().strftime("%H:%M:%S")}')
+        # The session can only be saved and backed up once every recorder has finished writing its files
+        if finish:
+            self.finish_recording(list(writers.values()), session)
+        return list(writers.values()), session
+
+    def finish_recording(self, writers: list, session: dict | None, wait: bool = True):
+        # Rather than waiting for the recorders (which would freeze the GUI), check on them every so often from the
+        # GUI's own thread, as Tk can only be used from there
+        if wait and not all(writer.finished.is_set() for writer in writers):
+            self.gui.root.after(200, self.finish_recording, writers, session)
+            return
+        if session is not None:
+            self.save_session(session)
         self.backup_output()
 
+    def save_session(self, session: dict):
+        """Saves when each video stream actually started, relative to the start of the Reaper recording"""
+        for name, stream in session['streams'].items():
+            if stream.get('start offset') is not None:
+                self.gui.log_text(text=f'{name} started {round(stream["start offset"])} ms after Reaper')
+        start = datetime.fromisoformat(session['start']).strftime('%Y-%m-%d_%H-%M-%S')
+        with open(f'output/video/{start}_session.json', 'w') as f:
+            json.dump(session, f, indent=4)
+        # Save every delay time applied by a delay timeline during the recording, timed from when Reaper started
+        if self.delay_scheduler.export(f'output/video/{start}_delay.csv', origin=session['start timestamp']):
+            self.gui.log_text(text=f'Delay timeline saved to output/video/{start}_delay.csv')
+
     def backup_output(self):
         """Automatically backs up output to specified directories after each recording"""
         # Iterate through all backup folders
@@ -118,6 +185,9 @@ class KeyThread:
                 # Iterate through our output files and copy them to the backup directory
                 for (root, dirs, files) in os.walk(r".\output", topdown=False):
                     for name in files:
+                        # Skip the files the recorders' encoders are waiting to write the next recording into
+                        if name.startswith('.pending'):
+                            continue
                         try:
                             shutil.copy(os.path.join(root, name), backup_dir)
                         except PermissionError:
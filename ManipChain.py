@@ -0,0 +1,177 @@
+import numpy as np
+from cv2 import cv2
+
+# Every parameter that changes the performer's video. The chain is only rebuilt when one of these is turned on or off.
+VIDEO_MANIPS = [
+    'flipped',
+    'delayed',
+    'loop rec',
+    'loop play',
+    'loop clear',
+    'pause video',
+    'pause both',
+    'blank face',
+    'blank eyes',
+]
+
+
+class ManipChain:
+    """Produces the performer's view from the active manipulations, which can be stacked (e.g. delay and blank face).
+
+    Each frame is taken from a source (live, delayed, looped or paused), then flipped and scaled to the size of the
+    view in a single step, and finally has any regions blanked out. All of this is written into one buffer, allocated
+    up front, so no new arrays are created for each frame."""
+    def __init__(self, view, delay_frames, loop_params: dict, output_size: tuple):
+        self.view = view
+        self.params = view.params
+        self.delay_frames = delay_frames
+        self.loop_params = loop_params
+        self.output_size = output_size
+        self.output = np.empty((output_size[1], output_size[0], 3), dtype=np.uint8)
+        # Values of VIDEO_MANIPS the chain was last built for
+        self.state = None
+        # The steps the chain is built from: we only look up which ones to use when the state changes
+        self.side_steps = []
+        self.source = self._live
+        self.paused = False
+        self.flipped = False
+        self.target = None
+        # Matrices to flip and scale frames of each size we've seen into the view (e.g. live and delayed frames differ)
+        self.affine = {}
+        # Size of the frames we last sent to the detector, as its regions are given relative to these
+        self.detect_size = None
+        # Capture time of the frame most recently shown, which is earlier than the live frame if e.g. delayed
+        self.timestamp = None
+
+    def __call__(self, frame: np.ndarray, frame_time: float, derived=None) -> np.ndarray:
+        """Returns the frame to show the performer. Derived versions of live frames (e.g. already scaled to the size
+        of the view by another consumer) are used from the FrameRing's cache, if it's given."""
+        state = tuple(self.params[m] for m in VIDEO_MANIPS)
+        if state != self.state:
+            self.compile(state)
+        for step in self.side_steps:
+            step(frame, derived)
+        frame, timestamp = self.source(frame, frame_time)
+        self.timestamp = timestamp
+        live = self.source == self._live and not self.paused
+        if self.paused:
+            if self.params['*pause frame'] is None:
+                self.params['*pause frame'] = frame.copy()
+            frame = self.params['*pause frame']
+        # Detection runs in the background on the frame we're about to show, before it's scaled or flipped
+        if self.target is not None:
+            self._submit(frame, timestamp, derived if live else None)
+        src_h, src_w = frame.shape[:2]
+        if live and derived is not None:
+            frame = derived.scaled(self.output_size)
+        frame = self._transform(frame)
+        if self.target is not None:
+            self._blank(frame, timestamp, scale=(self.output_size[0] / src_w, self.output_size[1] / src_h))
+        return frame
+
+    def compile(self, state: tuple) -> None:
+        """Works out which steps are needed for the manipulations that are now active"""
+        active = dict(zip(VIDEO_MANIPS, state))
+        previous = dict(zip(VIDEO_MANIPS, self.state or state))
+        self.state = state
+        # Turning a manipulation off while others are stacked with it (rather than resetting everything) must still
+        # forget what it was holding, so turning it on again starts afresh: a new paused frame, or a new loop
+        if previous['loop rec'] and not active['loop rec']:
+            self.loop_params["has_loop"] = True
+        # Steps that don't change the frame we show, but need to see every live frame
+        self.side_steps = []
+        if active['loop rec']:
+            self.side_steps.append(self._loop_rec)
+        if active['loop clear']:
+            self.side_steps.append(lambda frame, derived: self._loop_clear())
+        # Only one source can provide the frame: a paused frame is taken from whichever source was active when paused
+        if active['loop play']:
+            self.source = self._loop_play
+        elif active['delayed']:
+            self.source = self._delayed
+        else:
+            self.source = self._live
+        self.paused = active['pause video'] or active['pause both']
+        if not self.paused:
+            self.params['*pause frame'] = None
+        self.flipped = active['flipped']
+        # The face covers the eyes anyway, so there's no need to look for both
+        self.target = 'face' if active['blank face'] else 'eye' if active['blank eyes'] else None
+
+    def _live(self, frame: np.ndarray, frame_time: float) -> tuple[np.ndarray, float]:
+        return frame, frame_time
+
+    def _delayed(self, frame: np.ndarray, frame_time: float) -> tuple[np.ndarray, float]:
+        # We find the frame captured closest to the delay time before the current frame, rather than assuming the
+        # camera is giving us exactly *fps frames per second
+        # When a delay timeline is running, the delay for this frame is looked up from it directly
+        timeline = self.params.get('*delay timeline')
+        delay = self.params['*delay time']
+        if timeline is not None:
+            delay = timeline.value_at(frame_time, default=delay)
+        frame, timestamp = self.delay_frames.nearest(frame_time - delay / 1000)
+        self.view.log_delivered_delay(frame_time - timestamp)
+        return frame, timestamp
+
+    def _loop_play(self, frame: np.ndarray, frame_time: float) -> tuple[np.ndarray, float]:
+        # Keep showing live video if nothing has been recorded yet
+        if len(self.loop_params["frames"]):
+            frame = self.view._manip_loop_play(self.loop_params)
+        return frame, frame_time
+
+    def _loop_rec(self, frame: np.ndarray, derived) -> None:
+        # The loop may be stored at the size of the view, in which case the frame has probably been scaled already
+        frames = self.loop_params["frames"]
+        if derived is not None:
+            frame = derived.scaled((frames.width, frames.height))
+        self.view._manip_loop_rec(frame, self.loop_params)
+
+    def _loop_clear(self) -> None:
+        self.loop_params["var"] = 0
+        self.loop_params["frames"].clear()
+
+    def _transform(self, frame: np.ndarray) -> np.ndarray:
+        """Flips and scales a frame into our output buffer, or returns it untouched if neither is needed"""
+        h, w = frame.shape[:2]
+        if (w, h) == self.output_size:
+            if self.flipped:
+                return cv2.flip(frame, 0, dst=self.output)
+            # Frames from the ring or a buffer are shared, so we need our own copy to draw blanked regions on to
+            if self.target is not None:
+                np.copyto(self.output, frame)
+                return self.output
+            return frame
+        if not self.flipped:
+            return cv2.resize(frame, self.output_size, dst=self.output)
+        if (w, h) not in self.affine:
+            self.affine[(w, h)] = self._flip_matrix(w, h)
+        return cv2.warpAffine(frame, self.affine[(w, h)], self.output_size, dst=self.output)
+
+    def _flip_matrix(self, w: int, h: int) -> np.ndarray:
+        """Returns the matrix that scales a frame of the given size to the view and flips it vertically"""
+        ow, oh = self.output_size
+        sx, sy = ow / w, oh / h
+        # Pixel centres are at +0.5, so are offset by half a pixel either side of the scaling
+        return np.float32([
+            [sx, 0, 0.5 * sx - 0.5],
+            [0, -sy, oh - 0.5 - 0.5 * sy],
+        ])
+
+    def _submit(self, frame: np.ndarray, timestamp: float, derived) -> None:
+        # Regions found in frames of one size are no use for searching frames of another (e.g. when delay starts)
+        if frame.shape != self.detect_size:
+            self.view.detect_thread.reset()
+            self.detect_size = frame.shape
+        # Live and paused frames stay valid long enough for the detector to use them without taking a copy
+        stable = self.paused or self.source == self._live
+        self.view.detect_thread.submit(frame, timestamp, target=self.target, copy=not stable, derived=derived)
+
+    def _blank(self, frame: np.ndarray, timestamp: float, scale: tuple) -> None:
+        """Draws the newest regions found by the detector on to the scaled frame, without waiting for the detector"""
+        sx, sy = scale
+        regions = self.view.detect_thread.latest(self.target, timestamp) * [sx, sy, sx, sy]
+        if self.flipped:
+            regions[:, 1] = frame.shape[0] - regions[:, 1] - regions[:, 3]
+        params = self.view.detect_thread.blank_params[self.target]
+        for region in regions.astype(int):
+            self.view._manip_plot_blanked_region(frame, params, region, scale=sx)
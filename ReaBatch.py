@@ -0,0 +1,140 @@
+import reapy
+from reapy import reascript_api as RPR
+
+# Each function in this file runs entirely inside Reaper, so however many API calls it makes, it only costs a single
+# round trip over the socket and nothing else can happen in Reaper partway through it. For this to work, Reaper's
+# Python must be able to import this file: add this folder to the Python path in Reaper if it can't find it.
+# Everything passed in and returned is plain data (indices and numbers), as reapy objects can't cross the socket.
+
+# Time (in seconds of project time) well past the end of any recording, used when clearing automation envelopes
+ENVELOPE_END = 1e9
+
+
+def _fx(project, track: int, fx: int):
+    return project.tracks[track].fxs[fx]
+
+
+def _delay_envelope(project, track: int, fx: int, create: bool = False) -> str | None:
+    # The delay time is always the first parameter of the delay FX
+    envelope = RPR.GetFXEnvelope(project.tracks[track].id, fx, 0, create)
+    return envelope if RPR.ValidatePtr2(0, envelope, 'TrackEnvelope*') else None
+
+
+@reapy.inside_reaper()
+def setup_tracks(tracks: list, fx_name: str) -> dict:
+    """Names and arms every participant's track, adding the delay FX to any that don't have it yet, and returns the
+    current state of each FX so we can keep our own copy of it"""
+    project = reapy.Project()
+    states = []
+    for index, name in tracks:
+        track = project.tracks[index]
+        track.name = name
+        track.set_info_value('I_RECARM', 1)
+        fx = track.add_fx(name=fx_name, input_fx=False, even_if_exists=False)
+        states.append({'fx': fx.index, 'enabled': fx.is_enabled, 'delay': float(fx.params[0])})
+    return {'tracks': states, 'countin': project.n_tracks - 1}
+
+
+@reapy.inside_reaper()
+def start_recording(bpm: float) -> None:
+    project = reapy.Project()
+    # Sets the project BPM, then the playback cursor to the position of the first marker, the start of the count-in
+    project.bpm = bpm
+    project.cursor_position = project.markers[0].position
+    # Start recording if not already
+    if not project.is_recording:
+        project.record()
+
+
+@reapy.inside_reaper()
+def stop_recording() -> None:
+    project = reapy.Project()
+    # Stop if currently recording, then set the playback cursor back to the start of the count-in
+    if project.is_recording:
+        project.stop()
+    project.cursor_position = project.markers[0].position
+
+
+@reapy.inside_reaper()
+def is_recording() -> bool:
+    # Unlike status(), this doesn't need the count-in markers, so works in any project
+    return reapy.Project().is_recording
+
+
+@reapy.inside_reaper()
+def status() -> dict:
+    """Returns whether we're recording, where the play cursor is, and where the count-in ends"""
+    project = reapy.Project()
+    return {'recording': project.is_recording, 'position': project.play_position,
+            'countin end': project.markers[1].position}
+
+
+@reapy.inside_reaper()
+def reset(manip_fx: list, envelopes: list, stop: bool = False) -> None:
+    """Turns off every FX used in manipulations, unmutes every track, and clears any delay automation"""
+    project = reapy.Project()
+    if stop:
+        project.stop()
+    for track, fx in manip_fx:
+        _fx(project, track, fx).disable()
+    project.unmute_all_tracks()
+    # Once there are no points left, the delay time can be set directly again
+    for track, fx in envelopes:
+        envelope = _delay_envelope(project, track, fx)
+        if envelope is not None:
+            RPR.DeleteEnvelopePointRange(envelope, 0, ENVELOPE_END)
+
+
+@reapy.inside_reaper()
+def set_delay(changes: list) -> None:
+    """Applies (track, fx, enable, delay) changes to delay FX: enable turns the FX on, and delay is None if unchanged"""
+    project = reapy.Project()
+    for track, fx, enable, delay in changes:
+        if enable:
+            _fx(project, track, fx).enable()
+        if delay is not None:
+            _fx(project, track, fx).params[0] = delay
+
+
+@reapy.inside_reaper()
+def disable_delay(delay_fx: list, envelopes: list) -> None:
+    """Turns off the delay FX, and clears any delay automation, without touching any other manipulation"""
+    project = reapy.Project()
+    for track, fx in delay_fx:
+        _fx(project, track, fx).disable()
+    for track, fx in envelopes:
+        envelope = _delay_envelope(project, track, fx)
+        if envelope is not None:
+            RPR.DeleteEnvelopePointRange(envelope, 0, ENVELOPE_END)
+
+
+@reapy.inside_reaper()
+def mute_all() -> None:
+    reapy.Project().mute_all_tracks()
+
+
+@reapy.inside_reaper()
+def unmute_all() -> None:
+    reapy.Project().unmute_all_tracks()
+
+
+@reapy.inside_reaper()
+def write_delay_automation(targets: list, offsets: list, delays: list, lead: float) -> float:
+    """Replaces every point in the delay envelope of each (track, fx) with one point for every change in delay.
+    Returns the project time the points start at: the end of the count-in, or lead seconds ahead of the play cursor
+    if we're already past it."""
+    project = reapy.Project()
+    position, countin_end = project.play_position, project.markers[1].position
+    start = countin_end if position < countin_end else position + lead
+    for track, fx in targets:
+        _fx(project, track, fx).enable()
+        envelope = _delay_envelope(project, track, fx, create=True)
+        RPR.DeleteEnvelopePointRange(envelope, 0, ENVELOPE_END)
+        mode = RPR.GetEnvelopeScalingMode(envelope)
+        # There's no delay until the timeline starts (e.g. during the count-in). Points use a square shape, so the
+        # delay changes exactly on each point and holds until the next one.
+        RPR.InsertEnvelopePoint(envelope, 0, RPR.ScaleToEnvelopeMode(mode, 0), 1, 0, False, True)
+        for offset, delay in zip(offsets, delays):
+            RPR.InsertEnvelopePoint(envelope, start + offset, RPR.ScaleToEnvelopeMode(mode, delay), 1, 0, False, True)
+        RPR.Envelope_SortPoints(envelope)
+    return start
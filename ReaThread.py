@@ -1,4 +1,6 @@
-import reapy
+import time
+import ReaBatch
+from ReaWorker import ReaWorker
 
 # On certain machines (or a portable Reaper install), you may need to repeat the process of configuring Reapy every
 # time you close and open Reaper. To do this, run the enable_distant_api.py script in Reaper (via Actions -> Show
@@ -11,68 +13,150 @@ import reapy
 
 
 class ReaTrack:
-    def __init__(self, project: reapy.Project, track_name: str, track_index: int,):
-        # Set the track name and arm it for recording
-        self.track = project.tracks[track_index]
-        self.track.name = track_name + ' - Delay'
-        self.track.set_info_value('I_RECARM', 1)
-
-        # If any of these FX don't exist, these lines will add them in.
+    """Our copy of the state of a participant's track in Reaper, so we only send Reaper what's actually changed.
+    The track itself is set up by ReaBatch.setup_tracks."""
+    def __init__(self, track_index: int, state: dict):
+        self.index = track_index
+        # Index of the FX used to delay this track
+        self.delay_fx = state['fx']
         # These FX are used to trigger manipulations.
-        self.delay_fx = self.track.add_fx(name='midi_delay', input_fx=False, even_if_exists=False)
         self.manip_fx = [
             self.delay_fx,
             # More FX should be added here as and when they are required.
             # Adding FXs into this list makes it easy to turn them all off when reset_manips() is called.
         ]
+        self.delay_enabled = state['enabled']
+        self.delay_time = state['delay']
 
-        # This FX should not normally be touched, as it's used to convert the MIDI into audio
-        # self.vsti = self.track.add_fx(name=vst, input_fx=False, even_if_exists=False)
+    def delay_change(self, delay: float) -> tuple | None:
+        """Returns the change needed to set the delay time (turning on the delay FX if needed), or None if nothing
+        needs to change"""
+        enable, new_delay = not self.delay_enabled, delay if delay != self.delay_time else None
+        if not enable and new_delay is None:
+            return None
+        return self.index, self.delay_fx, enable, new_delay
 
 
 class ReaThread:
     def __init__(self, params: dict):
         # Initialise basic attributes
-        self.project = reapy.Project()  # Initialise the Reaper project in Python
         self.params = params
-        self.participants = [ReaTrack(project=self.project, track_name='Drums', track_index=2, ),
-                             ReaTrack(project=self.project, track_name='Keys', track_index=6,)]
-        self.countin = self.project.tracks[self.project.n_tracks-1]
+        # Every command is sent to Reaper by this worker, so commands from different threads never overlap. Commands
+        # that we need to wait for (e.g. starting recording) are called, anything else is just submitted. Every
+        # command runs inside Reaper as a single batch (see ReaBatch), so each costs one round trip.
+        self.worker = ReaWorker()
+        tracks = [(2, 'Drums'), (6, 'Keys')]
+        setup = self.worker.call('setup', ReaBatch.setup_tracks, [(i, name + ' - Delay') for i, name in tracks],
+                                 'midi_delay')
+        self.participants = [ReaTrack(track_index=i, state=state) for (i, _), state in zip(tracks, setup['tracks'])]
+        self.countin = setup['countin']
+        # Whether the delay is currently being set by automation envelopes, rather than by us
+        self.automated = False
 
     def start_recording(self, bpm,):
         # Sets the project BPM to value inputted by user (or to default provided in UserParams, if none provided in GUI)
-        self.project.bpm = bpm if bpm is not None else self.params['*default bpm']
-        # Sets the playback cursor to the position of the first marker, the start of the count-in
-        self.project.cursor_position = self.project.markers[0].position
-        # Start recording if not already
-        if not self.project.is_recording:
-            self.project.record()
+        bpm = bpm if bpm is not None else self.params['*default bpm']
+        # Wait for Reaper to actually start recording, as the video streams are timed from when it does
+        self.worker.call('start recording', ReaBatch.start_recording, bpm, coalesce=False)
 
     def stop_recording(self):
-        # Stop if currently recording
-        if self.project.is_recording:
-            self.project.stop()
-        # Sets the playback cursor to the position of the first marker, the start of the count-in
-        self.project.cursor_position = self.project.markers[0].position
-
-    def reset_manips(self):
-        # Iterate through all the participants and turn off the FX used in manipulations (not the VSTi)
+        self.worker.call('stop recording', ReaBatch.stop_recording, coalesce=False)
+
+    def status(self) -> dict:
+        return self.worker.call('status', ReaBatch.status)
+
+    def is_recording(self) -> bool:
+        return self.worker.call('recording', ReaBatch.is_recording)
+
+    def play_position(self) -> float:
+        return self.status()['position']
+
+    def countin_remaining(self) -> float:
+        """Returns the time left (in seconds) until the end of the count-in, or 0 if we're already past it"""
+        status = self.status()
+        return max(status['countin end'] - status['position'], 0)
+
+    def reset_manips(self, stop: bool = False):
+        # Commands are always sent in the order they're queued, so we don't need to wait for this to finish
+        self.worker.submit('reset', self._reset_manips, stop)
+
+    def _reset_manips(self, stop: bool = False):
+        # Turn off the FX used in manipulations for every participant (not the VSTi), and any delay automation
+        manip_fx = [(p.index, fx) for p in self.participants for fx in p.manip_fx]
+        envelopes = [(p.index, p.delay_fx) for p in self.participants] if self.automated else []
+        ReaBatch.reset(manip_fx, envelopes, stop)
         for participant in self.participants:
-            for fx in participant.manip_fx:
-                fx.disable()
-        self.project.unmute_all_tracks()
+            participant.delay_enabled = False
+        self._forget_automated_delay()
+
+    def write_delay_automation(self, timeline, length: float, lead: float) -> float:
+        """Writes a delay timeline into automation on every participant's delay FX, so Reaper changes the delay
+        itself, exactly on time, without us sending it anything while it plays. Returns the project time the timeline
+        starts at: the end of the count-in, or a little ahead of the play cursor if we're already past it."""
+        return self.worker.call('write automation', self._write_delay_automation, timeline, length, lead)
+
+    def _write_delay_automation(self, timeline, length: float, lead: float) -> float:
+        offsets, delays = timeline.changes(length)
+        start = ReaBatch.write_delay_automation([(p.index, p.delay_fx) for p in self.participants],
+                                                offsets.tolist(), delays.tolist(), lead)
+        for participant in self.participants:
+            participant.delay_enabled = True
+            # From now on the envelope sets the delay time, so we no longer know what it is
+            participant.delay_time = None
+        self.automated = True
+        return start
+
+    def _forget_automated_delay(self):
+        # Clearing the automation leaves the delay time wherever the envelope last put it, so the next delay time
+        # must always be sent, even if it's the same as the last one we sent ourselves
+        if self.automated:
+            for participant in self.participants:
+                participant.delay_time = None
+        self.automated = False
 
     def exit_loop(self):
-        self.project.stop()
-        self.reset_manips()
+        self.worker.call('exit', self._reset_manips, True, coalesce=False)
 
     def delayed_manip(self):
+        # If the delay changes again before this is sent, only the newest delay time is sent to Reaper
+        self.worker.submit('delay', self._delayed_manip)
+
+    def _delayed_manip(self):
+        # When the delay has been written into automation, Reaper is already setting it for us. A delay time queued
+        # just before the delay was turned off mustn't turn it back on again.
+        if self.automated or not self.params['delayed']:
+            return
+        # Set the delay time to equal the time set in the GUI, or the time due now if a delay timeline is running
+        timeline = self.params.get('*delay timeline')
+        delay = self.params['*delay time']
+        if timeline is not None:
+            delay = timeline.value_at(time.perf_counter(), default=delay)
+        delay = float(delay)
+        changes = [c for p in self.participants if (c := p.delay_change(delay)) is not None]
+        if not changes:
+            return
+        ReaBatch.set_delay(changes)
+        # Only update our copy once Reaper has actually been changed
+        for participant in self.participants:
+            participant.delay_enabled, participant.delay_time = True, delay
+
+    def undo_delayed_manip(self):
+        # Replaces any delay time still waiting to be sent, so the delay can't be turned on again after this
+        self.worker.submit('delay', self._undo_delayed_manip)
+
+    def _undo_delayed_manip(self):
+        delay_fx = [(p.index, p.delay_fx) for p in self.participants]
+        ReaBatch.disable_delay(delay_fx, delay_fx if self.automated else [])
         for participant in self.participants:
-            # Turn on the delay FX if it isn't turned on
-            if not participant.delay_fx.is_enabled:
-                participant.delay_fx.enable()
-            # Set the delay time to equal the time set in the GUI
-            participant.delay_fx.params[0] = self.params['*delay time']
+            participant.delay_enabled = False
+        self._forget_automated_delay()
 
     def pause_manip(self):
-        self.project.mute_all_tracks()
+        self.worker.submit('pause', ReaBatch.mute_all)
+
+    def undo_pause_manip(self):
+        # Uses the same key as pausing, so if the pause hasn't been sent yet, it never will be
+        self.worker.submit('pause', ReaBatch.unmute_all)
+
+    def rpc_stats(self) -> dict:
+        return self.worker.stats()
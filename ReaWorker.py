@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+class ReaWorker:
+    """Sends every command to Reaper from a single thread, one at a time, so commands from the GUI, KeyThread and the
+    delay scheduler can never overlap on the socket.
+
+    Commands are queued by name. If a command is queued again before it's been sent (e.g. when the delay time changes
+    faster than Reaper can take it), only the newest one is sent, and it moves to the back of the queue so it still
+    runs after anything queued before it."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Commands waiting to be sent, in the order they'll be sent: key -> (name, function, args, futures)
+        self.pending = OrderedDict()
+        # Round-trip time of each kind of command, in milliseconds
+        self.latency = {}
+        # Number of commands replaced by a newer one before they were sent
+        self.coalesced = 0
+        threading.Thread(target=self.main_loop, daemon=True).start()
+
+    def submit(self, name: str, func, *args, coalesce: bool = True) -> Future:
+        """Queues a command without waiting for it, returning a future for its result"""
+        future = Future()
+        # Commands that mustn't be merged with any other (e.g. starting recording) each get a key of their own
+        key = name if coalesce else (name, object())
+        with self.condition:
+            futures = []
+            if key in self.pending:
+                # Whoever was waiting on the replaced command gets the result of the newer one
+                futures = self.pending.pop(key)[3]
+                self.coalesced += 1
+            self.pending[key] = (name, func, args, futures + [future])
+            self.condition.notify()
+        return future
+
+    def call(self, name: str, func, *args, coalesce: bool = True, timeout: float = None):
+        """Queues a command and waits for its result. Must never be called from a command, or it'll wait forever."""
+        return self.submit(name, func, *args, coalesce=coalesce).result(timeout)
+
+    def main_loop(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                _, (name, func, args, futures) = self.pending.popitem(last=False)
+            start = time.perf_counter()
+            try:
+                result = func(*args)
+            except Exception as e:
+                print(f'Reaper command {name} failed: {e!r}')
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future in futures:
+                    future.set_result(result)
+            with self.condition:
+                self.latency.setdefault(name, deque(maxlen=256)).append((time.perf_counter() - start) * 1000)
+
+    def stats(self) -> dict:
+        """Returns the mean and last round-trip time of each kind of command, and how many commands were dropped"""
+        with self.condition:
+            latency = {name: list(lat) for name, lat in self.latency.items()}
+        return {
+            'coalesced': self.coalesced,
+            'commands': {name: {'latency': sum(lat) / len(lat), 'last': lat[-1]} for name, lat in latency.items()},
+        }
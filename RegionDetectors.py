@@ -0,0 +1,115 @@
+import os
+import threading
+import numpy as np
+from cv2 import cv2
+
+# Every detector we can use to find regions to blank. Cascades are looked for in the detector directory given in
+# UserParams first, then in the Haar cascades bundled with OpenCV. LBP cascades and DNN model files aren't bundled with
+# OpenCV, so must be put in the detector directory.
+DETECTORS = {
+    'haar face': {
+        'type': 'cascade',
+        'file': 'haarcascade_frontalface_default.xml',
+        'scaleFactor': 1.3,
+        'minNeighbors': 4,
+    },
+    'lbp face': {
+        'type': 'cascade',
+        'file': 'lbpcascade_frontalface_improved.xml',
+        'scaleFactor': 1.4,
+        'minNeighbors': 4,
+    },
+    'dnn face': {
+        'type': 'dnn',
+        'config': 'deploy.prototxt',
+        'model': 'res10_300x300_ssd_iter_140000.caffemodel',
+        'size': 300,    # Input size the network was trained on
+        'mean': (104.0, 177.0, 123.0),  # Mean BGR values subtracted from the input
+        'confidence': 0.5,  # Only detections with at least this confidence are returned
+    },
+    'haar eyes': {
+        'type': 'cascade',
+        'file': 'haarcascade_eye_tree_eyeglasses.xml',
+        'scaleFactor': 2.7,
+        'minNeighbors': 3,
+    },
+    # Add more detectors here in the format above - they can then be selected in UserParams
+}
+
+# Detectors are only ever loaded once per process, and shared by every camera
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+class CascadeDetector:
+    """Finds regions using a Haar or LBP cascade classifier"""
+    # Cascades only look at grayscale images, so can be given one directly to save converting it again
+    gray = True
+
+    def __init__(self, directory: str, file: str, scaleFactor: float, minNeighbors: int, **_):
+        path = find_model(directory, file)
+        self.cascade = cv2.CascadeClassifier(path)
+        # OpenCV doesn't raise if the file is missing or invalid, it just gives us a cascade that never finds anything
+        if self.cascade.empty():
+            raise ValueError(f'Could not load cascade from {path}: put {file} in the detector directory')
+        self.scale_factor = scaleFactor
+        self.min_neighbors = minNeighbors
+        # Cascades aren't safe to run from more than one thread at once, so cameras take it in turns
+        self.lock = threading.Lock()
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        """Returns an array of (x, y, w, h) boxes found in a BGR or grayscale image"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        with self.lock:
+            regions = self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)
+        return np.asarray(regions, dtype=int).reshape(-1, 4)
+
+
+class DnnDetector:
+    """Finds regions using an OpenCV DNN single-shot detector, run on the CPU"""
+    gray = False
+
+    def __init__(self, directory: str, config: str, model: str, size: int, mean: tuple, confidence: float, **_):
+        self.net = cv2.dnn.readNetFromCaffe(find_model(directory, config), find_model(directory, model))
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.size = size
+        self.mean = mean
+        self.confidence = confidence
+        self.lock = threading.Lock()
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        """Returns an array of (x, y, w, h) boxes found in a BGR image"""
+        h, w = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(image, 1.0, (self.size, self.size), self.mean)
+        with self.lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()[0, 0]
+        # Each detection is (image, class, confidence, x0, y0, x1, y1), with coordinates between 0 and 1
+        detections = detections[detections[:, 2] >= self.confidence]
+        boxes = np.clip(detections[:, 3:7], 0, 1) * [w, h, w, h]
+        boxes[:, 2:] -= boxes[:, :2]
+        return boxes.astype(int)
+
+
+def find_model(directory: str, file: str) -> str:
+    """Returns the path to a model file, looking in the detector directory first and then in OpenCV's own data"""
+    path = os.path.join(directory, file)
+    if not os.path.exists(path) and os.path.exists(os.path.join(cv2.data.haarcascades, file)):
+        path = os.path.join(cv2.data.haarcascades, file)
+    return path
+
+
+def get_detector(name: str, directory: str):
+    """Returns the detector registered under the given name, loading it the first time it's asked for"""
+    with _loaded_lock:
+        if name not in _loaded:
+            if name not in DETECTORS:
+                raise ValueError(f'Unknown detector {name}: choose from {list(DETECTORS)}')
+            config = DETECTORS[name]
+            cls = CascadeDetector if config['type'] == 'cascade' else DnnDetector
+            try:
+                _loaded[name] = cls(directory=directory, **config)
+            except cv2.error as e:
+                raise ValueError(f'Could not load detector {name} from {directory}: {e}') from e
+        return _loaded[name]
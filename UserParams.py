@@ -1,5 +1,4 @@
 # These parameters can be edited by the user before running the program and should adjust system settings automatically
-cascade_location = r".\venv\Lib\site-packages\opencv_python-4.5.5.62.dist-info"
 user_params = {
     '*participants': 1,     # Number of cameras/tracks to try and read
     '*backup directory': [
@@ -15,14 +14,47 @@ user_params = {
 
     '*fps': 30,     # Try and set camera FPS to this value (and adjust all params that require this as needed)
     '*resolution': '1920x1080',   # Camera resolution (for researcher view and recording)
+    '*capture backend': 'auto',     # 'dshow', 'msmf', 'v4l2', 'any', or 'auto' (best for OS); 'file' or 'synthetic'
+    '*capture fourcc': 'MJPG',  # Format to ask cameras for: MJPG is needed for full FPS at 1080p on most webcams
+    '*capture decode threads': 0,   # Decode MJPEG in this many threads if capture can't keep up (0: decode in driver)
+    '*camera profiles': r'./input/camera_profiles.json',    # Modes saved by CamProbe.py: override the FPS etc. above
+    '*capture file': None,  # Video file (or list, one per camera) played in place of cameras if backend is 'file'
     '*scaling': 0.5,     # Amount to scale up the performer camera view by
+    '*sync cameras': False,     # Show frames from all cameras that were captured at the same moment (if > 1 camera)
+    '*sync tolerance': 20,      # Max difference (ms) between the capture times of frames from different cameras
+    '*camera processes': False,     # Run each camera in its own process: helps with more than two cameras
+    '*recorder': 'ffmpeg',  # Record by piping frames to 'ffmpeg', with 'opencv', or by capturing windows ('gdigrab')
+    '*recorder codec': 'mpeg4',     # Codec used by ffmpeg (e.g. 'libx264'), or FourCC used by opencv (e.g. 'MJPG')
+    '*recording segment time': None,    # Split recordings into files this many seconds long (crash-safe), or None
+    '*recorder queue length': 16,   # Frames held for each recorder if the encoder falls behind (allocated up front)
+    '*recorder finish timeout': 30,     # Seconds to wait on exit for recorders to finish writing their queued frames
+    '*display refresh': 60,     # Rate (per second) that performer windows are refreshed at: ideally the monitor rate
+    '*researcher refresh': 15,  # Rate that researcher windows are refreshed at: lower to save CPU for the performer
     '*exit time': 3,    # Number of seconds to wait before exiting the program
+    '*frame delivery': {    # How each camera view receives frames: 'latest', 'drop oldest', or 'block' (+ max backlog)
+        'researcher': ('latest', 1),
+        'performer': ('drop oldest', 4),    # 'block' will hold up capture for every view if this view is too slow
+    },
 
     '*default bpm': 120,    # The default BPM to use in Reaper: can be overridden in the GUI
     '*default count-in': 4,     # The default number of count-in bars to use in Reaper: can be overridden in the GUI
 
     '*delay time': 1000,    # The default delay time (<= max delay time: can be changed when program is running)
+    '*delay automation': False,     # Write delay sequences into Reaper automation (variable delay needs a seed)
+    '*delay automation length': 1800,   # Seconds of looping delay sequences to write into automation
+    '*delay automation lead': 0.5,  # Seconds ahead of the play cursor to start automation, if past the count-in
+    '*delay late ticks': 'skip',    # If delay sequences fall behind: 'skip' missed values, or 'catch up' on them all
     '*max delay time': 10000,   # The maximum amount of time available for delay (will configure Reaper JSFX if needed)
+    '*delay buffer format': 'bgr',  # Format to hold frames for delay in: 'bgr' (fastest), 'yuv420' (half size), 'jpeg'
+    '*delay buffer scaled': True,   # Hold frames for delay at the performer view resolution, not full resolution
+    '*delay buffer jpeg quality': 90,   # JPEG quality (0-100) used when the delay buffer format is 'jpeg'
+    '*delay buffer directory': None,    # Set to a folder (ideally on a local SSD) to hold delay frames on disk, not RAM
+    '*stack manipulations': False,  # Allow more than one manipulation at once (e.g. delay and blank face)
+    '*max loop time': 60,   # The maximum length of video that can be recorded into a loop, in seconds
+    '*loop buffer format': 'bgr',   # Format to hold loop frames in: 'bgr', 'yuv420' or 'jpeg' (as for the delay buffer)
+    '*loop buffer scaled': True,    # Hold loop frames at the performer view resolution, not full resolution
+    '*loop ram budget': 1024,   # Maximum RAM (in MB) used to hold each camera's loop before spilling on to disk
+    '*loop buffer directory': './loops',    # Folder to spill loops past the RAM budget to (None: cut the loop short)
     '*delay time presets': {    # Preset delay times to display in GUI (must be <= max delay time)
         'Short': 50,
         'Medium': 200,
@@ -30,6 +62,18 @@ user_params = {
         'Longer': 5000,
         # Add more delay presets here - they will be configured in the GUI automatically
     },
+    '*blank detectors': {   # Detector used to find each region to blank: choose from those in RegionDetectors.py
+        'face': 'haar face',    # Bundled with OpenCV: the others need their files in the detector directory
+        'eye': 'haar eyes',
+    },
+    '*detector directory': './input/detectors',     # Folder containing any cascade/model files not bundled with OpenCV
+    '*blank detection': {   # Used to speed up face/eye detection when blanking the performer view
+        'scale': 0.5,   # Run detection on the frame scaled by this amount
+        'padding': 1.0,     # Only search an area this many box widths/heights around the previous detection
+        'every': 3,     # Only run detection every N frames, extrapolating where the boxes are in between
+    },
+    '*var delay length': 3600,  # Seconds of variable delay to draw ahead of time (after which the sequence repeats)
+    '*var delay seed': None,    # Seed used to draw variable delays: set this to get the same sequence every time
     '*var delay samples': 1000,  # Number of samples to draw when creating variable delay distributions.
     '*var delay distributions': {
         "Uniform": {    # Name of the distribution to be displayed in the combobox
@@ -58,6 +102,7 @@ sys_params = {
     'flipped': False,  # Rotates video orthogonally: used as a test manipulation, unlikely to be useful
 
     'delayed': False,  # Adds delay of X seconds to video and audio: amount of delay can be adjusted
+    '*delay timeline': None,    # DelayTimeline being run by the delay scheduler, which overrides the delay time
 
     'blank face': False,    # Uses ML (Haar-like) to blank performers face. Error detection in place.
     'blank eyes': False,    # Uses ML (Haar-like) to blank performers eyes. Some error detection in place, improvable?
@@ -66,7 +111,7 @@ sys_params = {
     'loop play': False,  # Plays previously recorded video
     'loop clear': False,    # Clears any previously recorded video from memory
     '*loop params': {
-            "frames": [],
+            "frames": None,     # Each performer view creates its own LoopBuffer to hold these
             "var": 0,
             "has_loop": False,
         },
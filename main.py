@@ -1,5 +1,9 @@
+import multiprocessing as mp
 from threading import Event, Barrier
-from CamThread import CamThread
+from CamThread import CamThread, recover_pending_recordings
+from CamProcess import CamProcess, MirroredParams
+from CaptureSync import CaptureCoordinator
+from DisplayThread import DisplayThread
 from KeyThread import KeyThread
 from ReaThread import ReaThread
 from ReaEdit import edit_reaper_fx
@@ -12,10 +16,24 @@ BARRIER = Barrier((3 * params['*participants']))  # Each CamThread uses 3 thread
 if __name__ == "__main__":
     # Runs a checks to make sure Reaper JSFX params are equal to those defined in UserParams
     edit_reaper_fx(params)
+    # Keep anything an earlier run didn't get the chance to finish recording, before any new recordings are started
+    recover_pending_recordings()
     # TODO: CamThread and ReaThread objects should be created in KeyThread, as with PolThread objects
+    # Timestamps frames from every camera against the same clock so they can be lined up with each other
+    coordinator = CaptureCoordinator(tolerance=params['*sync tolerance'] / 1000)
     # Creates CamThread objects for the number of cameras specified by the user
-    c = [CamThread(source=num, stop_event=STOPPER, global_barrier=BARRIER, params=params)
-         for num in range(params['*participants'])]
+    if params['*camera processes']:
+        # Each camera runs in its own process: changes to params made in this process are mirrored to them all
+        params = MirroredParams(params)
+        STOPPER, BARRIER = mp.Event(), mp.Barrier(3 * params['*participants'])
+        c = [CamProcess(source=num, stop_event=STOPPER, global_barrier=BARRIER, params=params, coordinator=coordinator)
+             for num in range(params['*participants'])]
+    else:
+        # A single thread shows the windows for every camera
+        display = DisplayThread(params=params, stop_event=STOPPER)
+        c = [CamThread(source=num, stop_event=STOPPER, global_barrier=BARRIER, params=params, coordinator=coordinator,
+                       display=display)
+             for num in range(params['*participants'])]
     # Creates single ReaThread and KeyThread objects
     r = ReaThread(params=params)
     k = KeyThread(params=params, stop_event=STOPPER, reathread=r, camthread=c,)
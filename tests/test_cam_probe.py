@@ -0,0 +1,48 @@
+from CamProbe import best_profile
+from CaptureBackends import load_profile, save_profile
+
+
+def result(width, height, fps, achieved, jitter, steady=True, fourcc='MJPG'):
+    return {'width': width, 'height': height, 'fps': fps, 'fourcc': fourcc,
+            'achieved fps': achieved, 'jitter': jitter, 'steady': steady}
+
+
+def test_best_profile_prefers_fastest_steady_mode():
+    results = [
+        result(1920, 1080, 30, 29.9, 1.0),
+        result(1280, 720, 60, 59.8, 2.0),
+        # Fastest of all, but can't keep up steadily
+        result(640, 480, 120, 90.0, 9.0, steady=False),
+    ]
+    profile = best_profile(results)
+    assert (profile['width'], profile['height'], profile['fps']) == (1280, 720, 60)
+    assert profile['fourcc'] == 'MJPG'
+
+
+def test_best_profile_breaks_ties_by_size_then_jitter():
+    results = [
+        result(1280, 720, 30, 30.1, 1.0),
+        result(1920, 1080, 30, 29.8, 3.0),
+        result(1920, 1080, 30, 29.9, 2.0, fourcc='YUY2'),
+    ]
+    profile = best_profile(results)
+    assert (profile['width'], profile['fourcc'], profile['jitter']) == (1920, 'YUY2', 2.0)
+
+
+def test_best_profile_leaves_default_format_to_driver():
+    profile = best_profile([result(640, 480, 30, 30.0, 1.0, fourcc='')])
+    assert profile['fourcc'] is None
+
+
+def test_no_profile_without_a_steady_mode():
+    assert best_profile([result(640, 480, 30, 20.0, 9.0, steady=False)]) is None
+    assert best_profile([]) is None
+
+
+def test_saved_profiles_are_kept_for_every_camera(tmp_path):
+    filename = str(tmp_path / 'profiles.json')
+    assert load_profile(filename, 'dshow', 0) is None
+    save_profile(filename, 'dshow', 0, {'width': 1280})
+    save_profile(filename, 'dshow', 1, {'width': 640})
+    assert load_profile(filename, 'dshow', 0) == {'width': 1280}
+    assert load_profile(filename, 'dshow', 1) == {'width': 640}
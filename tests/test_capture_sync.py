@@ -0,0 +1,66 @@
+import numpy as np
+from FrameRing import FrameRing
+from CaptureSync import CaptureCoordinator
+
+SHAPE = (4, 6, 3)
+
+
+def capture(ring, *times):
+    for timestamp in times:
+        ring.next_slot()[:] = 0
+        ring.commit(timestamp)
+
+
+def make_coordinator(tolerance=0.02):
+    coordinator = CaptureCoordinator(tolerance=tolerance)
+    rings = [FrameRing(shape=SHAPE, length=8) for _ in range(2)]
+    for source, ring in enumerate(rings):
+        coordinator.register(source, ring)
+    return coordinator, rings
+
+
+def test_reference_time_is_newest_time_every_camera_has_reached():
+    coordinator, (first, second) = make_coordinator()
+    assert coordinator.reference_time() is None
+    capture(first, 1.00, 1.03, 1.07)
+    # Only cameras that have started capturing are matched
+    assert coordinator.reference_time() == 1.07
+    capture(second, 1.01, 1.04)
+    assert coordinator.reference_time() == 1.04
+    assert np.isclose(coordinator.stats()['skew'], 30)
+
+
+def test_reference_time_is_only_measured_once_per_captured_frame():
+    coordinator, (first, second) = make_coordinator()
+    capture(first, 1.0)
+    capture(second, 1.1)
+    for _ in range(5):
+        coordinator.reference_time()
+    assert len(coordinator.skew_history) == 1
+    capture(first, 1.2)
+    coordinator.reference_time()
+    assert len(coordinator.skew_history) == 2
+
+
+def test_slot_for_finds_frame_nearest_reference_time():
+    coordinator, (first, second) = make_coordinator()
+    capture(first, 1.00, 1.03, 1.07)
+    capture(second, 1.01, 1.04)
+    # The reference time is 1.04, the newest frame from the second camera
+    assert coordinator.slot_for(0) == 1
+    assert coordinator.slot_for(1) == 1
+    assert coordinator.slot_for(0, reference=1.065) == 2
+
+
+def test_slot_for_gives_none_when_no_frame_is_close_enough():
+    coordinator, (first, _) = make_coordinator()
+    assert coordinator.slot_for(0, reference=1.0) is None
+    capture(first, 1.0, 1.1)
+    assert coordinator.slot_for(0, reference=1.05) is None
+
+
+def test_slot_for_never_searches_slot_about_to_be_overwritten():
+    coordinator, (first, _) = make_coordinator(tolerance=1)
+    capture(first, *range(10))
+    # Slots hold frames 8, 9, 2, 3, ..., 7: frame 2 is next to be overwritten
+    assert coordinator.slot_for(0, reference=2.0) == 3
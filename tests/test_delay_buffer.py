@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+from DelayBuffer import DelayBuffer, LoopBuffer, DELAY_FORMATS
+
+SHAPE = (48, 64, 3)
+
+
+def frame(value: int) -> np.ndarray:
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+@pytest.mark.parametrize('fmt', DELAY_FORMATS)
+def test_frames_round_trip_in_every_format(fmt):
+    buffer = DelayBuffer(capacity=4, shape=SHAPE, fmt=fmt)
+    buffer.append(frame(120), timestamp=1.0)
+    out = buffer[-1]
+    assert out.shape == SHAPE
+    # YUV and JPEG are lossy, but a flat grey frame should come back almost exactly
+    assert np.abs(out.astype(int) - 120).max() <= 2
+
+
+@pytest.mark.parametrize('fmt', DELAY_FORMATS)
+def test_frames_are_stored_scaled(fmt):
+    buffer = DelayBuffer(capacity=4, shape=SHAPE, scaling=0.5, fmt=fmt)
+    buffer.append(frame(60), timestamp=1.0)
+    assert (buffer.width, buffer.height) == (32, 24)
+    assert buffer[-1].shape == (24, 32, 3)
+
+
+def test_yuv420_uses_half_the_memory_of_bgr():
+    bgr = DelayBuffer(capacity=4, shape=SHAPE, fmt='bgr')
+    yuv = DelayBuffer(capacity=4, shape=SHAPE, fmt='yuv420')
+    assert yuv.store.nbytes * 2 == bgr.store.nbytes
+
+
+def test_yuv420_size_is_rounded_down_to_even():
+    buffer = DelayBuffer(capacity=4, shape=(47, 63, 3), fmt='yuv420')
+    assert (buffer.width, buffer.height) == (62, 46)
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        DelayBuffer(capacity=4, shape=SHAPE, fmt='png')
+
+
+def test_oldest_frames_are_replaced_once_full():
+    buffer = DelayBuffer(capacity=3, shape=SHAPE)
+    for n in range(5):
+        buffer.append(frame(n), timestamp=float(n))
+    assert len(buffer) == 3
+    assert [buffer[i][0, 0, 0] for i in range(3)] == [2, 3, 4]
+    assert buffer[-1][0, 0, 0] == 4
+    with pytest.raises(IndexError):
+        buffer[3]
+
+
+def test_frames_on_disk_wrap_around(tmp_path):
+    buffer = DelayBuffer(capacity=3, shape=SHAPE, directory=str(tmp_path))
+    assert buffer.mmap is not None
+    for n in range(5):
+        buffer.append(frame(n), timestamp=float(n))
+    assert [buffer[i][0, 0, 0] for i in range(3)] == [2, 3, 4]
+    buffer.close()
+    # The backing file is deleted as soon as it's closed
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_jpeg_on_disk_falls_back_to_yuv420(tmp_path):
+    buffer = DelayBuffer(capacity=4, shape=SHAPE, fmt='jpeg', directory=str(tmp_path))
+    assert buffer.fmt == 'yuv420'
+    buffer.append(frame(200), timestamp=1.0)
+    assert np.abs(buffer[-1].astype(int) - 200).max() <= 2
+    buffer.close()
+
+
+def test_nearest_looks_frames_up_by_capture_time():
+    buffer = DelayBuffer(capacity=4, shape=SHAPE)
+    for n in range(6):
+        buffer.append(frame(n), timestamp=n / 10)
+    out, timestamp = buffer.nearest(0.31)
+    assert out[0, 0, 0] == 3
+    assert timestamp == pytest.approx(0.3)
+    # Frames that have been replaced can't be found any more
+    assert buffer.nearest(0.0)[0][0, 0, 0] == 2
+
+
+def test_nearest_on_empty_buffer_raises():
+    with pytest.raises(IndexError):
+        DelayBuffer(capacity=4, shape=SHAPE).nearest(0.0)
+
+
+def test_loop_buffer_spills_to_disk(tmp_path):
+    slot_mb = SHAPE[0] * SHAPE[1] * 3 / 1024 / 1024
+    loop = LoopBuffer(capacity=5, shape=SHAPE, ram_budget=2 * slot_mb, directory=str(tmp_path))
+    # Nothing is allocated until a loop is recorded
+    assert loop.ram_store is None
+    for n in range(6):
+        loop.append(frame(n))
+    assert len(loop) == 5
+    assert loop.full
+    assert loop.disk_store is not None
+    assert [loop[i][0, 0, 0] for i in range(5)] == [0, 1, 2, 3, 4]
+    loop.clear()
+    assert len(loop) == 0
+    loop.close()
+
+
+def test_loop_buffer_is_cut_short_without_a_directory():
+    slot_mb = SHAPE[0] * SHAPE[1] * 3 / 1024 / 1024
+    loop = LoopBuffer(capacity=5, shape=SHAPE, ram_budget=2 * slot_mb)
+    assert loop.capacity == 2
+    assert [loop.append(frame(n)) for n in range(3)] == [True, True, False]
+
+
+@pytest.mark.parametrize('fmt', DELAY_FORMATS)
+def test_loop_buffer_can_be_cleared_before_recording(fmt):
+    loop = LoopBuffer(capacity=3, shape=SHAPE, fmt=fmt)
+    loop.clear()
+    loop.append(frame(30))
+    assert np.abs(loop[0].astype(int) - 30).max() <= 2
@@ -0,0 +1,141 @@
+import threading
+import time
+import pytest
+from DelayScheduler import DelayScheduler
+from DelayTimeline import DelayTimeline
+
+
+def make_scheduler(late_ticks: str = 'skip', running: bool = False) -> tuple:
+    params = {'delayed': True, '*delay late ticks': late_ticks, '*delay timeline': None}
+    stop_event = threading.Event()
+    # Without the thread running, ticks can be driven by hand at exactly the times we choose
+    if not running:
+        stop_event.set()
+    return DelayScheduler(params=params, stop_event=stop_event), params, stop_event
+
+
+def make_sequence(timeline: DelayTimeline, ticks: list, **callbacks) -> dict:
+    seq = {'timeline': timeline, 'on_tick': lambda index, value: ticks.append((index, value)), 'on_start': None,
+           'on_finish': None, 'hold': None, 'on_hold': None}
+    seq.update(callbacks)
+    return seq
+
+
+def test_ticks_run_one_period_apart():
+    scheduler, _, _ = make_scheduler()
+    ticks = []
+    seq = make_sequence(DelayTimeline.from_array([10, 20, 30], period=0.1), ticks)
+    seq, deadline, index = scheduler.tick(seq, deadline=5.0, index=0, now=5.01)
+    # The next tick is due a period after this one was, not a period after it actually ran
+    assert deadline == pytest.approx(5.1)
+    assert (index, ticks) == (1, [(0, 10.0)])
+
+
+def test_late_ticks_are_skipped():
+    scheduler, _, _ = make_scheduler('skip')
+    ticks = []
+    seq = make_sequence(DelayTimeline.from_array([10, 20, 30, 40, 50], period=0.1), ticks)
+    # Woken up three and a half periods late: the three missed ticks are never applied
+    seq, deadline, index = scheduler.tick(seq, deadline=0.0, index=0, now=0.35)
+    assert ticks == [(3, 40.0)]
+    assert (index, deadline) == (4, pytest.approx(0.4))
+    assert scheduler.skipped == 3
+
+
+def test_late_ticks_are_caught_up():
+    scheduler, _, _ = make_scheduler('catch up')
+    ticks = []
+    seq = make_sequence(DelayTimeline.from_array([10, 20, 30, 40, 50], period=0.1), ticks)
+    deadline, index = 0.0, 0
+    # Every missed tick is run straight away, one after the other, until we're back on time
+    while deadline <= 0.35:
+        seq, deadline, index = scheduler.tick(seq, deadline=deadline, index=index, now=0.35)
+    assert ticks == [(0, 10.0), (1, 20.0), (2, 30.0), (3, 40.0)]
+    assert scheduler.skipped == 0
+
+
+def test_timeline_that_does_not_loop_finishes():
+    scheduler, _, _ = make_scheduler()
+    ticks, finished = [], []
+    seq = make_sequence(DelayTimeline.from_space([30, 20], period=0.1), ticks, on_finish=finished.append)
+    seq, deadline, index = scheduler.tick(seq, deadline=0.0, index=0, now=0.0)
+    seq, deadline, index = scheduler.tick(seq, deadline=deadline, index=index, now=0.1)
+    seq, deadline, index = scheduler.tick(seq, deadline=deadline, index=index, now=0.2)
+    assert seq is None
+    assert ticks == [(0, 30.0), (1, 20.0)]
+    assert finished == [True]
+
+
+def test_error_in_callback_finishes_sequence():
+    scheduler, _, _ = make_scheduler()
+    finished = []
+
+    def on_tick(index, value):
+        raise RuntimeError('Reaper is not responding')
+    seq = make_sequence(DelayTimeline.from_array([10], period=0.1), [], on_tick=on_tick, on_finish=finished.append)
+    seq, _, _ = scheduler.tick(seq, deadline=0.0, index=0, now=0.0)
+    assert seq is None
+    assert finished == [False]
+
+
+def test_publish_and_unpublish_timeline():
+    scheduler, params, _ = make_scheduler()
+    timeline = DelayTimeline.from_array([10, 20], period=0.1)
+    seq = make_sequence(timeline, [])
+    scheduler.publish(seq, start=100.0)
+    assert params['*delay timeline'] is timeline
+    assert timeline.value_at(100.15) == 20.0
+    scheduler.unpublish(seq, stop=101.0)
+    assert params['*delay timeline'] is None
+    # Once stopped, nothing can look up a delay from the timeline
+    assert timeline.value_at(100.15, default=5.0) == 5.0
+    assert scheduler.runs[-1] == (timeline, 100.0, 101.0)
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_running_sequence_is_applied_and_replaced():
+    scheduler, params, stop_event = make_scheduler(running=True)
+    ticks, finished = [], []
+    scheduler.start(DelayTimeline.from_array([10, 20], period=0.02), on_tick=lambda i, v: ticks.append(v),
+                    on_finish=finished.append)
+    assert wait_for(lambda: len(ticks) >= 4)
+    assert ticks[:4] == [10.0, 20.0, 10.0, 20.0]
+    # Starting another sequence ends the one already running
+    scheduler.start(DelayTimeline.from_array([30], period=0.02), on_tick=lambda i, v: None)
+    assert wait_for(lambda: finished == [False])
+    stop_event.set()
+
+
+def test_error_in_hold_only_stops_its_own_sequence():
+    scheduler, params, stop_event = make_scheduler(running=True)
+    finished, ticks = [], []
+
+    def hold():
+        raise ConnectionError('Reaper is not responding')
+    scheduler.start(DelayTimeline.from_array([10], period=0.02), on_tick=lambda i, v: None, hold=hold,
+                    on_finish=finished.append)
+    assert wait_for(lambda: finished == [False])
+    # The scheduler is still running, so the next sequence is applied as normal
+    scheduler.start(DelayTimeline.from_array([20], period=0.02), on_tick=lambda i, v: ticks.append(v))
+    assert wait_for(lambda: ticks)
+    stop_event.set()
+
+
+def test_sequence_ends_when_delay_is_turned_off():
+    scheduler, params, stop_event = make_scheduler(running=True)
+    finished = []
+    scheduler.start(DelayTimeline.from_array([10], period=0.02), on_tick=lambda i, v: None,
+                    on_finish=finished.append)
+    assert wait_for(lambda: params['*delay timeline'] is not None)
+    params['delayed'] = False
+    assert wait_for(lambda: finished == [False])
+    assert params['*delay timeline'] is None
+    stop_event.set()
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from DelayTimeline import DelayTimeline
+
+
+def test_timeline_is_not_running_until_started():
+    timeline = DelayTimeline.from_array([10, 20], period=0.1)
+    assert timeline.index_at(5.0) is None
+    assert timeline.value_at(5.0, default=3.0) == 3.0
+
+
+def test_array_loops_back_to_the_start():
+    timeline = DelayTimeline.from_array([[10, 20], [30, 40]], period=0.1)
+    timeline.start = 100.0
+    assert [timeline.value_at(100.0 + t) for t in (0.05, 0.15, 0.35, 0.45)] == [10.0, 20.0, 40.0, 10.0]
+    # Anything looked up before the first tick gets the first delay time
+    assert timeline.value_at(99.0) == 10.0
+
+
+def test_space_holds_final_delay_time():
+    timeline = DelayTimeline.from_space([30, 20, 10], period=0.1)
+    timeline.start = 0.0
+    assert timeline.value_at(0.25) == 10.0
+    assert timeline.value_at(60.0) == 10.0
+
+
+def test_delays_out_of_range_are_replaced_with_no_delay():
+    timeline = DelayTimeline.from_array([-5, 50, 100, 150], period=0.1, max_delay=100)
+    assert timeline.delays.tolist() == [0, 50, 0, 0]
+
+
+def test_empty_timeline_is_rejected():
+    with pytest.raises(ValueError):
+        DelayTimeline.from_array([], period=0.1)
+
+
+def test_seeded_distribution_draws_same_sequence():
+    dist = np.arange(-50, 500)
+    first = DelayTimeline.from_distribution(dist, period=0.1, length=10, seed=1)
+    second = DelayTimeline.from_distribution(dist, period=0.1, length=10, seed=1)
+    assert len(first) == 100
+    assert np.array_equal(first.delays, second.delays)
+    # Negative delays are drawn as positive ones
+    assert (first.delays >= 0).all()
+
+
+def test_export_writes_delay_applied_from_origin(tmp_path):
+    timeline = DelayTimeline.from_array([10, 20], period=0.5)
+    filename = tmp_path / 'delays.csv'
+    timeline.export(str(filename), start=0.0, stop=2.0, origin=0.75)
+    rows = filename.read_text().splitlines()
+    assert rows == ['time (s),delay (ms)', '0,20.0', '0.25,10.0', '0.75,20.0']
+
+
+def test_changes_only_include_ticks_that_change_the_delay():
+    timeline = DelayTimeline.from_array([10, 10, 20, 20, 10], period=0.5)
+    offsets, delays = timeline.changes(length=5)
+    # The array is repeated to fill the length: 10, 10, 20, 20, 10, 10, 10, 20, 20, 10
+    assert offsets.tolist() == [0.0, 1.0, 2.0, 3.5, 4.5]
+    assert delays.tolist() == [10, 20, 10, 20, 10]
+
+
+def test_changes_of_space_end_with_the_space():
+    timeline = DelayTimeline.from_space([30, 20, 20, 10], period=0.1)
+    offsets, delays = timeline.changes(length=60)
+    assert offsets == pytest.approx([0.0, 0.1, 0.3])
+    assert delays.tolist() == [30, 20, 10]
+
+
+def test_changes_always_include_the_first_tick():
+    timeline = DelayTimeline.from_array([40], period=0.1)
+    offsets, delays = timeline.changes(length=0)
+    assert (offsets.tolist(), delays.tolist()) == ([0.0], [40])
@@ -0,0 +1,123 @@
+import threading
+import time
+import numpy as np
+from FrameRing import FrameRing
+from DetectThread import DetectThread
+
+PARAMS = {'*blank detection': {'scale': 0.5, 'padding': 1.0, 'every': 1}}
+
+
+class FakeDetector:
+    """Finds the same boxes in every image, remembering the images it was given"""
+    def __init__(self, boxes, gray=False):
+        self.boxes = np.asarray(boxes).reshape(-1, 4)
+        self.gray = gray
+        self.images = []
+
+    def detect(self, image):
+        self.images.append(image)
+        return self.boxes
+
+
+def wait_until(condition, timeout=1.0):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def make_thread(detector, min_num=1):
+    blank_params = {'face': {'detector': detector, 'minNum': min_num,
+                             'previous_detection': np.full((min_num, 4), fill_value=100)}}
+    return DetectThread(params=PARAMS, blank_params=blank_params)
+
+
+def test_run_detector_searches_whole_scaled_frame_when_nothing_found():
+    detector = FakeDetector([[10, 20, 5, 5]])
+    thread = make_thread(detector)
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    regions = thread.run_detector(frame, thread.blank_params['face'])
+    assert detector.images[0].shape == (50, 100, 3)
+    # Boxes are given back in the coordinates of the full-resolution frame
+    assert regions.tolist() == [[20, 40, 10, 10]]
+
+
+def test_run_detector_only_searches_around_previous_boxes():
+    detector = FakeDetector([[5, 5, 10, 10]])
+    thread = make_thread(detector)
+    params = dict(thread.blank_params['face'], found=True, previous_detection=np.array([[100, 40, 20, 10]]))
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    regions = thread.run_detector(frame, params)
+    # The search area is padded by one box size each way: x from 80 to 140, y from 30 to 60
+    assert detector.images[0].shape == (15, 30, 3)
+    assert regions.tolist() == [[90, 40, 20, 20]]
+
+
+def test_run_detector_uses_shared_gray_frame():
+    detector = FakeDetector([[1, 1, 2, 2]], gray=True)
+    thread = make_thread(detector)
+    ring = FrameRing(shape=(100, 200, 3), length=4)
+    ring.next_slot()[:] = 0
+    ring.commit(1.0)
+    derived = ring.derivatives(0)
+    thread.run_detector(ring.slots[0], thread.blank_params['face'], derived)
+    assert detector.images[0].shape == (50, 100)
+    # The detector is given the grayscale frame from the ring's cache, rather than converting its own
+    assert np.shares_memory(detector.images[0], derived.gray((100, 50)))
+
+
+def test_track_sorts_boxes_and_measures_velocity():
+    thread = make_thread(FakeDetector([]), min_num=2)
+    params = thread.blank_params['face']
+    thread.track(np.array([[50, 0, 10, 10], [10, 0, 10, 10]]), 1.0, 'face', params)
+    assert params['found']
+    assert params['previous_detection'][:, 0].tolist() == [10, 50]
+    thread.track(np.array([[60, 0, 10, 10], [20, 0, 10, 10]]), 1.5, 'face', params)
+    assert params['velocity'][:, 0].tolist() == [20, 20]
+    # Regions are moved along by their velocity until the next detection
+    assert thread.latest('face', 2.0)[:, 0].tolist() == [30, 70]
+
+
+def test_track_forgets_boxes_when_wrong_number_found():
+    thread = make_thread(FakeDetector([]), min_num=2)
+    params = thread.blank_params['face']
+    thread.track(np.array([[50, 0, 10, 10], [10, 0, 10, 10]]), 1.0, 'face', params)
+    thread.track(np.array([[50, 0, 10, 10]]), 1.5, 'face', params)
+    assert not params['found']
+    assert not params['velocity'].any()
+
+
+def test_detection_carries_on_after_a_failed_frame():
+    class FailingDetector(FakeDetector):
+        def detect(self, image):
+            if not self.images:
+                self.images.append(image)
+                raise RuntimeError('bad frame')
+            return super().detect(image)
+
+    detector = FailingDetector([[10, 20, 5, 5]])
+    thread = make_thread(detector)
+    stop_event = threading.Event()
+    thread.start(stop_event)
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    try:
+        thread.submit(frame, 1.0, 'face')
+        assert wait_until(lambda: detector.images)
+        thread.submit(frame, 2.0, 'face')
+        assert wait_until(lambda: 'face' in thread.published)
+    finally:
+        stop_event.set()
+    assert thread.published['face'][2] == 2.0
+
+
+def test_reset_forgets_tracked_regions():
+    thread = make_thread(FakeDetector([]))
+    params = thread.blank_params['face']
+    thread.track(np.array([[50, 0, 10, 10]]), 1.0, 'face', params)
+    thread.reset()
+    assert not thread.published
+    assert not thread.blank_params['face']['found']
+    # Regions still being searched for when the reset happened will be thrown away
+    assert thread.generation == 1
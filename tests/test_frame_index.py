@@ -0,0 +1,57 @@
+import pytest
+from FrameIndex import FrameIndex, FrameIndexWriter, INDEX_MAGIC
+
+
+def write_index(filename, times):
+    writer = FrameIndexWriter(str(filename), flush_every=2)
+    for captured, presented in times:
+        writer.append(captured, presented)
+    writer.close()
+
+
+def test_index_round_trip(tmp_path):
+    times = [(1.0, 1.02), (1.033, 1.05), (1.066, 1.09)]
+    write_index(tmp_path / 'take.frames', times)
+    index = FrameIndex.for_video(str(tmp_path / 'take.avi'))
+    assert len(index) == 3
+    assert list(index.records['frame']) == [0, 1, 2]
+    assert index.time_of(1) == pytest.approx(1.05)
+    assert index.time_of(1, column='captured') == pytest.approx(1.033)
+    assert index.duration() == pytest.approx(0.07)
+    index.close()
+
+
+def test_frame_at_finds_frame_showing_at_a_time(tmp_path):
+    write_index(tmp_path / 'take.frames', [(0.0, 1.0), (0.1, 2.0), (0.2, 3.0)])
+    index = FrameIndex(str(tmp_path / 'take.frames'))
+    assert index.frame_at(2.5) == 1
+    assert index.frame_at(3.0) == 2
+    # Before the first frame, we're still showing the first frame
+    assert index.frame_at(0.5) == 0
+    assert index.frame_at(0.15, column='captured') == 1
+    index.close()
+
+
+def test_partly_written_record_is_ignored(tmp_path):
+    filename = tmp_path / 'take.frames'
+    write_index(filename, [(0.0, 1.0), (0.1, 2.0)])
+    # As if the program crashed partway through writing the third record
+    with open(filename, 'ab') as f:
+        f.write(b'\x00' * 5)
+    index = FrameIndex(str(filename))
+    assert len(index) == 2
+    index.close()
+
+
+def test_empty_index_has_no_duration(tmp_path):
+    write_index(tmp_path / 'take.frames', [])
+    index = FrameIndex(str(tmp_path / 'take.frames'))
+    assert len(index) == 0
+    assert index.duration() == 0.0
+
+
+def test_other_files_are_rejected(tmp_path):
+    filename = tmp_path / 'take.frames'
+    filename.write_bytes(b'not an index' + bytes(len(INDEX_MAGIC)))
+    with pytest.raises(ValueError):
+        FrameIndex(str(filename))
@@ -0,0 +1,157 @@
+import threading
+import numpy as np
+import pytest
+from FrameRing import FrameRing, RecordQueue, nearest_slot
+
+SHAPE = (4, 6, 3)
+
+
+def write_frames(ring, count, start=0):
+    # Each frame is filled with its own number, and captured at that many seconds
+    for n in range(start, start + count):
+        ring.next_slot()[:] = n
+        ring.commit(float(n))
+
+
+def test_slots_wrap_around_the_ring():
+    ring = FrameRing(shape=SHAPE, length=8)
+    write_frames(ring, 20)
+    assert ring.write_index == 20
+    # Frame n is always held in slot n % length
+    assert ring.slots[19 % 8][0, 0, 0] == 19
+    assert ring.timestamps[19 % 8] == 19.0
+    assert ring.index_of(19 % 8) == 19
+    # The oldest slot (about to be overwritten) holds the frame written length frames ago
+    assert ring.index_of(20 % 8) == 12
+
+
+def test_latest_policy_skips_to_newest_frame():
+    ring = FrameRing(shape=SHAPE, length=8)
+    cursor = ring.cursor(policy='latest')
+    write_frames(ring, 5)
+    assert cursor.get(timeout=0)[0, 0, 0] == 4
+    assert cursor.dropped == 4
+    assert cursor.get(timeout=0) is None
+
+
+def test_drop_oldest_policy_keeps_up_to_maxlen_frames():
+    ring = FrameRing(shape=SHAPE, length=8)
+    cursor = ring.cursor(policy='drop oldest', maxlen=3)
+    write_frames(ring, 10)
+    assert [cursor.get(timeout=0)[0, 0, 0] for _ in range(3)] == [7, 8, 9]
+    assert cursor.dropped == 7
+    assert cursor.delivered == 3
+    assert cursor.lag == 0
+
+
+def test_maxlen_is_limited_by_ring_length():
+    ring = FrameRing(shape=SHAPE, length=8)
+    cursor = ring.cursor(maxlen=100)
+    assert cursor.maxlen == 7
+
+
+def test_unknown_policy_is_rejected():
+    ring = FrameRing(shape=SHAPE, length=8)
+    with pytest.raises(ValueError):
+        ring.cursor(policy='newest')
+
+
+def test_block_policy_holds_up_writer_until_read():
+    ring = FrameRing(shape=SHAPE, length=4)
+    cursor = ring.cursor(policy='block')
+    # Only length - 1 frames can be written ahead of a blocking cursor
+    write_frames(ring, 3)
+    writer = threading.Thread(target=write_frames, args=(ring, 1, 3), daemon=True)
+    writer.start()
+    writer.join(timeout=0.2)
+    assert writer.is_alive()
+    assert cursor.get(timeout=0)[0, 0, 0] == 0
+    writer.join(timeout=1)
+    assert not writer.is_alive()
+    assert [cursor.get(timeout=0)[0, 0, 0] for _ in range(3)] == [1, 2, 3]
+    assert cursor.dropped == 0
+
+
+def test_closed_block_cursor_no_longer_holds_up_writer():
+    ring = FrameRing(shape=SHAPE, length=4)
+    cursor = ring.cursor(policy='block')
+    write_frames(ring, 3)
+    cursor.close()
+    write_frames(ring, 5, start=3)
+    assert ring.write_index == 8
+
+
+def test_derived_versions_are_shared_between_cursors():
+    ring = FrameRing(shape=SHAPE, length=8)
+    first, second = ring.cursor(), ring.cursor()
+    write_frames(ring, 1)
+    first.get(timeout=0)
+    second.get(timeout=0)
+    scaled = first.derived.scaled((3, 2))
+    assert scaled.shape == (2, 3, 3)
+    assert second.derived.scaled((3, 2)) is scaled
+
+
+def test_derived_versions_of_lagging_cursor_are_its_own_frame():
+    ring = FrameRing(shape=SHAPE, length=64)
+    lagging, live = ring.cursor(policy='block'), ring.cursor(policy='latest')
+    write_frames(ring, 40)
+    # Frames 0 and 16 used to share a cache, so the live cursor replaced the lagging cursor's versions
+    lagging.get(timeout=0)
+    old = lagging.derived
+    ring.derivatives(16).gray()
+    live.get(timeout=0)
+    assert live.derived.scaled((3, 2))[0, 0, 0] == 39
+    assert old.scaled((3, 2))[0, 0, 0] == 0
+    assert ring.derivatives(16).gray()[0, 0] == 16
+
+def test_nearest_slot_finds_closest_timestamp():
+    timestamps = np.array([0.0, 1.0, 2.0, 3.0])
+    assert nearest_slot(timestamps, 4, 1.4) == 1
+    assert nearest_slot(timestamps, 4, 1.6) == 2
+    # Ties go to the earlier frame
+    assert nearest_slot(timestamps, 4, 1.5) == 1
+    # Times outside the ring give the oldest or newest frame
+    assert nearest_slot(timestamps, 4, -5) == 0
+    assert nearest_slot(timestamps, 4, 10) == 3
+
+
+def test_nearest_slot_with_partly_filled_ring():
+    timestamps = np.array([0.0, 1.0, 0.0, 0.0])
+    assert nearest_slot(timestamps, 2, 5.0) == 1
+    assert nearest_slot(timestamps, 2, -1.0) == 0
+
+
+def test_nearest_slot_searches_across_wraparound():
+    # Six frames written into a ring of four: slots hold frames 4, 5, 2, 3
+    timestamps = np.array([4.0, 5.0, 2.0, 3.0])
+    assert nearest_slot(timestamps, 6, 2.1) == 2
+    assert nearest_slot(timestamps, 6, 3.9) == 0
+    assert nearest_slot(timestamps, 6, 4.8) == 1
+    # The oldest slot (frame 2) is left out when limited to the newest three
+    assert nearest_slot(timestamps, 6, 2.1, limit=3) == 3
+
+
+def test_record_queue_drops_when_full():
+    queue = RecordQueue(shape=SHAPE, length=2)
+    frame = np.zeros(SHAPE, dtype=np.uint8)
+    assert queue.put(frame, captured=1.0, presented=1.5)
+    assert queue.put(frame + 1, captured=2.0, presented=2.5)
+    assert not queue.put(frame, captured=3.0, presented=3.5)
+    assert queue.dropped == 1
+    got, times = queue.get(timeout=0)
+    assert got[0, 0, 0] == 0
+    assert tuple(times) == (1.0, 1.5)
+    queue.release()
+    assert len(queue) == 1
+
+
+def test_record_queue_clear_forgets_queued_frames():
+    queue = RecordQueue(shape=SHAPE, length=2)
+    frame = np.zeros(SHAPE, dtype=np.uint8)
+    queue.put(frame, captured=1.0, presented=1.5)
+    queue.put(frame, captured=2.0, presented=2.5)
+    queue.clear()
+    assert len(queue) == 0
+    assert queue.get(timeout=0) == (None, None)
+    assert queue.put(frame, captured=3.0, presented=3.5)
@@ -0,0 +1,128 @@
+import numpy as np
+from cv2 import cv2
+from ManipChain import ManipChain, VIDEO_MANIPS
+
+
+class FakeDetectThread:
+    """Always finds one region, given in the coordinates of the frames submitted to it"""
+    def __init__(self, region):
+        self.region = np.array([region])
+        self.blank_params = {'face': {}, 'eye': {}}
+        self.submitted = []
+
+    def submit(self, frame, timestamp, target, copy=False, derived=None):
+        self.submitted.append((frame, target, copy))
+
+    def latest(self, target, timestamp):
+        return self.region
+
+    def reset(self):
+        pass
+
+
+class FakeView:
+    def __init__(self, region=(0, 0, 1, 1)):
+        self.params = {manip: False for manip in VIDEO_MANIPS}
+        self.params.update({'*pause frame': None, '*delay time': 0, '*delay timeline': None})
+        self.detect_thread = FakeDetectThread(region)
+
+    def _manip_plot_blanked_region(self, frame, params, region, scale):
+        x, y, w, h = region
+        frame[y:y + h, x:x + w] = 0
+
+
+def make_chain(view, output_size):
+    loop_params = {'frames': None, 'var': 0, 'has_loop': False}
+    return ManipChain(view, delay_frames=None, loop_params=loop_params, output_size=output_size)
+
+
+def gradient(h, w):
+    # Each row is brighter than the one above it, so flipping is easy to spot
+    return np.repeat(np.linspace(10, 250, h, dtype=np.uint8)[:, None, None], w, axis=1).repeat(3, axis=2)
+
+
+def test_unmanipulated_frame_is_passed_through_untouched():
+    view = FakeView()
+    chain = make_chain(view, (8, 6))
+    frame = gradient(6, 8)
+    assert chain(frame, 1.0) is frame
+
+
+def test_flip_is_written_into_output_buffer():
+    view = FakeView()
+    view.params['flipped'] = True
+    chain = make_chain(view, (8, 6))
+    frame = gradient(6, 8)
+    out = chain(frame, 1.0)
+    assert out is chain.output
+    assert np.array_equal(out, frame[::-1])
+
+
+def test_scale_is_written_into_output_buffer():
+    view = FakeView()
+    chain = make_chain(view, (4, 3))
+    frame = gradient(6, 8)
+    out = chain(frame, 1.0)
+    assert out is chain.output
+    assert np.array_equal(out, cv2.resize(frame, (4, 3)))
+
+
+def test_flip_and_scale_are_done_in_one_step():
+    view = FakeView()
+    view.params['flipped'] = True
+    chain = make_chain(view, (16, 12))
+    frame = gradient(24, 32)
+    out = chain(frame, 1.0)
+    assert out is chain.output
+    expected = cv2.flip(cv2.resize(frame, (16, 12)), 0)
+    assert np.abs(out.astype(int) - expected).max() <= 1
+
+
+def test_blanked_region_is_drawn_on_a_copy():
+    view = FakeView(region=(2, 0, 4, 2))
+    view.params['blank face'] = True
+    chain = make_chain(view, (8, 6))
+    frame = gradient(6, 8)
+    out = chain(frame, 1.0)
+    assert out is chain.output
+    assert not out[0:2, 2:6].any()
+    assert out[2:, :].all()
+    # Frames from the ring are shared with other consumers, so mustn't be drawn on
+    assert frame.all()
+    assert view.detect_thread.submitted[0][1] == 'face'
+
+
+def test_blanked_region_is_scaled_and_flipped_with_the_frame():
+    view = FakeView(region=(4, 0, 8, 4))
+    view.params.update({'blank face': True, 'flipped': True})
+    chain = make_chain(view, (8, 6))
+    out = chain(gradient(12, 16), 1.0)
+    # The region at the top of the full-size frame is at the bottom of the flipped, half-size view
+    assert not out[4:6, 2:6].any()
+    assert out[:4, :].all()
+
+
+def test_turning_pause_off_forgets_paused_frame():
+    view = FakeView()
+    view.params['pause video'] = True
+    chain = make_chain(view, (8, 6))
+    first = gradient(6, 8)
+    assert np.array_equal(chain(first, 1.0), first)
+    # New frames are ignored while paused
+    assert np.array_equal(chain(first // 2, 2.0), first)
+    view.params['pause video'] = False
+    chain(first, 3.0)
+    assert view.params['*pause frame'] is None
+
+
+def test_turning_loop_rec_off_keeps_loop_for_playback():
+    view = FakeView()
+    chain = make_chain(view, (8, 6))
+    chain.compile(tuple(view.params[m] for m in VIDEO_MANIPS))
+    view.params['loop rec'] = True
+    chain.compile(tuple(view.params[m] for m in VIDEO_MANIPS))
+    assert chain.side_steps
+    view.params['loop rec'] = False
+    chain.compile(tuple(view.params[m] for m in VIDEO_MANIPS))
+    assert chain.loop_params['has_loop']
+    assert not chain.side_steps
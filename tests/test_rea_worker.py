@@ -0,0 +1,62 @@
+import threading
+import pytest
+from ReaWorker import ReaWorker
+
+
+def blocked_worker() -> tuple:
+    # The first command holds up the worker, so everything queued after it waits until the gate is opened
+    worker, gate = ReaWorker(), threading.Event()
+    worker.submit('gate', gate.wait)
+    return worker, gate
+
+
+def test_commands_are_sent_in_order():
+    worker, gate = blocked_worker()
+    sent = []
+    futures = [worker.submit(name, sent.append, name) for name in ('mute', 'set delay', 'play')]
+    gate.set()
+    for future in futures:
+        future.result(timeout=1)
+    assert sent == ['mute', 'set delay', 'play']
+
+
+def test_only_newest_of_repeated_command_is_sent():
+    worker, gate = blocked_worker()
+    sent = []
+    first = worker.submit('set delay', sent.append, 100)
+    worker.submit('mute', sent.append, 'mute')
+    second = worker.submit('set delay', sent.append, 200)
+    gate.set()
+    second.result(timeout=1)
+    # The newer command goes to the back of the queue, so it still runs after everything queued before it
+    assert sent == ['mute', 200]
+    assert worker.coalesced == 1
+    # Whoever was waiting on the replaced command gets the result of the newer one
+    assert first.done()
+
+
+def test_commands_that_mustnt_coalesce_are_all_sent():
+    worker, gate = blocked_worker()
+    sent = []
+    futures = [worker.submit('record', sent.append, n, coalesce=False) for n in range(3)]
+    gate.set()
+    for future in futures:
+        future.result(timeout=1)
+    assert sent == [0, 1, 2]
+    assert worker.coalesced == 0
+
+
+def test_call_waits_for_result():
+    worker = ReaWorker()
+    assert worker.call('add', lambda a, b: a + b, 1, 2, timeout=1) == 3
+    assert 'add' in worker.stats()['commands']
+
+
+def test_failed_command_raises_for_caller_and_worker_carries_on():
+    worker = ReaWorker()
+
+    def fail():
+        raise ConnectionError('Reaper is not responding')
+    with pytest.raises(ConnectionError):
+        worker.call('fail', fail, timeout=1)
+    assert worker.call('echo', lambda: 'ok', timeout=1) == 'ok'